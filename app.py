@@ -2,47 +2,159 @@
 """
 JollyLLBot - Legal Document Analysis AI Webapp/WhatsApp Bot
 Main Flask application entry point
+
+``create_app`` builds the Flask app and its services; importing this module
+builds the default ``app``. SDKs and format-specific extractors load on first
+use, so importing is cheap (see ``gunicorn.conf.py`` for the preload mode).
 """
 
-import os
+import json
+import time
 import logging
-from flask import Flask, request, render_template, flash, redirect, url_for, jsonify
+from contextlib import ExitStack, nullcontext
+from flask import Flask, Response, g, request, stream_with_context, render_template, flash, redirect, url_for, jsonify
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
 from src.document_analyzer import DocumentAnalyzer
-from src.whatsapp_bot import WhatsAppBot
+from src.whatsapp_bot import InvalidSignatureError, WhatsAppBot
+from src.batch_analyzer import BatchAnalyzer
+from src.document_source import DocumentSource
+from src.health import DISABLED, UP, HealthChecker
+from src.job_queue import JobQueue, QueueFullError
+from src.metrics import CONTENT_TYPE, ERRORS, IN_FLIGHT_REQUESTS, REGISTRY, REQUEST_SECONDS
+from src.scheduler import API, BATCH, INTERACTIVE, AnalysisScheduler, Overloaded
+from src.settings import Settings, configure, get_settings
+from src.structured_logging import (
+    REQUEST_ID_HEADER, bind_correlation, current_correlation_id, reset_correlation, stage_timings
+)
 from src.utils import allowed_file, setup_logging
 
-# Load environment variables
-load_dotenv()
-
-# Setup logging
-setup_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
-app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_FILE_SIZE_MB', 10)) * 1024 * 1024
+# Services of the most recently created app, used by the views below
+document_analyzer: DocumentAnalyzer = None
+whatsapp_bot: WhatsAppBot = None
+job_queue: JobQueue = None
+batch_analyzer: BatchAnalyzer = None
+health_checker: HealthChecker = None
+scheduler: AnalysisScheduler = None
+
+# (rule, view, options) of every view, added to each app built by create_app
+ROUTES = []
+
+
+def route(rule, **options):
+    """Record a view for create_app to register; the endpoint is the function name"""
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+def _check_openai():
+    """OpenAI readiness: a cheap authenticated API call"""
+    if document_analyzer.client is None:
+        return DISABLED
+    document_analyzer.client.ping()
+    return UP
+
+
+def _check_twilio():
+    """Twilio readiness: fetch the configured account"""
+    if whatsapp_bot.client is None:
+        return DISABLED
+    whatsapp_bot.ping()
+    return UP
+
+
+def _check_job_queue():
+    """Async analysis readiness: the queue can take more work"""
+    stats = job_queue.stats()
+    if stats['pending'] >= stats['max_depth']:
+        raise RuntimeError(f"Job queue is full ({stats['pending']} pending)")
+    return UP
+
+
+def start_request_timer():
+    """Start end-to-end timing for the request and correlate its logs (reusing the caller's X-Request-ID)"""
+    g.request_started = time.perf_counter()
+    g.correlation = bind_correlation(request.headers.get(REQUEST_ID_HEADER))
+    IN_FLIGHT_REQUESTS.inc()
+
+
+def record_request_time(response):
+    """Record end-to-end request time by endpoint and status"""
+    started = g.get('request_started')
+    if started is not None:
+        REQUEST_SECONDS.labels(endpoint=request.endpoint or 'unknown', method=request.method,
+                               status=response.status_code).observe(time.perf_counter() - started)
+    response.headers[REQUEST_ID_HEADER] = current_correlation_id() or ''
+    g.response_status = response.status_code
+    return response
+
+
+def finish_request(error=None):
+    """Drop the request from the in-flight gauge and log its stage timings (after any streamed body)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        IN_FLIGHT_REQUESTS.dec()
+        logger.info("%s %s %s in %.1f ms", request.method, request.path, g.get('response_status', 500),
+                    (time.perf_counter() - started) * 1000, extra={'stages': stage_timings(), 'sample': True})
+    if error is not None:
+        ERRORS.labels(stage='request').inc()
+    token = g.pop('correlation', None)
+    if token is not None:
+        reset_correlation(token)
+
+
+def client_id() -> str:
+    """Caller identity for per-client rate limits (the proxy must set the real address, e.g. via ProxyFix)"""
+    return request.remote_addr or 'anonymous'
+
+
+def scheduled(traffic_class: str):
+    """Admit the current request and wait for an analysis slot; raises Overloaded
+    
+    Returns the slot (a context manager), or a no-op one when scheduling is disabled.
+    """
+    if scheduler is None:
+        return nullcontext()
+    scheduler.admit(traffic_class, client_id())
+    return scheduler.acquire(traffic_class)
+
+
+def overloaded_body(error: Overloaded) -> dict:
+    """JSON body of a 429/503 response; shared with the ASGI app"""
+    if error.status == 429:
+        message = 'Too many requests, please retry later'
+    else:
+        message = 'Server is busy, please retry later'
+    return {'error': message, 'retry_after': int(error.retry_after_header)}
+
 
-# Initialize services
-document_analyzer = DocumentAnalyzer()
-whatsapp_bot = WhatsAppBot()
+def overloaded_response(error: Overloaded):
+    """Fast 429/503 JSON response telling the client when to retry"""
+    response = jsonify(overloaded_body(error))
+    response.headers['Retry-After'] = error.retry_after_header
+    return response, error.status
 
-# Create upload directory
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+def _run_queued(func, *args):
+    """Job body for queued analyses: waits as long as needed for a batch slot"""
+    if scheduler is None:
+        return func(*args)
+    with scheduler.acquire(BATCH, timeout=None):
+        return func(*args)
 
-@app.route('/')
+
+@route('/')
 def index():
     """Main page with document upload form"""
     return render_template('index.html')
 
 
-@app.route('/upload', methods=['POST'])
+@route('/upload', methods=['POST'])
 def upload_file():
     """Handle document upload and analysis"""
     try:
@@ -57,14 +169,10 @@ def upload_file():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Analyze document
-            analysis_result = document_analyzer.analyze_document(filepath)
             
-            # Clean up uploaded file
-            os.remove(filepath)
+            # Analyze document straight from the upload stream
+            with scheduled(INTERACTIVE):
+                analysis_result = document_analyzer.analyze_document(file.stream, filename)
             
             return render_template('result.html', 
                                  filename=filename, 
@@ -73,62 +181,316 @@ def upload_file():
             flash('Invalid file type. Please upload PDF, DOCX, or TXT files.')
             return redirect(request.url)
             
+    except Overloaded as e:
+        flash('We are analyzing a lot of documents right now. Please try again in a moment.')
+        return render_template('index.html'), e.status, {'Retry-After': e.retry_after_header}
     except Exception as e:
-        logger.error(f"Error processing upload: {str(e)}")
+        logger.error("Error processing upload: %s", e)
         flash('An error occurred while processing your document.')
         return redirect(url_for('index'))
 
 
-@app.route('/api/analyze', methods=['POST'])
+def validate_upload(files):
+    """Return (file, secure filename, None) for an analysis upload, or (None, None, error message)
+    
+    Shared with the ASGI app so both serving modes accept the same uploads.
+    """
+    if 'file' not in files:
+        return None, None, 'No file provided'
+    
+    file = files['file']
+    if not allowed_file(file.filename):
+        return None, None, 'Invalid file type'
+    
+    return file, secure_filename(file.filename), None
+
+
+def wants_async_job(values) -> bool:
+    """Whether an analysis request asked to be queued as a background job"""
+    return values.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+@route('/api/analyze', methods=['POST'])
 def api_analyze():
     """API endpoint for document analysis"""
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
-        
-        file = request.files['file']
-        if not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file type'}), 400
-        
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        file, filename, error = validate_upload(request.files)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Analyze document
-        analysis_result = document_analyzer.analyze_document(filepath)
+        if wants_async_job(request.values):
+            return _enqueue_analysis(file, filename)
         
-        # Clean up uploaded file
-        os.remove(filepath)
+        # Analyze document straight from the upload stream
+        with scheduled(API):
+            analysis_result = document_analyzer.analyze_document(file.stream, filename)
         
         return jsonify({
             'filename': filename,
             'analysis': analysis_result
         })
         
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
-        logger.error(f"API error: {str(e)}")
+        logger.error("API error: %s", e)
         return jsonify({'error': 'Analysis failed'}), 500
 
 
-@app.route('/webhook/whatsapp', methods=['POST'])
+@route('/api/analyze/stream', methods=['POST'])
+def api_analyze_stream():
+    """Stream analysis progress as Server-Sent Events"""
+    file, filename, error = validate_upload(request.files)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    slot = ExitStack()
+    try:
+        slot.enter_context(scheduled(INTERACTIVE))
+    except Overloaded as e:
+        return overloaded_response(e)
+    try:
+        document = DocumentSource.from_stream(file.stream, filename)
+    except Exception:
+        slot.close()
+        raise
+    
+    def generate():
+        try:
+            for event, data in document_analyzer.stream_analysis(document):
+                if event == 'complete':
+                    data = {'filename': filename, 'analysis': data}
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            document.close()
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Held until the stream ends, even when the client disconnects before it starts
+    response.call_on_close(slot.close)
+    return response
+
+
+@route('/api/analyze/batch', methods=['POST'])
+def api_analyze_batch():
+    """Analyze several files or a ZIP archive, streaming NDJSON results as each finishes"""
+    uploads = request.files.getlist('files') + request.files.getlist('file')
+    if not uploads:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    if scheduler is not None:
+        try:
+            scheduler.admit(BATCH, client_id())
+        except Overloaded as e:
+            return overloaded_response(e)
+    
+    def generate():
+        for line in batch_analyzer.iter_results(batch_analyzer.iter_items(uploads)):
+            yield json.dumps(line) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _enqueue_analysis(file, filename):
+    """Capture the upload before the request ends and analyze it on the job queue"""
+    if scheduler is not None:
+        try:
+            scheduler.admit(BATCH, client_id())
+        except Overloaded as e:
+            return overloaded_response(e)
+    document = DocumentSource.from_stream(file.stream, filename)
+    
+    try:
+        job = job_queue.submit(_run_queued, document_analyzer.analyze_document, document,
+                               metadata={'filename': filename}, cleanup=document.close)
+    except QueueFullError as e:
+        document.close()
+        logger.warning("Rejecting async analysis: %s", e)
+        response = jsonify({'error': 'Too many pending analyses, please retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    
+    response = jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('api_job_status', job_id=job.id)
+    })
+    response.headers['Location'] = url_for('api_job_status', job_id=job.id)
+    return response, 202
+
+
+@route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """Status and result of an asynchronous analysis job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+def retrieve_clauses(doc_hash, payload):
+    """Validate a document question and find its most relevant clauses
+    
+    Returns (response fields without the answer, excerpts in document order, None),
+    or (None, None, (error message, status)). Shared with the ASGI app.
+    """
+    if document_analyzer.clause_store is None:
+        return None, None, ('Document questions are disabled', 404)
+    
+    question = (payload.get('question') or '').strip()
+    if not question:
+        return None, None, ('No question provided', 400)
+    
+    try:
+        top_k = min(max(int(payload.get('k', 5)), 1), 20)
+    except (TypeError, ValueError):
+        return None, None, ('k must be an integer', 400)
+    
+    try:
+        index = document_analyzer.clause_store.get(doc_hash.lower())
+    except ValueError:
+        return None, None, ('Invalid document id', 400)
+    if index is None:
+        return None, None, ('Document not found; analyze it first', 404)
+    
+    started = time.perf_counter()
+    matches = index.search(question, top_k)
+    retrieval_ms = (time.perf_counter() - started) * 1000
+    clauses = [{'index': clause_id, 'score': score, 'text': index.clause(clause_id)}
+               for clause_id, score in matches]
+    excerpts = [clause['text'] for clause in sorted(clauses, key=lambda clause: clause['index'])]
+    
+    return {
+        'document_id': doc_hash.lower(),
+        'question': question,
+        'clauses': clauses,
+        'context_chars': sum(len(excerpt) for excerpt in excerpts),
+        'retrieval_ms': round(retrieval_ms, 2)
+    }, excerpts, None
+
+
+@route('/api/documents/<doc_hash>/ask', methods=['POST'])
+def api_document_ask(doc_hash):
+    """Answer a question about an analyzed document from its most relevant clauses"""
+    fields, excerpts, error = retrieve_clauses(doc_hash, request.get_json(silent=True) or request.values)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    
+    try:
+        with scheduled(API):
+            fields['answer'] = document_analyzer.answer_question(fields['question'], excerpts)
+    except Overloaded as e:
+        return overloaded_response(e)
+    return jsonify(fields)
+
+
+@route('/webhook/whatsapp', methods=['POST'])
 def whatsapp_webhook():
     """WhatsApp webhook endpoint"""
     try:
         return whatsapp_bot.handle_message(request)
+    except InvalidSignatureError:
+        logger.warning("Rejected unsigned WhatsApp webhook call from %s", request.remote_addr)
+        return "Forbidden", 403
     except Exception as e:
-        logger.error(f"WhatsApp webhook error: {str(e)}")
+        logger.error("WhatsApp webhook error: %s", e)
         return "OK", 200
 
 
-@app.route('/health')
+@route('/api/routing')
+def routing_report():
+    """Per-route analysis count, p50/p95 latency and model spend since startup"""
+    router = document_analyzer.router
+    if router is None:
+        return jsonify({'enabled': False})
+    return jsonify({
+        'enabled': True,
+        'table': [{'name': entry.name, 'model': router.tiers[entry.tier].model if entry.tier else None,
+                   'max_output_tokens': entry.max_output_tokens, 'template': entry.template}
+                   for entry in router.routes],
+        **router.log.summary()
+    })
+
+
+@route('/health')
 def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'service': 'JollyLLBot'})
+    """Health check endpoint reporting dependency readiness; 503 when a required dependency is down"""
+    report, ready = health_checker.report()
+    report['service'] = 'JollyLLBot'
+    return jsonify(report), 200 if ready else 503
+
+
+@route('/metrics')
+def metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+def create_app(settings: Settings = None) -> Flask:
+    """Build the Flask app and its services
+    
+    Settings are read from the environment (and .env) unless given. Services are
+    created here rather than at import time, so a gunicorn master can preload the
+    code and each forked worker builds its own threads, pools and connections.
+    """
+    global document_analyzer, whatsapp_bot, job_queue, batch_analyzer, health_checker, scheduler
+    
+    if settings is None:
+        load_dotenv()
+        settings = get_settings()
+    else:
+        configure(settings)
+    setup_logging(settings.log_level)
+    
+    flask_app = Flask(__name__)
+    flask_app.config['SECRET_KEY'] = settings.secret_key
+    flask_app.config['MAX_CONTENT_LENGTH'] = settings.max_file_size_bytes
+    
+    scheduler = AnalysisScheduler.from_env()
+    document_analyzer = DocumentAnalyzer()
+    whatsapp_bot = WhatsAppBot(analyzer=document_analyzer, scheduler=scheduler)
+    job_queue = JobQueue.from_env()
+    batch_analyzer = BatchAnalyzer.from_env(document_analyzer, scheduler)
+    health_checker = HealthChecker.from_env()
+    
+    health_checker.register('openai', _check_openai)
+    health_checker.register('twilio', _check_twilio)
+    health_checker.register('job_queue', _check_job_queue, required=True)
+    
+    REGISTRY.register_callback('jollybot_job_queue_pending', 'Async analysis jobs queued or running',
+                               lambda: job_queue.stats()['pending'])
+    REGISTRY.register_callback('jollybot_whatsapp_pending_messages', 'WhatsApp messages waiting to be handled',
+                               lambda: whatsapp_bot.dispatcher.stats()['pending'])
+    REGISTRY.register_callback('jollybot_llm_retries_total', 'Model call retries after transient failures',
+                               lambda: document_analyzer.client.metrics.snapshot()['retries']
+                               if document_analyzer.client else 0, kind='counter')
+    REGISTRY.register_callback('jollybot_scheduler_in_flight', 'Analyses holding a scheduler slot',
+                               lambda: scheduler.stats()['in_flight'] if scheduler else 0)
+    REGISTRY.register_callback('jollybot_scheduler_queue_depth', 'Analyses waiting for a slot by traffic class',
+                               lambda: {(name,): data['queued'] for name, data in scheduler.stats()['classes'].items()}
+                               if scheduler else {}, labelnames=['traffic_class'])
+    REGISTRY.register_callback('jollybot_scheduler_oldest_wait_seconds',
+                               'Wait so far of the oldest queued analysis by traffic class',
+                               lambda: {(name,): data['oldest_wait_seconds']
+                                        for name, data in scheduler.stats()['classes'].items()}
+                               if scheduler else {}, labelnames=['traffic_class'])
+    
+    flask_app.before_request(start_request_timer)
+    flask_app.after_request(record_request_time)
+    flask_app.teardown_request(finish_request)
+    for rule, view, options in ROUTES:
+        flask_app.add_url_rule(rule, view_func=view, **options)
+    
+    return flask_app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
-    port = int(os.getenv('PORT', 5000))
-    debug = os.getenv('FLASK_ENV') == 'development'
+    settings = get_settings()
     
-    logger.info(f"Starting JollyLLBot on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
+    logger.info("Starting JollyLLBot on port %s", settings.port)
+    app.run(host='0.0.0.0', port=settings.port, debug=settings.debug)
\ No newline at end of file
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+JollyLLBot - ASGI entry point
+Serves the Flask app's hot endpoints natively on asyncio and everything else through the WSGI app
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from werkzeug.wrappers import Request
+
+import app as webapp
+from src.document_source import get_spool_threshold
+from src.metrics import CONTENT_TYPE, ERRORS, IN_FLIGHT_REQUESTS, REGISTRY, REQUEST_SECONDS
+from src.scheduler import API, Overloaded
+from src.structured_logging import REQUEST_ID_HEADER, correlation, stage_timings
+from src.whatsapp_bot import SIGNATURE_HEADER, InvalidSignatureError
+
+logger = logging.getLogger(__name__)
+
+JSON_TYPE = 'application/json'
+TWIML_TYPE = 'text/html; charset=utf-8'
+
+
+class AsgiApp:
+    """ASGI application sharing app.py's services and request handling
+
+    ``POST /api/analyze``, ``POST /api/documents/<id>/ask``, ``POST /webhook/whatsapp``,
+    ``/health`` and ``/metrics`` run on the event loop: model and Twilio calls are
+    awaited and text extraction runs in a process pool, so one process can hold
+    hundreds of analyses waiting on the model. Other routes (web pages, streaming,
+    batch and job endpoints) are passed to the Flask app on a thread pool.
+    """
+
+    def __init__(self, wsgi_app, extraction_processes: int = None, wsgi_threads: int = 16):
+        """Initialize; pools are created at startup"""
+        self.wsgi_app = wsgi_app
+        self.extraction_processes = extraction_processes if extraction_processes is not None else os.cpu_count()
+        self.wsgi_threads = wsgi_threads
+        self.max_body_bytes = wsgi_app.config.get('MAX_CONTENT_LENGTH')
+        self._wsgi_pool = None
+        self._process_pool = None
+        self._routes = [
+            ('POST', '/api/analyze', 'api_analyze', self.api_analyze),
+            ('POST', '/webhook/whatsapp', 'whatsapp_webhook', self.whatsapp_webhook),
+            ('GET', '/health', 'health_check', self.health_check),
+            ('GET', '/metrics', 'metrics', self.metrics)
+        ]
+
+    @classmethod
+    def from_env(cls, wsgi_app) -> 'AsgiApp':
+        """Build from ASGI_* environment variables"""
+        processes = os.getenv('ASGI_EXTRACTION_PROCESSES')
+        return cls(
+            wsgi_app,
+            extraction_processes=int(processes) if processes else None,
+            wsgi_threads=int(os.getenv('ASGI_WSGI_THREADS', 16))
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        self.startup()
+
+        handler, endpoint, args = self._match(scope['method'], scope['path'])
+        if handler is None:
+            await self._call_wsgi(scope, await self._read_body(receive), send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        request_id = self._header(scope, REQUEST_ID_HEADER)
+        with IN_FLIGHT_REQUESTS.track_inprogress(), correlation(request_id) as request_id:
+            try:
+                body = await self._read_body(receive)
+                headers = ()
+                if self.max_body_bytes and self._size(body) > self.max_body_bytes:
+                    status, content_type, payload = 413, JSON_TYPE, {'error': 'File too large'}
+                else:
+                    request = Request(self._environ(scope, body))
+                    result = await handler(request, *args)
+                    if result is None:
+                        # Handled by the Flask app instead (e.g. queued jobs), under the same request id
+                        await self._call_wsgi(scope, body, send, request_id)
+                        return
+                    status, content_type, payload, *extra = result
+                    headers = extra[0] if extra else ()
+                await self._respond(send, status, content_type, payload,
+                                    [*headers, (b'x-request-id', request_id.encode('latin-1'))])
+            except Exception as e:
+                ERRORS.labels(stage='request').inc()
+                logger.error("ASGI request error: %s", e)
+                await self._respond(send, 500, JSON_TYPE, {'error': 'Internal server error'})
+            finally:
+                elapsed = time.perf_counter() - started
+                REQUEST_SECONDS.labels(endpoint=endpoint, method=scope['method'], status=status).observe(elapsed)
+                logger.info("%s %s %s in %.1f ms", scope['method'], scope['path'], status, elapsed * 1000,
+                            extra={'stages': stage_timings(), 'sample': True})
+
+    def _match(self, method: str, path: str):
+        """Native handler, endpoint name and path arguments for a request, or (None, None, None)"""
+        for route_method, route_path, endpoint, handler in self._routes:
+            if method == route_method and path == route_path:
+                return handler, endpoint, ()
+        parts = path.strip('/').split('/')
+        if method == 'POST' and len(parts) == 4 and parts[:2] == ['api', 'documents'] and parts[3] == 'ask':
+            return self.api_document_ask, 'api_document_ask', (parts[2],)
+        return None, None, None
+
+    async def api_analyze(self, request: Request):
+        """Async counterpart of app.api_analyze"""
+        files = await asyncio.get_running_loop().run_in_executor(self._wsgi_pool, lambda: request.files)
+        try:
+            file, filename, error = webapp.validate_upload(files)
+            if error:
+                return 400, JSON_TYPE, {'error': error}
+            if webapp.wants_async_job(request.values):
+                return None
+
+            with await self._scheduled(API, request):
+                analysis_result = await webapp.document_analyzer.analyze_document_async(file.stream, filename)
+            return 200, JSON_TYPE, {'filename': filename, 'analysis': analysis_result}
+
+        except Overloaded as e:
+            return self._overloaded(e)
+        except Exception as e:
+            logger.error("API error: %s", e)
+            return 500, JSON_TYPE, {'error': 'Analysis failed'}
+
+    async def api_document_ask(self, request: Request, doc_hash: str):
+        """Async counterpart of app.api_document_ask"""
+        fields, excerpts, error = webapp.retrieve_clauses(doc_hash, request.get_json(silent=True) or request.values)
+        if error:
+            return error[1], JSON_TYPE, {'error': error[0]}
+
+        try:
+            with await self._scheduled(API, request):
+                fields['answer'] = await webapp.document_analyzer.answer_question_async(fields['question'], excerpts)
+        except Overloaded as e:
+            return self._overloaded(e)
+        return 200, JSON_TYPE, fields
+
+    async def _scheduled(self, traffic_class: str, request: Request):
+        """Async counterpart of app.scheduled: admit the request and await an analysis slot"""
+        scheduler = webapp.scheduler
+        if scheduler is None:
+            return nullcontext()
+        scheduler.admit(traffic_class, request.remote_addr or 'anonymous')
+        return await scheduler.acquire_async(traffic_class)
+
+    @staticmethod
+    def _overloaded(error: Overloaded):
+        """429/503 response with Retry-After"""
+        return (error.status, JSON_TYPE, webapp.overloaded_body(error),
+                [(b'retry-after', error.retry_after_header.encode('latin-1'))])
+
+    async def whatsapp_webhook(self, request: Request):
+        """Async counterpart of app.whatsapp_webhook"""
+        try:
+            return 200, TWIML_TYPE, await webapp.whatsapp_bot.handle_message_async(
+                request.form, request.url, request.headers.get(SIGNATURE_HEADER))
+        except InvalidSignatureError:
+            logger.warning("Rejected unsigned WhatsApp webhook call from %s", request.remote_addr)
+            return 403, TWIML_TYPE, "Forbidden"
+        except Exception as e:
+            logger.error("WhatsApp webhook error: %s", e)
+            return 200, TWIML_TYPE, "OK"
+
+    async def health_check(self, request: Request):
+        """Async counterpart of app.health_check; probes run in a thread"""
+        report, ready = await asyncio.get_running_loop().run_in_executor(
+            self._wsgi_pool, webapp.health_checker.report)
+        report['service'] = 'JollyLLBot'
+        return 200 if ready else 503, JSON_TYPE, report
+
+    async def metrics(self, request: Request):
+        """Prometheus metrics"""
+        return 200, CONTENT_TYPE, REGISTRY.render()
+
+    def startup(self):
+        """Create the WSGI thread pool and extraction process pool (idempotent)"""
+        if self._wsgi_pool is not None:
+            return
+        self._wsgi_pool = ThreadPoolExecutor(max_workers=self.wsgi_threads, thread_name_prefix='jollybot-wsgi')
+        if self.extraction_processes:
+            # Spawned rather than forked: the server process already runs threads
+            self._process_pool = ProcessPoolExecutor(max_workers=self.extraction_processes,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            webapp.document_analyzer.process_pool = self._process_pool
+        logger.info("ASGI mode started with %s extraction processes", self.extraction_processes or 0)
+
+    async def shutdown(self):
+        """Finish background WhatsApp work and release pools and connections"""
+        await webapp.whatsapp_bot.shutdown_async()
+        if webapp.document_analyzer.async_client is not None:
+            await webapp.document_analyzer.async_client.aclose()
+        if self._process_pool is not None:
+            webapp.document_analyzer.process_pool = None
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        if self._wsgi_pool is not None:
+            self._wsgi_pool.shutdown(wait=False)
+            self._wsgi_pool = None
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        """Request body, spooled to disk above UPLOAD_SPOOL_THRESHOLD_KB"""
+        body = tempfile.SpooledTemporaryFile(max_size=get_spool_threshold())
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+            if self.max_body_bytes and body.tell() > self.max_body_bytes:
+                break
+        body.seek(0)
+        return body
+
+    @staticmethod
+    def _header(scope, name: str) -> str:
+        """First value of a request header, or None"""
+        wanted = name.lower().encode('latin-1')
+        for key, value in scope.get('headers', []):
+            if key.lower() == wanted:
+                return value.decode('latin-1')
+        return None
+
+    @staticmethod
+    def _size(body) -> int:
+        """Length of a spooled body, leaving it positioned at the start"""
+        body.seek(0, os.SEEK_END)
+        size = body.tell()
+        body.seek(0)
+        return size
+
+    def _environ(self, scope, body) -> dict:
+        """WSGI environ for an ASGI HTTP scope"""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        length = self._size(body)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(length),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f"HTTP_{name}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _respond(self, send, status: int, content_type: str, payload, headers=()):
+        if not isinstance(payload, (str, bytes)):
+            payload = json.dumps(payload)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', content_type.encode('latin-1')),
+                        (b'content-length', str(len(payload)).encode('latin-1'))] + list(headers)
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def _call_wsgi(self, scope, body, send, request_id: str = None):
+        """Run the Flask app on the thread pool, forwarding its response (streamed bodies included)"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        environ = self._environ(scope, body)
+        if request_id:
+            environ['HTTP_X_REQUEST_ID'] = request_id
+
+        def emit(*item):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        def start_response(status, headers, exc_info=None):
+            emit('start', status, headers)
+            return lambda data: emit('body', data)
+
+        def run():
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            emit('body', chunk)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            except Exception as e:
+                emit('error', e)
+            finally:
+                body.close()
+                emit('end')
+
+        worker = loop.run_in_executor(self._wsgi_pool, run)
+        started = False
+        while True:
+            kind, *item = await queue.get()
+            if kind == 'start':
+                status, headers = item
+                await send({
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+                })
+                started = True
+            elif kind == 'body':
+                await send({'type': 'http.response.body', 'body': bytes(item[0]), 'more_body': True})
+            elif kind == 'error':
+                logger.error("WSGI app error: %s", item[0])
+                if not started:
+                    await self._respond(send, 500, JSON_TYPE, {'error': 'Internal server error'})
+                    await worker
+                    return
+            else:
+                break
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        await worker
+
+
+application = AsgiApp.from_env(webapp.app)
@@ -0,0 +1,4 @@
+"""
+Benchmarks Package
+Reproducible performance benchmarks for extraction, parsing and end-to-end analysis
+"""
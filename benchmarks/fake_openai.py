@@ -0,0 +1,95 @@
+"""
+Fake OpenAI Module
+Local chat completions server with configurable latency for benchmarking without network calls
+"""
+
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fixtures import synthetic_responses
+
+
+class FakeOpenAIServer:
+    """Answers /v1/chat/completions after ``latency_ms`` (plus up to ``jitter_ms``) with a fixed reply"""
+
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 0, content: str = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        """Start serving in a background thread"""
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.content = content if content is not None else synthetic_responses()['json_small']
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(3)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._send({'object': 'list', 'data': [
+                    {'id': 'gpt-3.5-turbo', 'object': 'model', 'created': 0, 'owned_by': 'benchmark'}
+                ]})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                with server._lock:
+                    server.requests += 1
+                    jitter = server._random.uniform(0, server.jitter_ms)
+                time.sleep((server.latency_ms + jitter) / 1000)
+                prompt_tokens = sum(len(message.get('content', '')) for message in body.get('messages', [])) // 4
+                completion_tokens = len(server.content) // 4
+                self._send({
+                    'id': 'chatcmpl-benchmark', 'object': 'chat.completion', 'created': int(time.time()),
+                    'model': body.get('model', 'gpt-3.5-turbo'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': server.content}}],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                              'total_tokens': prompt_tokens + completion_tokens}
+                })
+
+            def _send(self, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://{host}:{self._server.server_address[1]}/v1"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeOpenAIServer':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve a fake OpenAI chat completions API')
+    parser.add_argument('--port', type=int, default=8011)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    args = parser.parse_args()
+    fake = FakeOpenAIServer(args.latency_ms, args.jitter_ms, port=args.port)
+    print(f"Fake OpenAI API at {fake.base_url} (set OPENAI_BASE_URL to use it)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.close()
@@ -0,0 +1,149 @@
+"""
+Benchmark Fixtures Module
+Deterministic generated corpora: legal-style PDF, DOCX and TXT documents and synthetic model replies
+"""
+
+import os
+import json
+import random
+from typing import Dict, List
+
+from docx import Document
+
+# Pages per document size; TXT and DOCX get the same amount of text as the PDF
+SIZES = {'small': 2, 'medium': 30, 'huge': 300}
+FORMATS = ('pdf', 'docx', 'txt')
+LINES_PER_PAGE = 45
+
+HEADINGS = ['Definitions', 'Term', 'Payment', 'Confidentiality', 'Termination', 'Indemnification',
+            'Limitation of Liability', 'Governing Law', 'Assignment', 'Notices', 'Warranties',
+            'Intellectual Property', 'Force Majeure', 'Dispute Resolution', 'Severability']
+SUBJECTS = ['The Employer', 'The Contractor', 'Either party', 'The Licensee', 'The Tenant', 'The Company',
+            'The Service Provider', 'The Client']
+VERBS = ['shall pay', 'shall indemnify', 'may terminate', 'shall not disclose', 'shall maintain',
+         'shall deliver', 'may assign', 'shall notify']
+OBJECTS = ['all fees due under this Agreement', 'any Confidential Information', 'the Services',
+           'the premises', 'written notice of thirty (30) days', 'the Deliverables',
+           'any losses arising from a breach', 'insurance with a reputable insurer']
+QUALIFIERS = ['within fifteen (15) days of the invoice date', 'subject to Section 9',
+              'unless otherwise agreed in writing', 'in accordance with applicable law',
+              'during the Term and for two years after', 'at its sole discretion', '']
+
+
+def legal_lines(pages: int, seed: int = 7) -> List[str]:
+    """Lines of numbered clauses, ``LINES_PER_PAGE`` per page, the same for a given seed"""
+    rng = random.Random(seed)
+    lines = ['MASTER SERVICES AGREEMENT', 'This Agreement is entered into between the parties below.']
+    section = 0
+    while len(lines) < pages * LINES_PER_PAGE:
+        section += 1
+        lines.append(f"{section}. {HEADINGS[(section - 1) % len(HEADINGS)].upper()}")
+        for clause in range(1, rng.randint(3, 7)):
+            sentence = f"{section}.{clause} {rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)}"
+            qualifier = rng.choice(QUALIFIERS)
+            lines.append(f"{sentence} {qualifier}.".replace(' .', '.'))
+    return lines[:pages * LINES_PER_PAGE]
+
+
+def _pdf_string(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_pdf(lines: List[str]) -> bytes:
+    """Minimal text PDF with ``LINES_PER_PAGE`` lines per page"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    kids = []
+    for start in range(0, len(lines), LINES_PER_PAGE):
+        page = lines[start:start + LINES_PER_PAGE]
+        content = ' T* '.join(f"({_pdf_string(line)}) Tj" for line in page)
+        stream = f"BT /F1 9 Tf 12 TL 40 760 Td {content} ET".encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def build_docx(lines: List[str], path: str):
+    """DOCX with numbered headings as heading paragraphs and a fee schedule table"""
+    document = Document()
+    for line in lines:
+        if line.split('. ', 1)[-1].isupper():
+            document.add_heading(line, level=2)
+        else:
+            document.add_paragraph(line)
+    table = document.add_table(rows=1, cols=3)
+    for cell, title in zip(table.rows[0].cells, ('Milestone', 'Due', 'Fee')):
+        cell.text = title
+    for month in range(1, 13):
+        cells = table.add_row().cells
+        cells[0].text, cells[1].text, cells[2].text = f"Phase {month}", f"Month {month}", f"${month * 1000}"
+    document.save(path)
+
+
+def synthetic_responses() -> Dict[str, str]:
+    """Model replies in the shapes the parser sees: JSON, fenced JSON and sectioned text"""
+    rng = random.Random(11)
+
+    def bullets(count: int) -> List[str]:
+        return [f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)}" for _ in range(count)]
+
+    responses = {}
+    for size, count in (('small', 3), ('large', 40)):
+        fields = {
+            'summary': ' '.join(bullets(count // 2 + 1)),
+            'document_type': 'Service Agreement',
+            'key_points': bullets(count),
+            'risks_concerns': bullets(count),
+            'recommendations': bullets(count)
+        }
+        responses[f"json_{size}"] = json.dumps(fields)
+        responses[f"fenced_json_{size}"] = f"```json\n{json.dumps(fields, indent=2)}\n```"
+        responses[f"sections_{size}"] = '\n'.join(
+            [f"## 1. Summary\n{fields['summary']}", f"**Document Type:** {fields['document_type']}", "KEY POINTS:"]
+            + [f"- {point}" for point in fields['key_points']]
+            + ["RISKS & CONCERNS:"] + [f"{i}. {risk}" for i, risk in enumerate(fields['risks_concerns'], 1)]
+            + ["Recommendations:"] + [f"* {item}" for item in fields['recommendations']]
+        )
+    return responses
+
+
+def generate_corpus(directory: str, sizes=None) -> Dict[str, str]:
+    """Write fixture documents into ``directory`` (reusing existing files) and return {name: path}
+
+    Names are ``<size>.<format>``, e.g. ``medium.pdf``.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for size in sizes or SIZES:
+        lines = legal_lines(SIZES[size])
+        for file_format in FORMATS:
+            name = f"{size}.{file_format}"
+            path = os.path.join(directory, name)
+            paths[name] = path
+            if os.path.exists(path):
+                continue
+            if file_format == 'pdf':
+                with open(path, 'wb') as out:
+                    out.write(build_pdf(lines))
+            elif file_format == 'docx':
+                build_docx(lines, path)
+            else:
+                with open(path, 'w', encoding='utf-8') as out:
+                    out.write('\n'.join(lines))
+    return paths
@@ -0,0 +1,366 @@
+"""
+Benchmark Runner Module
+Measures latency percentiles, throughput and peak RSS per pipeline stage and compares against a baseline
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.15
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Any, List
+
+from benchmarks.fixtures import SIZES, generate_corpus, synthetic_responses
+
+STAGES = ('extraction', 'parsing', 'analysis', 'http', 'startup')
+
+# Metrics where a larger value is a regression; throughput is the other way round
+LOWER_IS_BETTER = ('p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb', 'rss_mb', 'private_mb', 'all_ready_ms')
+HIGHER_IS_BETTER = ('throughput_per_s', 'mb_per_s')
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Linearly interpolated percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, Any]:
+    """Latency percentiles (ms) and throughput for one benchmark case"""
+    ordered = sorted(latencies)
+    return {
+        'iterations': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'throughput_per_s': round(len(ordered) / elapsed, 3) if elapsed else 0.0
+    }
+
+
+def measure(func: Callable[[], Any], iterations: int, warmup: int = 1) -> Dict[str, Any]:
+    """Time ``iterations`` sequential calls after ``warmup`` untimed ones"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _iterations_for(size: str, iterations: int) -> int:
+    return max(2, iterations // {'small': 1, 'medium': 5, 'huge': 20}[size])
+
+
+def _quiet_logging():
+    # Claims the root logger first so the app's setup_logging does not log every call to stderr and disk
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+
+def bench_extraction(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Text extraction per fixture document"""
+    _quiet_logging()
+    from src.document_analyzer import DocumentAnalyzer
+
+    analyzer = DocumentAnalyzer()
+    results = {}
+    for name, path in sorted(config['fixtures'].items()):
+        with open(path, 'rb') as file:
+            data = file.read()
+        summary = measure(lambda: analyzer.extract_text(data, name),
+                          _iterations_for(name.split('.')[0], config['iterations']))
+        seconds = summary['mean_ms'] / 1000
+        summary['mb_per_s'] = round(len(data) / 1024 / 1024 / seconds, 3) if seconds else 0.0
+        summary['bytes'] = len(data)
+        results[name] = summary
+    return results
+
+
+def bench_parsing(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Model reply parsing per synthetic response shape"""
+    _quiet_logging()
+    from src.response_parser import parse_analysis_response
+
+    return {name: measure(lambda: parse_analysis_response(text), config['iterations'] * 50)
+            for name, text in sorted(synthetic_responses().items())}
+
+
+def _benchmark_env(config: Dict[str, Any], base_url: str):
+    """Point the app at the fake model server with caching off so every run does the work"""
+    os.environ.update({
+        'OPENAI_API_KEY': 'benchmark',
+        'OPENAI_BASE_URL': base_url,
+        'OPENAI_RPM': '',
+        'OPENAI_TPM': '',
+        'ANALYSIS_CACHE_SIZE': '0',
+        'ANALYSIS_CACHE_DB': '',
+        # Load comes from one client; per-client rate limits would reject most of it
+        'SCHEDULER_CLIENT_RPM': 'interactive=0,whatsapp=0,api=0,batch=0',
+        'CLAUSE_INDEX_DIR': tempfile.mkdtemp(prefix='jollybot-bench-')
+    })
+
+
+def bench_analysis(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Full extraction and analysis per fixture against the fake model server"""
+    _quiet_logging()
+    from benchmarks.fake_openai import FakeOpenAIServer
+
+    with FakeOpenAIServer(config['latency_ms'], config['jitter_ms']) as fake:
+        _benchmark_env(config, fake.base_url)
+        from src.document_analyzer import DocumentAnalyzer
+
+        analyzer = DocumentAnalyzer()
+        results = {}
+        for name, path in sorted(config['fixtures'].items()):
+            with open(path, 'rb') as file:
+                data = file.read()
+            before = fake.requests
+            logged = len(analyzer.router.log.entries()) if analyzer.router else 0
+            summary = measure(lambda: analyzer.analyze_document(data, name),
+                              _iterations_for(name.split('.')[0], config['iterations'] // 4))
+            summary['model_calls_per_document'] = round((fake.requests - before) / (summary['iterations'] + 1), 2)
+            if analyzer.router:
+                entries = analyzer.router.log.entries()[logged:]
+                summary['route'] = entries[-1]['route']
+                summary['cost_usd_per_document'] = round(sum(entry['cost_usd'] for entry in entries) / len(entries), 6)
+            results[name] = summary
+        return results
+
+
+def bench_http(config: Dict[str, Any]) -> Dict[str, Any]:
+    """/api/analyze under concurrent load through a real threaded HTTP server"""
+    _quiet_logging()
+    import requests
+    from werkzeug.serving import make_server
+    from benchmarks.fake_openai import FakeOpenAIServer
+
+    with FakeOpenAIServer(config['latency_ms'], config['jitter_ms']) as fake:
+        _benchmark_env(config, fake.base_url)
+        import app as webapp
+
+        server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/api/analyze"
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=config['concurrency']))
+
+        results = {}
+        try:
+            for name in ('small.pdf', 'medium.pdf', 'medium.docx'):
+                if name not in config['fixtures']:
+                    continue
+                with open(config['fixtures'][name], 'rb') as file:
+                    data = file.read()
+
+                def post(_):
+                    started = time.perf_counter()
+                    response = session.post(url, files={'file': (name, data)}, timeout=120)
+                    return time.perf_counter() - started, response.status_code
+
+                post(None)
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=config['concurrency']) as pool:
+                    outcomes = list(pool.map(post, range(config['requests'])))
+                summary = summarize([latency for latency, _ in outcomes], time.perf_counter() - started)
+                summary['concurrency'] = config['concurrency']
+                summary['errors'] = sum(1 for _, status in outcomes if status != 200)
+                results[name] = summary
+        finally:
+            server.shutdown()
+        return results
+
+
+def bench_startup(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Cold app import, and forked workers with and without preloading, each in a fresh interpreter"""
+    from benchmarks.startup import run_child
+
+    cold = [run_child(['cold']) for _ in range(max(3, config['iterations'] // 4))]
+    summary = summarize([report['import_ms'] / 1000 for report in cold],
+                        sum(report['process_ms'] for report in cold) / 1000)
+    summary['process_p50_ms'] = round(percentile(sorted(report['process_ms'] for report in cold), 0.5), 1)
+    summary['rss_mb'] = max(report['rss_mb'] for report in cold)
+    summary['lazy_modules_loaded'] = sorted({name for report in cold for name in report['lazy_modules_loaded']})
+    results = {'cold_import': summary}
+
+    workers = min(4, os.cpu_count() or 1)
+    document = config['fixtures'].get('small.pdf')
+    for preload in (False, True):
+        report = run_child(['workers', '--workers', str(workers)] + (['--document', document] if document else [])
+                           + (['--preload'] if preload else []))
+        summary = summarize([worker['ready_ms'] / 1000 for worker in report['workers']],
+                            report['all_ready_ms'] / 1000)
+        summary.update({
+            'workers': len(report['workers']),
+            'all_ready_ms': report['all_ready_ms'],
+            'master_preload_ms': report['master_preload_ms'],
+            'rss_mb': max(worker['rss_mb'] for worker in report['workers'])
+        })
+        private = [worker['private_mb'] for worker in report['workers'] if worker['private_mb'] is not None]
+        if private:
+            summary['private_mb'] = max(private)
+        results['workers_preload' if preload else 'workers'] = summary
+    return results
+
+
+BENCHMARKS = {
+    'extraction': bench_extraction,
+    'parsing': bench_parsing,
+    'analysis': bench_analysis,
+    'http': bench_http,
+    'startup': bench_startup
+}
+
+
+def _run_stage(stage: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    results = BENCHMARKS[stage](config)
+    rss = peak_rss_mb()
+    for summary in results.values():
+        summary['peak_rss_mb'] = rss
+    return results
+
+
+def run_stage(stage: str, config: Dict[str, Any], isolate: bool = True) -> Dict[str, Any]:
+    """Run one stage, by default in a fresh process so its peak RSS is its own"""
+    if not isolate:
+        return _run_stage(stage, config)
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(_run_stage, stage, config).result()
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.15) -> List[Dict[str, Any]]:
+    """Metrics that got worse than the baseline by more than ``tolerance`` (a fraction)"""
+    regressions = []
+    for stage, cases in results['results'].items():
+        for case, summary in cases.items():
+            previous = baseline.get('results', {}).get(stage, {}).get(case)
+            if not previous:
+                continue
+            for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+                if metric not in summary or not previous.get(metric):
+                    continue
+                change = (summary[metric] - previous[metric]) / previous[metric]
+                if metric in HIGHER_IS_BETTER:
+                    change = -change
+                if change > tolerance:
+                    regressions.append({
+                        'stage': stage, 'case': case, 'metric': metric,
+                        'baseline': previous[metric], 'current': summary[metric],
+                        'change_pct': round(change * 100, 1)
+                    })
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def run(stages=STAGES, sizes=None, fixtures_dir: str = None, iterations: int = 20, latency_ms: float = 200,
+        jitter_ms: float = 0, concurrency: int = 8, requests: int = 40, isolate: bool = True) -> Dict[str, Any]:
+    """Run the selected stages and return the results document"""
+    fixtures_dir = fixtures_dir or os.path.join(tempfile.gettempdir(), 'jollybot-bench-fixtures')
+    config = {
+        'fixtures': generate_corpus(fixtures_dir, sizes),
+        'iterations': iterations,
+        'latency_ms': latency_ms,
+        'jitter_ms': jitter_ms,
+        'concurrency': concurrency,
+        'requests': requests
+    }
+    results = {}
+    for stage in stages:
+        started = time.perf_counter()
+        results[stage] = run_stage(stage, config, isolate)
+        print(f"{stage}: {len(results[stage])} cases in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': {key: value for key, value in config.items() if key != 'fixtures'}
+        },
+        'results': results
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Run the JollyLLBot benchmark suite')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma-separated stages: ' + ', '.join(STAGES))
+    parser.add_argument('--sizes', default=','.join(SIZES), help='Comma-separated fixture sizes')
+    parser.add_argument('--fixtures-dir', help='Where generated fixtures are kept between runs')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed iterations for small fixtures')
+    parser.add_argument('--latency-ms', type=float, default=200, help='Fake model server latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Extra random latency up to this much')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients for the http stage')
+    parser.add_argument('--requests', type=int, default=40, help='Requests per document in the http stage')
+    parser.add_argument('--no-isolate', action='store_true', help='Run stages in this process (shared RSS)')
+    parser.add_argument('--output', help='Write results JSON here instead of stdout')
+    parser.add_argument('--baseline', help='Results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed regression as a fraction')
+    parser.add_argument('--save-baseline', help='Also write the results here as the new baseline')
+    args = parser.parse_args(argv)
+
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    results = run(stages, [size for size in args.sizes.split(',') if size], args.fixtures_dir, args.iterations,
+                  args.latency_ms, args.jitter_ms, args.concurrency, args.requests, not args.no_isolate)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as file:
+            results['regressions'] = compare(results, json.load(file), args.tolerance)
+        for regression in results['regressions']:
+            print(f"REGRESSION {regression['stage']}/{regression['case']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} ({regression['change_pct']:+}%)",
+                  file=sys.stderr)
+        status = 1 if results['regressions'] else 0
+
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(payload)
+    else:
+        print(payload)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            file.write(payload)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
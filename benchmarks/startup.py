@@ -0,0 +1,161 @@
+"""
+Startup Benchmark Module
+Cold import time and per-worker memory of forked app workers, with and without preloading
+
+Each measurement runs in a fresh interpreter so nothing is already imported:
+    python -m benchmarks.startup cold
+    python -m benchmarks.startup workers --workers 4 --preload --document small.pdf
+prints one JSON object.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+# Modules that load on first use rather than when the app is imported
+LAZY_MODULES = ('openai', 'httpx', 'twilio', 'aiohttp', 'PyPDF2', 'docx')
+
+
+def memory_mb() -> Dict[str, float]:
+    """Resident and private (unshared) memory of this process in MB; private is None off Linux"""
+    rss = private = None
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+        with open('/proc/self/smaps_rollup') as file:
+            private = sum(int(line.split()[1]) for line in file
+                          if line.startswith(('Private_Clean:', 'Private_Dirty:'))) / 1024
+    except OSError:
+        pass
+    if rss is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return {'rss_mb': round(rss, 1), 'private_mb': round(private, 1) if private is not None else None}
+
+
+def startup_env() -> Dict[str, str]:
+    """Environment for the measured interpreters: credentials set so SDK clients are built, nothing on disk"""
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'benchmark',
+        'OPENAI_BASE_URL': 'http://127.0.0.1:9/v1',
+        'TWILIO_ACCOUNT_SID': 'ACbenchmark',
+        'TWILIO_AUTH_TOKEN': 'benchmark',
+        'ANALYSIS_CACHE_DB': '',
+        'CLAUSE_INDEX_DIR': tempfile.mkdtemp(prefix='jollybot-startup-'),
+        'PYTHONPATH': os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    })
+    return env
+
+
+def _quiet_logging():
+    # Claims the root logger first so the app's setup_logging does not write to stderr and disk
+    logging.basicConfig(level=logging.ERROR)
+
+
+def cold_start() -> Dict[str, Any]:
+    """Import the app in this (fresh) interpreter"""
+    _quiet_logging()
+    started = time.perf_counter()
+    import app  # noqa: F401
+    import_ms = (time.perf_counter() - started) * 1000
+    result = {'import_ms': round(import_ms, 1), 'lazy_modules_loaded': [
+        name for name in LAZY_MODULES if name in sys.modules]}
+    result.update(memory_mb())
+    return result
+
+
+def _worker(document: str) -> Dict[str, Any]:
+    """Body of a forked worker: create the app and serve a first analysis-like workload"""
+    started = time.perf_counter()
+    import app as webapp
+
+    # First use of the lazily loaded pieces a worker needs for its first requests
+    if document:
+        webapp.document_analyzer.extract_text(document, os.path.basename(document))
+    if webapp.document_analyzer.client is not None:
+        webapp.document_analyzer.client._client
+    webapp.whatsapp_bot.client
+    webapp.whatsapp_bot._twiml()
+
+    result = {'ready_ms': round((time.perf_counter() - started) * 1000, 1)}
+    result.update(memory_mb())
+    return result
+
+
+def forked_workers(workers: int, preload: bool, document: str = None) -> Dict[str, Any]:
+    """Fork ``workers`` workers the way a pre-fork server does and collect their startup cost"""
+    _quiet_logging()
+    started = time.perf_counter()
+    if preload:
+        from src.preload import preload_modules
+        preload_modules()
+    master_ms = (time.perf_counter() - started) * 1000
+
+    children = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                payload = json.dumps(_worker(document)).encode('utf-8')
+                os.write(write_fd, payload)
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    reports = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd, 'rb') as pipe:
+            data = pipe.read()
+        os.waitpid(pid, 0)
+        if data:
+            reports.append(json.loads(data))
+
+    return {
+        'preload': preload,
+        'master_preload_ms': round(master_ms, 1),
+        'all_ready_ms': round((time.perf_counter() - started) * 1000, 1),
+        'workers': reports
+    }
+
+
+def run_child(args: List[str]) -> Dict[str, Any]:
+    """Run this module in a fresh interpreter and return its JSON report, plus its wall time"""
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-m', 'benchmarks.startup'] + args, env=startup_env(),
+                               capture_output=True, text=True, check=True)
+    report = json.loads(completed.stdout)
+    report['process_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measure JollyLLBot startup in this interpreter')
+    parser.add_argument('mode', choices=('cold', 'workers'))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--preload', action='store_true')
+    parser.add_argument('--document', help='Document each worker extracts as its first request')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'cold':
+        report = cold_start()
+    else:
+        report = forked_workers(args.workers, args.preload, args.document)
+    print(json.dumps(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+JollyLLBot - Gunicorn configuration
+Picked up automatically by ``gunicorn app:app`` from the project directory
+
+With GUNICORN_PRELOAD enabled the master imports the application code and SDKs
+once before forking (``src/preload.py``), so workers start without re-importing
+them and share those pages copy-on-write. The app itself is still created in each
+worker: ``preload_app`` stays off because the services start threads and open
+connections and database handles that must not be shared across a fork.
+
+Async job status must be visible to every worker, since a poll can land on any
+of them. With more than one worker and neither JOB_DB nor ANALYSIS_CACHE_DB set,
+the master points JOB_DB at a private temporary SQLite file the workers inherit.
+"""
+
+import os
+import shutil
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Analyses wait on the model; the default 30 seconds would kill long ones
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+_job_dir = None
+if workers > 1 and not (os.getenv('JOB_DB') or os.getenv('ANALYSIS_CACHE_DB')):
+    _job_dir = tempfile.mkdtemp(prefix='jollybot-jobs-')
+    os.environ['JOB_DB'] = os.path.join(_job_dir, 'jobs.db')
+
+
+def on_starting(server):
+    """Preload shared modules in the master before any worker is forked"""
+    if preload:
+        from src.preload import preload_modules
+        timings = preload_modules()
+        server.log.info("Preloaded %s modules in %.2fs", len(timings), sum(timings.values()))
+
+
+def on_exit(server):
+    """Remove the temporary job table created for this server"""
+    if _job_dir:
+        shutil.rmtree(_job_dir, ignore_errors=True)
@@ -0,0 +1,171 @@
+"""
+Analysis Cache Module
+Content-addressed cache for legal analysis results
+"""
+
+import os
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return ' '.join(text.split())
+
+
+def make_cache_key(file_bytes: bytes, text: str, model: str, prompt_version: str) -> str:
+    """Build a content-addressed key from the upload, its text and the analysis settings"""
+    digest = hashlib.sha256()
+    for part in (hashlib.sha256(file_bytes).hexdigest(), normalize_text(text), model, prompt_version):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Two-tier (in-memory LRU + optional SQLite) cache of analysis results"""
+
+    def __init__(self, max_entries: int = 256, db_path: Optional[str] = None,
+                 ttl_seconds: float = 86400, max_disk_bytes: int = 100 * 1024 * 1024):
+        """Initialize the cache tiers"""
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expired': 0
+        }
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS analysis_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache (accessed)')
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> 'AnalysisCache':
+        """Build a cache from ANALYSIS_CACHE_* environment variables"""
+        return cls(
+            max_entries=int(os.getenv('ANALYSIS_CACHE_SIZE', 256)),
+            db_path=os.getenv('ANALYSIS_CACHE_DB') or None,
+            ttl_seconds=float(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', 86400)),
+            max_disk_bytes=int(os.getenv('ANALYSIS_CACHE_MAX_DISK_MB', 100)) * 1024 * 1024
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached result, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return copy.deepcopy(value)
+                del self._memory[key]
+                self._stats['expired'] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, created FROM analysis_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    if now - row[1] <= self.ttl_seconds:
+                        self._db.execute('UPDATE analysis_cache SET accessed = ? WHERE key = ?', (now, key))
+                        self._db.commit()
+                        value = json.loads(row[0])
+                        self._remember(key, row[1], value)
+                        self._stats['disk_hits'] += 1
+                        return copy.deepcopy(value)
+                    self._db.execute('DELETE FROM analysis_cache WHERE key = ?', (key,))
+                    self._db.commit()
+                    self._stats['expired'] += 1
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Store a result in both tiers"""
+        now = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._remember(key, now, value)
+            self._stats['sets'] += 1
+
+            if self._db is not None:
+                payload = json.dumps(value)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO analysis_cache (key, value, size, created, accessed) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, payload, len(payload), now, now)
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def clear(self):
+        """Drop every cached entry"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM analysis_cache')
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+            stats['memory_entries'] = len(self._memory)
+            if self._db is not None:
+                count, size = self._db.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache'
+                ).fetchone()
+                stats['disk_entries'] = count
+                stats['disk_bytes'] = size
+        return stats
+
+    def _remember(self, key: str, created: float, value: Dict[str, Any]):
+        """Insert into the memory tier, evicting least recently used entries"""
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _evict_disk(self, now: float):
+        """Drop expired rows, then least recently accessed rows until under the size limit"""
+        cursor = self._db.execute('DELETE FROM analysis_cache WHERE created < ?', (now - self.ttl_seconds,))
+        self._stats['expired'] += cursor.rowcount
+
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM analysis_cache').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        for key, size in self._db.execute(
+                'SELECT key, size FROM analysis_cache ORDER BY accessed ASC').fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute('DELETE FROM analysis_cache WHERE key = ?', (key,))
+            total -= size
+            self._stats['evictions'] += 1
@@ -0,0 +1,192 @@
+"""
+Batch Analysis Module
+Fans multi-document uploads and ZIP archives out over a bounded worker pool
+"""
+
+import os
+import time
+import hashlib
+import logging
+import zipfile
+import contextvars
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, BinaryIO, Iterable, Iterator
+
+from src.document_source import DocumentSource
+from src.scheduler import BATCH
+from src.settings import get_settings
+from src.utils import allowed_file
+
+logger = logging.getLogger(__name__)
+
+# One entry of a batch: a document to analyze, or a file skipped with a reason
+BatchItem = namedtuple('BatchItem', ['filename', 'document', 'error'])
+
+
+def iter_zip_items(stream: BinaryIO, max_files: int, max_member_bytes: int) -> Iterator[BatchItem]:
+    """Yield archive members one at a time without extracting the archive to disk
+
+    Members are read into memory, never spooled: each is at most
+    ``max_member_bytes`` and iter_results keeps only a few in flight.
+    """
+    with zipfile.ZipFile(stream) as archive:
+        members = [info for info in archive.infolist()
+                   if not info.is_dir() and not info.filename.startswith('__MACOSX/')]
+        for count, info in enumerate(members):
+            if count >= max_files:
+                yield BatchItem(info.filename, None, f'Batch limit of {max_files} files reached')
+                continue
+            if not allowed_file(info.filename):
+                yield BatchItem(info.filename, None, 'Invalid file type')
+                continue
+            if info.file_size > max_member_bytes:
+                yield BatchItem(info.filename, None, 'File too large')
+                continue
+            with archive.open(info) as member:
+                # The size in the archive header is not trusted
+                data = member.read(max_member_bytes + 1)
+            if len(data) > max_member_bytes:
+                yield BatchItem(info.filename, None, 'File too large')
+                continue
+            yield BatchItem(info.filename, DocumentSource.from_bytes(data, info.filename), None)
+
+
+class BatchAnalyzer:
+    """Analyzes many documents concurrently, deduplicating identical files"""
+
+    def __init__(self, analyzer, max_workers: int = 4, max_files: int = 500,
+                 max_member_bytes: int = 10 * 1024 * 1024, scheduler=None):
+        """Initialize with a DocumentAnalyzer and concurrency limits
+
+        With a ``scheduler`` each document waits for a slot in the batch traffic
+        class, so large batches yield to interactive work.
+        """
+        self.analyzer = analyzer
+        self.scheduler = scheduler
+        self.max_workers = max_workers
+        self.max_files = max_files
+        self.max_member_bytes = max_member_bytes
+
+    @classmethod
+    def from_env(cls, analyzer, scheduler=None) -> 'BatchAnalyzer':
+        """Build a batch analyzer from BATCH_* environment variables"""
+        return cls(
+            analyzer,
+            max_workers=int(os.getenv('BATCH_MAX_CONCURRENCY', 4)),
+            max_files=int(os.getenv('BATCH_MAX_FILES', 500)),
+            max_member_bytes=get_settings().max_file_size_bytes,
+            scheduler=scheduler
+        )
+
+    def iter_items(self, uploads: Iterable) -> Iterator[BatchItem]:
+        """Expand uploaded files (FileStorage-like objects) and ZIP archives into batch items"""
+        for upload in uploads:
+            filename = os.path.basename(upload.filename or '')
+            if filename.lower().endswith('.zip'):
+                try:
+                    yield from iter_zip_items(upload.stream, self.max_files, self.max_member_bytes)
+                except zipfile.BadZipFile:
+                    yield BatchItem(filename, None, 'Invalid ZIP archive')
+            elif allowed_file(filename):
+                yield BatchItem(filename, DocumentSource.from_stream(upload.stream, filename), None)
+            else:
+                yield BatchItem(filename, None, 'Invalid file type')
+
+    def iter_results(self, items: Iterable[BatchItem]) -> Iterator[Dict[str, Any]]:
+        """Yield one result per file as soon as it finishes, then an aggregate summary"""
+        started = time.perf_counter()
+        originals = {}
+        results = {}
+        waiting_duplicates = {}
+        in_flight = {}
+        counts = Counter()
+        document_types = Counter()
+
+        def finished(future) -> Iterator[Dict[str, Any]]:
+            filename, digest, document, submitted = in_flight.pop(future)
+            document.close()
+            analysis = future.result()
+            results[digest] = analysis
+            ok = analysis.get('success', False)
+            counts['analyzed' if ok else 'failed'] += 1
+            if ok:
+                document_types[analysis['analysis']['document_type']] += 1
+            yield self._line(filename, digest, analysis, elapsed_ms=(time.perf_counter() - submitted) * 1000)
+            for duplicate in waiting_duplicates.pop(digest, []):
+                yield self._line(duplicate, digest, analysis, duplicate_of=filename)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='jollybot-batch')
+        try:
+            for item in items:
+                counts['files'] += 1
+                if item.document is None:
+                    counts['skipped'] += 1
+                    yield {'filename': item.filename, 'status': 'skipped', 'error': item.error}
+                    continue
+
+                digest = hashlib.sha256(item.document.buffer).hexdigest()
+                original = originals.get(digest)
+                if original is not None:
+                    counts['duplicates'] += 1
+                    item.document.close()
+                    if digest in results:
+                        yield self._line(item.filename, digest, results[digest], duplicate_of=original)
+                    else:
+                        waiting_duplicates.setdefault(digest, []).append(item.filename)
+                    continue
+
+                future = executor.submit(contextvars.copy_context().run, self._analyze, item.document)
+                in_flight[future] = (item.filename, digest, item.document, time.perf_counter())
+                originals[digest] = item.filename
+
+                for future in [future for future in in_flight if future.done()]:
+                    yield from finished(future)
+
+                # Keep reading the upload only as fast as workers free up
+                while len(in_flight) >= self.max_workers * 2:
+                    done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from finished(future)
+
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from finished(future)
+        finally:
+            # Reached early when the client disconnects mid-batch
+            executor.shutdown(wait=True, cancel_futures=True)
+            for _, _, document, _ in in_flight.values():
+                document.close()
+
+        yield {'summary': {
+            'files': counts['files'],
+            'analyzed': counts['analyzed'],
+            'duplicates': counts['duplicates'],
+            'failed': counts['failed'],
+            'skipped': counts['skipped'],
+            'document_types': dict(document_types),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+        }}
+
+    def _analyze(self, document: DocumentSource) -> Dict[str, Any]:
+        """Analyze one document, waiting as long as it takes for a batch slot"""
+        if self.scheduler is None:
+            return self.analyzer.analyze_document(document)
+        with self.scheduler.acquire(BATCH, timeout=None):
+            return self.analyzer.analyze_document(document)
+
+    def _line(self, filename: str, digest: str, analysis: Dict[str, Any], duplicate_of: str = None,
+              elapsed_ms: float = None) -> Dict[str, Any]:
+        """Format one NDJSON result line"""
+        line = {
+            'filename': filename,
+            'sha256': digest,
+            'status': 'ok' if analysis.get('success') else 'error'
+        }
+        if duplicate_of is not None:
+            line['duplicate_of'] = duplicate_of
+        if elapsed_ms is not None:
+            line['elapsed_ms'] = round(elapsed_ms, 1)
+        line['analysis'] = analysis
+        return line
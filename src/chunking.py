@@ -0,0 +1,132 @@
+"""
+Chunking Module
+Splits long documents into token-budgeted chunks on clause/section boundaries
+"""
+
+import logging
+import re
+import threading
+from typing import Callable, List
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; token counts fall back to the character estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Rough average for English legal prose with the OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+# Lines that open a new section or clause: "Section 4", "ARTICLE II", "12.3 Term", "(a) ...", "WHEREAS"
+SECTION_START = re.compile(
+    r'^\s*(?:'
+    r'(?:section|article|clause|schedule|exhibit|appendix|annex)\s+[\w.]+'
+    r'|\d+(?:\.\d+)*[.)]?\s+\S'
+    r'|\([a-z0-9]{1,4}\)\s+\S'
+    r'|[A-Z][A-Z0-9 ,&\'-]{3,}$'
+    r'|whereas\b|now,? therefore\b'
+    r')',
+    re.IGNORECASE
+)
+SENTENCE_END = re.compile(r'(?<=[.;:])\s+')
+
+# Encoding used by the gpt-3.5/gpt-4 chat models
+TOKEN_ENCODING = 'cl100k_base'
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of model tokens in a piece of text"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _get_encoding():
+    """Load the tokenizer once; False when tiktoken is missing or its encoding cannot be loaded"""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    _encoding = tiktoken.get_encoding(TOKEN_ENCODING) if tiktoken else False
+                except Exception as e:
+                    logger.warning("Could not load the %s tokenizer: %s", TOKEN_ENCODING, e)
+                    _encoding = False
+                if _encoding is False:
+                    logger.warning("tiktoken unavailable; token counts are estimated at %s characters per token, "
+                                   "so chunk and prompt budgets are approximate", CHARS_PER_TOKEN)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Count model tokens with the local tokenizer, or estimate them when it is unavailable"""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def split_sections(text: str) -> List[str]:
+    """Split text into sections at headings, numbered clauses and blank lines"""
+    sections = []
+    current = []
+    for line in text.splitlines():
+        if not line.strip():
+            if current:
+                sections.append('\n'.join(current))
+                current = []
+            continue
+        if current and SECTION_START.match(line):
+            sections.append('\n'.join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append('\n'.join(current))
+    return sections
+
+
+def _split_oversized(section: str, max_tokens: int) -> List[str]:
+    """Break a section larger than the budget at sentence ends, then hard-wrap"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    pieces = []
+    current = ''
+    for sentence in SENTENCE_END.split(section):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text: str, max_tokens: int, count: Callable[[str], int] = estimate_tokens) -> List[str]:
+    """Pack whole sections into chunks of at most ``max_tokens`` tokens as measured by ``count``"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for section in split_sections(text):
+        section_tokens = count(section)
+        parts = [section] if section_tokens <= max_tokens else _split_oversized(section, max_tokens)
+        for part in parts:
+            part_tokens = count(part)
+            # +1 token for the blank line joining sections
+            if current and current_tokens + part_tokens + 1 > max_tokens:
+                chunks.append('\n\n'.join(current))
+                current = []
+                current_tokens = 0
+            current.append(part)
+            current_tokens += part_tokens + 1
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
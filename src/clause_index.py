@@ -0,0 +1,383 @@
+"""
+Clause Index Module
+BM25 retrieval over a document's clauses, persisted as memory-mapped files keyed by document hash
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import heapq
+import struct
+import logging
+import time
+import tempfile
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+from src.chunking import split_sections, split_into_chunks, estimate_tokens
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; scoring falls back to pure Python
+    np = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'JBCLAUS1'
+DOC_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# array typecode for 32-bit integers
+INT32 = 'i' if array('i').itemsize == 4 else 'l'
+
+WORD = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a about above after all also an and any are as at be been before being between both but by can could
+did do does doing for from had has have having he her here hers him his how i if in into is it its
+itself me more most my no nor not of on once only or other our ours out over own same she should so
+some such than that the their theirs them then there these they this those through to too under until
+up very was we were what when where which while who whom why will with would you your yours shall
+may must per whats what's tell please document contract agreement
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case content words of ``text`` without stopwords"""
+    return [word for word in WORD.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+def segment_clauses(text: str, max_tokens: int = 150, min_chars: int = 40) -> List[str]:
+    """Split text into clauses at headings and numbered provisions
+
+    Bare headings and other fragments shorter than ``min_chars`` are joined to
+    the clause that follows; clauses over ``max_tokens`` are split at sentences.
+    """
+    clauses = []
+    pending = ''
+    for section in split_sections(text):
+        section = f"{pending}\n{section}" if pending else section
+        if len(section) < min_chars:
+            pending = section
+            continue
+        pending = ''
+        if estimate_tokens(section) <= max_tokens:
+            clauses.append(section)
+        else:
+            clauses.extend(split_into_chunks(section, max_tokens))
+    if pending:
+        if clauses:
+            clauses[-1] = f"{clauses[-1]}\n{pending}"
+        else:
+            clauses.append(pending)
+    return clauses
+
+
+class ClauseIndex:
+    """Inverted index of clauses stored as flat int32 arrays (CSR postings)
+
+    ``term_offsets[t]:term_offsets[t + 1]`` slices ``posting_clauses`` and
+    ``posting_tf`` for term ``t``. The arrays are either in memory after
+    ``build`` or views over a memory-mapped file after ``load``.
+    """
+
+    def __init__(self, terms: List[str], term_offsets, posting_clauses, posting_tf, clause_lengths,
+                 text_offsets, text_blob, mapped: mmap.mmap = None):
+        """Initialize from index arrays; use build() or load()"""
+        self.vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        self.term_offsets = term_offsets
+        self.posting_clauses = posting_clauses
+        self.posting_tf = posting_tf
+        self.clause_lengths = clause_lengths
+        self.text_offsets = text_offsets
+        self.text_blob = text_blob
+        self._mapped = mapped
+
+        count = len(clause_lengths)
+        self.average_length = (sum(clause_lengths) / count) if count else 0.0
+        # Per-clause BM25 length normalization, computed once
+        self._norms = [K1 * (1 - B + B * length / self.average_length) if self.average_length else K1
+                       for length in clause_lengths]
+        if np is not None:
+            self._np_clauses = np.frombuffer(posting_clauses, dtype=np.int32)
+            self._np_tf = np.frombuffer(posting_tf, dtype=np.int32).astype(np.float32)
+            self._np_norms = np.asarray(self._norms, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.clause_lengths)
+
+    @classmethod
+    def build(cls, text: str, max_clause_tokens: int = 150) -> 'ClauseIndex':
+        """Segment ``text`` into clauses and index them"""
+        return cls.from_clauses(segment_clauses(text, max_clause_tokens))
+
+    @classmethod
+    def from_clauses(cls, clauses: List[str]) -> 'ClauseIndex':
+        """Index already segmented clauses"""
+        postings = {}
+        clause_lengths = array(INT32)
+        for clause_id, clause in enumerate(clauses):
+            words = tokenize(clause)
+            clause_lengths.append(len(words))
+            for term, count in Counter(words).items():
+                postings.setdefault(term, []).append((clause_id, count))
+
+        terms = sorted(postings)
+        term_offsets = array(INT32, [0])
+        posting_clauses = array(INT32)
+        posting_tf = array(INT32)
+        for term in terms:
+            for clause_id, count in postings[term]:
+                posting_clauses.append(clause_id)
+                posting_tf.append(count)
+            term_offsets.append(len(posting_clauses))
+
+        blob = bytearray()
+        text_offsets = array(INT32, [0])
+        for clause in clauses:
+            blob += clause.encode('utf-8')
+            text_offsets.append(len(blob))
+
+        return cls(terms, term_offsets, posting_clauses, posting_tf, clause_lengths, text_offsets, bytes(blob))
+
+    def clause(self, clause_id: int) -> str:
+        """Text of one clause"""
+        start, end = self.text_offsets[clause_id], self.text_offsets[clause_id + 1]
+        return bytes(self.text_blob[start:end]).decode('utf-8')
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Top ``k`` (clause id, BM25 score) pairs for the query, best first"""
+        count = len(self)
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        if not term_ids or not count:
+            return []
+
+        if np is not None:
+            scores = np.zeros(count, dtype=np.float32)
+            for term_id in term_ids:
+                start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+                clauses = self._np_clauses[start:end]
+                tf = self._np_tf[start:end]
+                idf = math.log(1 + (count - (end - start) + 0.5) / ((end - start) + 0.5))
+                # Each clause appears once per term, so fancy-index addition is safe
+                scores[clauses] += idf * tf * (K1 + 1) / (tf + self._np_norms[clauses])
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            ranked = sorted(((int(i), float(scores[i])) for i in top if scores[i] > 0),
+                            key=lambda item: item[1], reverse=True)
+            return [(clause_id, round(score, 4)) for clause_id, score in ranked]
+
+        scores = {}
+        for term_id in term_ids:
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            idf = math.log(1 + (count - (end - start) + 0.5) / ((end - start) + 0.5))
+            for position in range(start, end):
+                clause_id = self.posting_clauses[position]
+                tf = self.posting_tf[position]
+                scores[clause_id] = scores.get(clause_id, 0.0) + \
+                    idf * tf * (K1 + 1) / (tf + self._norms[clause_id])
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(clause_id, round(score, 4)) for clause_id, score in ranked]
+
+    def save(self, path: str):
+        """Write the index to ``path`` atomically
+
+        Layout: magic, header length, JSON header (vocabulary and array
+        lengths), then 8-byte aligned int32 arrays and the UTF-8 clause text.
+        """
+        arrays = [self.term_offsets, self.posting_clauses, self.posting_tf,
+                  self.clause_lengths, self.text_offsets]
+        header = json.dumps({
+            'byteorder': sys.byteorder,
+            'terms': sorted(self.vocabulary, key=self.vocabulary.get),
+            'lengths': [len(values) for values in arrays],
+            'text_bytes': len(self.text_blob)
+        }).encode('utf-8')
+
+        directory = os.path.dirname(path) or '.'
+        fd, temp_path = tempfile.mkstemp(prefix='.clauses-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(MAGIC + struct.pack('<I', len(header)) + header)
+                out.write(b'\0' * (-out.tell() % 8))
+                for values in arrays:
+                    out.write(values)
+                    out.write(b'\0' * (-out.tell() % 8))
+                out.write(self.text_blob)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> 'ClauseIndex':
+        """Memory-map an index written by save(); arrays are views, not copies"""
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise ValueError(f"Not a clause index: {path}")
+        header_length = struct.unpack_from('<I', mapped, len(MAGIC))[0]
+        start = len(MAGIC) + 4
+        header = json.loads(mapped[start:start + header_length].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            mapped.close()
+            raise ValueError(f"Clause index {path} was written on a {header['byteorder']}-endian machine")
+
+        view = memoryview(mapped)
+        position = start + header_length
+        arrays = []
+        for length in header['lengths']:
+            position += -position % 8
+            arrays.append(view[position:position + length * 4].cast(INT32))
+            position += length * 4
+        position += -position % 8
+        text_blob = view[position:position + header['text_bytes']]
+        return cls(header['terms'], *arrays, text_blob, mapped=mapped)
+
+
+class ClauseIndexStore:
+    """Clause indexes on disk, one file per document hash, with recently used ones kept open
+
+    Index files hold the document text, so the directory is private to the
+    service user and files are removed once unused for ``ttl_seconds`` or
+    when the directory grows past ``max_bytes`` (least recently used first).
+    """
+
+    def __init__(self, directory: str, max_open: int = 32, max_clause_tokens: int = 150,
+                 max_bytes: int = 256 * 1024 * 1024, ttl_seconds: float = 7 * 86400):
+        """Initialize, creating the index directory"""
+        self.directory = directory
+        self.max_open = max_open
+        self.max_clause_tokens = max_clause_tokens
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+
+    @classmethod
+    def from_env(cls) -> Optional['ClauseIndexStore']:
+        """Build a store from CLAUSE_INDEX_* environment variables, or None when disabled"""
+        if os.getenv('CLAUSE_INDEX_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+            return None
+        return cls(
+            os.getenv('CLAUSE_INDEX_DIR') or os.path.join(tempfile.gettempdir(), 'jollybot-clause-index'),
+            max_open=int(os.getenv('CLAUSE_INDEX_MAX_OPEN', 32)),
+            max_clause_tokens=int(os.getenv('CLAUSE_INDEX_CLAUSE_TOKENS', 150)),
+            max_bytes=int(float(os.getenv('CLAUSE_INDEX_MAX_MB', 256)) * 1024 * 1024),
+            ttl_seconds=float(os.getenv('CLAUSE_INDEX_TTL_SECONDS', 7 * 86400))
+        )
+
+    def path_for(self, doc_hash: str) -> str:
+        """File holding a document's index"""
+        if not DOC_HASH.match(doc_hash):
+            raise ValueError(f"Invalid document hash: {doc_hash!r}")
+        return os.path.join(self.directory, f"{doc_hash}.clauses")
+
+    def __contains__(self, doc_hash: str) -> bool:
+        return DOC_HASH.match(doc_hash) is not None and os.path.exists(self.path_for(doc_hash))
+
+    def ensure(self, doc_hash: str, text: str) -> bool:
+        """Index ``text`` under ``doc_hash`` unless an index already exists; True if it was built
+
+        An existing index counts as used again, so a re-analyzed document's
+        index is not expired before its follow-up questions are answered.
+        """
+        path = self.path_for(doc_hash)
+        try:
+            os.utime(path)
+            return False
+        except FileNotFoundError:
+            pass
+        self.rebuild(doc_hash, text)
+        return True
+
+    def rebuild(self, doc_hash: str, text: str):
+        """Index ``text`` under ``doc_hash``, replacing any existing index"""
+        index = ClauseIndex.build(text, self.max_clause_tokens)
+        index.save(self.path_for(doc_hash))
+        with self._lock:
+            # Searches already using the old mapping keep it until they finish
+            self._open.pop(doc_hash, None)
+        logger.info("Indexed %s clauses for document %s", len(index), doc_hash[:12], extra={'sample': True})
+        self.evict()
+
+    def get(self, doc_hash: str) -> Optional[ClauseIndex]:
+        """Open (memory-map) a document's index, or None if it has not been indexed"""
+        path = self.path_for(doc_hash)
+        with self._lock:
+            index = self._open.get(doc_hash)
+            if index is not None:
+                self._open.move_to_end(doc_hash)
+                return index
+        try:
+            modified = os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+        if time.time() - modified > self.ttl_seconds:
+            self._remove(doc_hash)
+            return None
+
+        index = ClauseIndex.load(path)
+        os.utime(path)
+        with self._lock:
+            self._open[doc_hash] = index
+            while len(self._open) > self.max_open:
+                # Dropped indexes are unmapped once no search is using them
+                self._open.popitem(last=False)
+        return index
+
+    def evict(self) -> int:
+        """Remove expired index files, then the least recently used ones past the size budget
+
+        Over budget, the directory is trimmed to three quarters of
+        ``max_bytes`` so eviction does not run on every new document.
+        Returns the number of files removed.
+        """
+        now = time.time()
+        entries, total, removed = [], 0, 0
+        for entry in os.scandir(self.directory):
+            doc_hash, ext = os.path.splitext(entry.name)
+            if ext != '.clauses' or not DOC_HASH.match(doc_hash):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                removed += self._remove(doc_hash)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, doc_hash))
+            total += stat.st_size
+
+        if total > self.max_bytes:
+            keep = self.max_bytes * 3 // 4
+            for _, size, doc_hash in sorted(entries):
+                if total <= keep:
+                    break
+                removed += self._remove(doc_hash)
+                total -= size
+        if removed:
+            logger.info("Evicted %s clause indexes", removed)
+        return removed
+
+    def _remove(self, doc_hash: str) -> int:
+        """Delete a document's index file and forget its mapping; 1 if a file was removed"""
+        with self._lock:
+            # An open mapping stays valid for searches already using it
+            self._open.pop(doc_hash, None)
+        try:
+            os.remove(self.path_for(doc_hash))
+        except FileNotFoundError:
+            return 0
+        return 1
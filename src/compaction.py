@@ -0,0 +1,165 @@
+"""
+Prompt Compaction Module
+Strips extraction artifacts and repeated content from document text before it is sent to the model
+"""
+
+import os
+import re
+import math
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from src.chunking import count_tokens, split_sections
+from src.extraction import PAGE_BREAK
+
+# Bare page numbers: "12", "- 12 -", "Page 12", "Page 12 of 40", "12/40"
+PAGE_NUMBER = re.compile(r'^[-–—\s]*(?:page\s*)?\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?[-–—\s]*$', re.IGNORECASE)
+# A word broken across lines by a hyphen: "termi-\nnation"
+LINE_HYPHEN = re.compile(r'(?<=[a-z])-\n(?=[a-z])')
+DIGITS = re.compile(r'\d+')
+# Longer lines are content, however often they repeat
+MAX_BOILERPLATE_CHARS = 120
+
+
+class CompactionReport:
+    """Compacted text plus counts of what was removed"""
+
+    def __init__(self, text: str, tokens_before: int, tokens_after: int, boilerplate_lines: int = 0,
+                 hyphenations: int = 0, duplicate_clauses: int = 0):
+        """Initialize the report"""
+        self.text = text
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.boilerplate_lines = boilerplate_lines
+        self.hyphenations = hyphenations
+        self.duplicate_clauses = duplicate_clauses
+
+    @property
+    def tokens_saved(self) -> int:
+        """Tokens no longer sent to the model"""
+        return self.tokens_before - self.tokens_after
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summary included with analysis results"""
+        return {
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'tokens_saved': self.tokens_saved,
+            'boilerplate_lines_removed': self.boilerplate_lines,
+            'hyphenations_joined': self.hyphenations,
+            'duplicate_clauses_removed': self.duplicate_clauses
+        }
+
+
+class PromptCompactor:
+    """Normalizes extracted text so each prompt carries as much of the document as possible
+
+    Steps, in order: drop headers, footers and page numbers repeated at the top or
+    bottom of pages (pages are separated by PAGE_BREAK), collapse whitespace, rejoin
+    words hyphenated across lines, and drop clauses that repeat earlier ones verbatim.
+    """
+
+    def __init__(self, boilerplate_min_pages: int = 3, boilerplate_page_ratio: float = 0.5,
+                 edge_lines: int = 2, dedupe_min_chars: int = 40, count: Callable[[str], int] = count_tokens):
+        """Initialize the compactor
+
+        A line among the first or last ``edge_lines`` of a page is boilerplate when
+        (after masking digits) the same line sits in the same position on at least
+        ``boilerplate_page_ratio`` of the pages of a document with
+        ``boilerplate_min_pages`` or more. Clauses shorter than
+        ``dedupe_min_chars`` (headings, "None.") are never treated as duplicates.
+        """
+        self.boilerplate_min_pages = boilerplate_min_pages
+        self.boilerplate_page_ratio = boilerplate_page_ratio
+        self.edge_lines = edge_lines
+        self.dedupe_min_chars = dedupe_min_chars
+        self.count = count
+
+    @classmethod
+    def from_env(cls) -> Optional['PromptCompactor']:
+        """Build a compactor from PROMPT_COMPACTION_* environment variables, or None when disabled"""
+        if os.getenv('PROMPT_COMPACTION_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+            return None
+        return cls(
+            boilerplate_min_pages=int(os.getenv('PROMPT_COMPACTION_MIN_PAGES', 3)),
+            boilerplate_page_ratio=float(os.getenv('PROMPT_COMPACTION_PAGE_RATIO', 0.5)),
+            dedupe_min_chars=int(os.getenv('PROMPT_COMPACTION_DEDUPE_MIN_CHARS', 40))
+        )
+
+    def compact(self, text: str) -> CompactionReport:
+        """Compact document text and report the tokens saved"""
+        tokens_before = self.count(text)
+        pages, boilerplate_lines = self._strip_boilerplate(text.split(PAGE_BREAK))
+        text = self._normalize_whitespace('\n'.join(pages))
+        text, hyphenations = LINE_HYPHEN.subn('', text)
+        text, duplicate_clauses = self._dedupe_clauses(text)
+        return CompactionReport(text, tokens_before, self.count(text), boilerplate_lines, hyphenations,
+                                duplicate_clauses)
+
+    def _strip_boilerplate(self, pages: List[str]):
+        """Remove repeated header/footer lines and page numbers from the edges of each page"""
+        page_lines = [page.splitlines() for page in pages]
+        edges = [self._edges(lines) for lines in page_lines]
+
+        repeated = set()
+        if len(pages) >= self.boilerplate_min_pages:
+            seen_on = Counter()
+            for lines, positions in zip(page_lines, edges):
+                seen_on.update({(position, self._line_key(lines[index])) for index, position in positions})
+            threshold = max(2, math.ceil(self.boilerplate_page_ratio * len(pages)))
+            repeated = {key for key, pages_seen in seen_on.items()
+                        if key[1] and len(key[1]) <= MAX_BOILERPLATE_CHARS and pages_seen >= threshold}
+
+        removed = 0
+        stripped = []
+        for lines, positions in zip(page_lines, edges):
+            drop = {index for index, position in positions
+                    if PAGE_NUMBER.match(lines[index]) or (position, self._line_key(lines[index])) in repeated}
+            removed += len(drop)
+            stripped.append('\n'.join(line for index, line in enumerate(lines) if index not in drop))
+        return stripped, removed
+
+    def _edges(self, lines: List[str]) -> List[tuple]:
+        """(line index, position) of the first and last few non-blank lines of a page
+
+        Positions count from the top (0, 1, ...) or the bottom (-1, -2, ...).
+        """
+        filled = [index for index, line in enumerate(lines) if line.strip()]
+        edges = dict(zip(filled[:self.edge_lines], range(self.edge_lines)))
+        for position, index in enumerate(reversed(filled[-self.edge_lines:]), 1):
+            edges.setdefault(index, -position)
+        return list(edges.items())
+
+    @staticmethod
+    def _line_key(line: str) -> str:
+        """Line compared across pages: lowercased, single-spaced, digits masked"""
+        return DIGITS.sub('#', ' '.join(line.split()).lower())
+
+    @staticmethod
+    def _normalize_whitespace(text: str) -> str:
+        """Single spaces within lines and at most one blank line between blocks"""
+        lines = []
+        for line in text.splitlines():
+            line = ' '.join(line.split())
+            if line or (lines and lines[-1]):
+                lines.append(line)
+        return '\n'.join(lines).strip()
+
+    def _dedupe_clauses(self, text: str):
+        """Drop sections that repeat an earlier section word for word, keeping paragraph breaks"""
+        blocks = []
+        seen = set()
+        removed = 0
+        for block in text.split('\n\n'):
+            kept = []
+            for section in split_sections(block):
+                key = section.lower()
+                if len(key) >= self.dedupe_min_chars:
+                    if key in seen:
+                        removed += 1
+                        continue
+                    seen.add(key)
+                kept.append(section)
+            if kept:
+                blocks.append('\n'.join(kept))
+        return '\n\n'.join(blocks), removed
@@ -4,223 +4,1076 @@ Handles document text extraction and AI-powered legal analysis
 """
 
 import os
+import time
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any
-import PyPDF2
-import docx
-from openai import OpenAI
+import contextvars
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import zip_longest
+from typing import Dict, Any, List, BinaryIO, Iterator, Tuple, Union
+
+from src.analysis_cache import AnalysisCache, make_cache_key
+from src.chunking import count_tokens, split_into_chunks
+from src.clause_index import ClauseIndexStore, segment_clauses
+from src.compaction import CompactionReport, PromptCompactor
+from src.document_classifier import DEFAULT_TYPE, DocumentClassifier, DocumentTypeScore
+from src.docx_extraction import extract_docx_text
+from src.document_source import DocumentSource, open_document
+from src.extraction import PAGE_BREAK, PdfExtractionEngine, pdf_page_count
+from src.llm_client import DEFAULT_MODEL, AsyncLLMClient, LLMClient
+from src.metrics import (
+    ANALYSIS_SECONDS, CACHE_REQUESTS, ERRORS, EXTRACTION_SECONDS, IN_FLIGHT_ANALYSES, MOCK_FALLBACKS,
+    NEAR_DUPLICATE_LOOKUPS, PARSE_SECONDS, PROMPT_TOKENS_SAVED, UPLOAD_SIZE
+)
+from src.model_router import TEMPLATES, ModelRouter, RoutingDecision
+from src.near_duplicate import NearDuplicateIndex
+from src.revision_index import ClauseDiff, RevisionIndex, diff_clauses
+from src.response_parser import (
+    MISSING_SUMMARY, SectionTokenizer, format_analysis, parse_json_response, parse_sections
+)
+from src.structured_logging import log_stage
 
 logger = logging.getLogger(__name__)
 
+# Bump whenever the prompt or response parsing changes so cached results are not reused
+PROMPT_VERSION = "6"
+
+# Result fields pushed to streaming clients as soon as the model finishes them
+STREAMED_SECTIONS = ('summary', 'key_points', 'risks_concerns', 'recommendations')
+
+# What the model should look at most closely for each detected document type
+TYPE_FOCUS = {
+    'Contract/Agreement': 'obligations of each party, payment terms, liability and termination',
+    'Lease Agreement': 'rent, term and renewal, deposits, maintenance duties and termination',
+    'Non-Disclosure Agreement': 'scope of confidential information, exclusions, duration and remedies',
+    'Will/Testament': 'bequests, executors, guardianship and execution formalities',
+    'Employment Document': 'compensation, duties, restrictive covenants and termination'
+}
+
+# Anything DocumentAnalyzer can read a document from
+DocumentInput = Union[str, bytes, bytearray, memoryview, BinaryIO, DocumentSource]
+
+EMPTY_DOCUMENT_ERROR = 'Document appears to be empty or text could not be extracted'
+
+# Stands in for the risks of fast-path results, which no model has looked at
+FAST_PATH_RISK_NOTE = ('Not reviewed by the model: this short document was summarized locally, '
+                       'so risks were not assessed. Have it reviewed before relying on it.')
+
+# Everything decided about a document before the model is asked: the compacted text,
+# its revision clauses and MinHash signature, an earlier analysis to reuse
+# ((base, diff, same_document) or None), the prompt chunks and the routing decision
+AnalysisPlan = namedtuple('AnalysisPlan', ['compaction', 'clauses', 'signature', 'revision', 'chunks', 'decision'])
+
+# PDF engine inside process pool workers: the pool already runs one worker per core,
+# so each extracts serially instead of opening a pool of its own (created lazily)
+_worker_pdf_engine = PdfExtractionEngine(max_workers=1)
+
+
+def extract_docx(document: DocumentSource) -> str:
+    """Extract text from a DOCX file: body (with tables), headers, footers and notes"""
+    with document.open() as stream:
+        return extract_docx_text(stream).strip()
+
+
+def extract_txt(document: DocumentSource) -> str:
+    """Extract text from a TXT file"""
+    text = str(document.buffer, 'utf-8')
+    return text.replace('\r\n', '\n').replace('\r', '\n').strip()
+
+
+def extract_document(document: DocumentSource, pdf_engine: PdfExtractionEngine, token_budget: int = None) -> str:
+    """Extract text based on file type, stopping PDFs at ``token_budget`` estimated tokens"""
+    file_extension = document.extension
+    if file_extension == 'pdf':
+        return pdf_engine.extract(document.location, token_budget=token_budget).text
+    elif file_extension == 'docx':
+        return extract_docx(document)
+    elif file_extension == 'txt':
+        return extract_txt(document)
+    else:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+
+
+def _extract_in_worker(location: Union[str, bytes], filename: str, token_budget: int = None) -> str:
+    """Extract text in a process pool worker (module level so it can be pickled)"""
+    with open_document(location, filename) as document:
+        return extract_document(document, _worker_pdf_engine, token_budget)
+
 
 class DocumentAnalyzer:
     """Main class for document analysis operations"""
     
-    def __init__(self):
+    def __init__(self, cache: AnalysisCache = None, pdf_engine: PdfExtractionEngine = None,
+                 classifier: DocumentClassifier = None, clause_store: ClauseIndexStore = None,
+                 compactor: PromptCompactor = None, revisions: RevisionIndex = None, router: ModelRouter = None,
+                 near_duplicates: NearDuplicateIndex = None):
         """Initialize the document analyzer with OpenAI client"""
+        self.model = os.getenv('OPENAI_MODEL', DEFAULT_MODEL)
+        self.max_output_tokens = 1000
+        self.max_answer_tokens = 300
+        self.json_mode = os.getenv('OPENAI_JSON_MODE', 'true').lower() in ('1', 'true', 'yes')
+        self.chunk_tokens = int(os.getenv('ANALYSIS_CHUNK_TOKENS', 1000))
+        self.max_parallel_chunks = int(os.getenv('ANALYSIS_MAX_PARALLEL_CHUNKS', 4))
+        self.max_document_tokens = int(os.getenv('ANALYSIS_MAX_DOCUMENT_TOKENS', 20000))
+        self.pdf_engine = pdf_engine if pdf_engine is not None else PdfExtractionEngine.from_env()
+        self.cache = cache if cache is not None else AnalysisCache.from_env()
+        self.classifier = classifier if classifier is not None else DocumentClassifier.from_env()
+        self.clause_store = clause_store if clause_store is not None else ClauseIndexStore.from_env()
+        self.compactor = compactor if compactor is not None else PromptCompactor.from_env()
+        self.revisions = revisions if revisions is not None else RevisionIndex.from_env()
+        self.near_duplicates = near_duplicates if near_duplicates is not None else NearDuplicateIndex.from_env()
+        self.router = router if router is not None else ModelRouter.from_env(self.model)
+        # Revisions changing more than this share of the document's tokens are analyzed in full
+        self.revision_max_changed = float(os.getenv('REVISION_MAX_CHANGED_RATIO', 0.3))
+        # Above this confidence the detected type is given to the model instead of asked for
+        self.type_hint_confidence = float(os.getenv('DOCUMENT_TYPE_HINT_CONFIDENCE', 0.6))
+        
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             logger.warning("OpenAI API key not found. Analysis will use mock responses.")
             self.client = None
         else:
-            self.client = OpenAI(api_key=api_key)
+            self.client = LLMClient.from_env(model=self.model)
+        # Used by the *_async methods; its connection pool belongs to the serving event loop
+        self.async_client = AsyncLLMClient.from_env(model=self.model) if api_key else None
+        # Process pool for extraction in the async methods, set by the ASGI app
+        self.process_pool = None
+        # Rebuilds the clause indexes of PDFs whose extraction stopped at the token budget
+        self._index_pool = (ThreadPoolExecutor(max_workers=1, thread_name_prefix='jollybot-clause-index')
+                            if self.clause_store is not None else None)
     
-    def extract_text(self, filepath: str) -> str:
-        """Extract text from document based on file type"""
+    def extract_text(self, source: DocumentInput, filename: str = None) -> str:
+        """Extract text from a document path, buffer or upload stream based on file type"""
         try:
-            file_extension = filepath.lower().split('.')[-1]
-            
-            if file_extension == 'pdf':
-                return self._extract_pdf_text(filepath)
-            elif file_extension == 'docx':
-                return self._extract_docx_text(filepath)
-            elif file_extension == 'txt':
-                return self._extract_txt_text(filepath)
-            else:
-                raise ValueError(f"Unsupported file type: {file_extension}")
+            with open_document(source, filename) as document:
+                file_extension = document.extension
+                UPLOAD_SIZE.observe(document.size)
+                
+                with EXTRACTION_SECONDS.labels(format=file_extension).time(), log_stage('extraction'):
+                    return self._extract(document)
+                
+        except Exception as e:
+            ERRORS.labels(stage='extraction').inc()
+            logger.error("Text extraction failed: %s", e)
+            raise
+    
+    async def extract_text_async(self, source: DocumentInput, filename: str = None) -> str:
+        """Extract text without blocking the event loop
+        
+        Extraction is CPU-bound, so it runs in ``process_pool`` when one is set,
+        letting many extractions proceed in parallel, or otherwise in a thread.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            with open_document(source, filename) as document:
+                file_extension = document.extension
+                UPLOAD_SIZE.observe(document.size)
+                
+                with EXTRACTION_SECONDS.labels(format=file_extension).time(), log_stage('extraction'):
+                    if self.process_pool is None:
+                        return await loop.run_in_executor(None, self._extract, document)
+                    location = document.location
+                    if not isinstance(location, str):
+                        location = bytes(location)
+                    return await loop.run_in_executor(self.process_pool, _extract_in_worker,
+                                                      location, document.filename, self.max_document_tokens)
                 
         except Exception as e:
-            logger.error(f"Text extraction failed: {str(e)}")
+            ERRORS.labels(stage='extraction').inc()
+            logger.error("Text extraction failed: %s", e)
             raise
     
-    def _extract_pdf_text(self, filepath: str) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        with open(filepath, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        return text.strip()
-    
-    def _extract_docx_text(self, filepath: str) -> str:
-        """Extract text from DOCX file"""
-        doc = docx.Document(filepath)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text.strip()
-    
-    def _extract_txt_text(self, filepath: str) -> str:
-        """Extract text from TXT file"""
-        with open(filepath, 'r', encoding='utf-8') as file:
-            return file.read().strip()
-    
-    def analyze_document(self, filepath: str) -> Dict[str, Any]:
+    def _extract(self, document: DocumentSource) -> str:
+        """Extract text based on file type; PDFs stop at the analysis token budget
+        
+        Text past the budget would never reach the model. The clause index of a
+        PDF cut short is rebuilt from every page in the background (see
+        _index_clauses).
+        """
+        return extract_document(document, self.pdf_engine, self.max_document_tokens)
+    
+    def analyze_document(self, source: DocumentInput, filename: str = None) -> Dict[str, Any]:
         """Analyze document and return legal insights"""
         try:
-            # Extract text from document
-            text_content = self.extract_text(filepath)
+            with open_document(source, filename) as document:
+                # Extract text from document
+                text_content = self.extract_text(document)
+                
+                if not text_content.strip():
+                    return {
+                        'error': EMPTY_DOCUMENT_ERROR
+                    }
+                
+                cache_key = self._cache_key(document.buffer, text_content)
+                document_id = self._index_clauses(document.buffer, text_content)
+            
+            # Perform AI analysis
+            analysis = self._perform_legal_analysis(text_content, cache_key, document_id=document_id)
             
-            if not text_content.strip():
+            return self._document_result(text_content, analysis, document_id)
+            
+        except Exception as e:
+            logger.error("Document analysis failed: %s", e)
+            return {
+                'error': f'Analysis failed: {str(e)}',
+                'success': False
+            }
+    
+    def analyze_text(self, text: str, source_bytes: bytes = b'') -> Dict[str, Any]:
+        """Analyze already extracted text; ``source_bytes`` are the original file, used for caching"""
+        try:
+            if not text.strip():
                 return {
-                    'error': 'Document appears to be empty or text could not be extracted'
+                    'error': EMPTY_DOCUMENT_ERROR
                 }
             
-            # Perform AI analysis
-            analysis = self._perform_legal_analysis(text_content)
+            cache_key = self._cache_key(source_bytes, text)
+            document_id = self._index_clauses(source_bytes, text)
+            analysis = self._perform_legal_analysis(text, cache_key, document_id=document_id)
             
+            return self._document_result(text, analysis, document_id)
+            
+        except Exception as e:
+            logger.error("Document analysis failed: %s", e)
             return {
-                'text_length': len(text_content),
-                'word_count': len(text_content.split()),
-                'analysis': analysis,
-                'success': True
+                'error': f'Analysis failed: {str(e)}',
+                'success': False
             }
+    
+    async def analyze_document_async(self, source: DocumentInput, filename: str = None) -> Dict[str, Any]:
+        """Async counterpart of analyze_document: extraction is offloaded and model calls are awaited"""
+        loop = asyncio.get_running_loop()
+        try:
+            with open_document(source, filename) as document:
+                text_content = await self.extract_text_async(document)
+                
+                if not text_content.strip():
+                    return {
+                        'error': EMPTY_DOCUMENT_ERROR
+                    }
+                
+                cache_key = self._cache_key(document.buffer, text_content)
+                document_id = await loop.run_in_executor(None, self._index_clauses, document.buffer, text_content)
+            
+            analysis = await self._perform_legal_analysis_async(text_content, cache_key, document_id=document_id)
+            
+            return self._document_result(text_content, analysis, document_id)
+            
+        except Exception as e:
+            logger.error("Document analysis failed: %s", e)
+            return {
+                'error': f'Analysis failed: {str(e)}',
+                'success': False
+            }
+    
+    async def analyze_text_async(self, text: str, source_bytes: bytes = b'') -> Dict[str, Any]:
+        """Async counterpart of analyze_text"""
+        loop = asyncio.get_running_loop()
+        try:
+            if not text.strip():
+                return {
+                    'error': EMPTY_DOCUMENT_ERROR
+                }
+            
+            cache_key = self._cache_key(source_bytes, text)
+            document_id = await loop.run_in_executor(None, self._index_clauses, source_bytes, text)
+            analysis = await self._perform_legal_analysis_async(text, cache_key, document_id=document_id)
+            
+            return self._document_result(text, analysis, document_id)
             
         except Exception as e:
-            logger.error(f"Document analysis failed: {str(e)}")
+            logger.error("Document analysis failed: %s", e)
             return {
                 'error': f'Analysis failed: {str(e)}',
                 'success': False
             }
     
-    def _perform_legal_analysis(self, text: str) -> Dict[str, Any]:
-        """Perform AI-powered legal analysis of the text"""
+    def _cache_key(self, source_bytes: bytes, text: str) -> str:
+        """Cache key of a document under the current model settings
+        
+        With routing on, the model is picked per document after the cache
+        lookup, so the key covers the routing table and every route's model.
+        """
+        model = self.router.fingerprint if self.router is not None else self.model
+        return make_cache_key(source_bytes, text, model, PROMPT_VERSION)
+    
+    def _document_result(self, text: str, analysis: Dict[str, Any], document_id: str) -> Dict[str, Any]:
+        """Result payload for an analyzed document"""
+        return self._with_document_id({
+            'text_length': len(text),
+            'word_count': len(text.split()),
+            'analysis': analysis,
+            'success': True
+        }, document_id)
+    
+    def _index_clauses(self, source_bytes: bytes, text: str) -> str:
+        """Store a clause index for later questions; returns the document id (SHA-256 of the file)
+        
+        ``text`` is indexed right away. For a newly indexed PDF, whose extraction
+        may have stopped at the token budget, a background task then checks for
+        missing pages and re-indexes the full text.
+        """
+        if self.clause_store is None:
+            return None
+        document_id = hashlib.sha256(source_bytes or text.encode('utf-8')).hexdigest()
+        try:
+            built = self.clause_store.ensure(document_id, text)
+        except Exception as e:
+            logger.error("Clause indexing failed: %s", e)
+            return None
+        if built and bytes(source_bytes[:5]) == b'%PDF-':
+            self._index_pool.submit(self._index_full_pdf, document_id, bytes(source_bytes), text)
+        return document_id
+    
+    def _index_full_pdf(self, document_id: str, pdf_bytes: bytes, text: str):
+        """Re-index a PDF from every page if ``text`` stopped short of the last one"""
+        try:
+            if pdf_page_count(pdf_bytes) <= text.count(PAGE_BREAK) + 1:
+                return
+            full_text = self.pdf_engine.extract(pdf_bytes).text
+            self.clause_store.rebuild(document_id, full_text)
+        except Exception as e:
+            logger.error("Full-text clause indexing of %s failed: %s", document_id[:12], e)
+    
+    def _with_document_id(self, payload: Dict[str, Any], document_id: str) -> Dict[str, Any]:
+        """Add the id used by the document question API, when the document was indexed"""
+        if document_id is not None:
+            payload['document_id'] = document_id
+        return payload
+    
+    def answer_question(self, question: str, excerpts: List[str]) -> str:
+        """Answer a question about a document from its most relevant excerpts only"""
+        if not excerpts:
+            return "I couldn't find anything in the document about that. Try rephrasing your question."
+        
         if not self.client:
-            # Return mock analysis if no OpenAI client
-            return self._get_mock_analysis(text)
+            return "Relevant excerpts:\n\n" + '\n\n'.join(excerpts)
         
         try:
-            # Prepare the prompt for legal analysis
-            prompt = self._create_legal_analysis_prompt(text)
-            
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a legal document analysis assistant. Provide clear, structured analysis of legal documents."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.3
-            )
+            response = self.client.complete(**self._question_request(question, excerpts))
+            return response.choices[0].message.content.strip()
             
-            analysis_text = response.choices[0].message.content
+        except Exception as e:
+            logger.error("Question answering failed: %s", e)
+            return "Sorry, I couldn't answer that right now. Please try again later."
+    
+    async def answer_question_async(self, question: str, excerpts: List[str]) -> str:
+        """Async counterpart of answer_question"""
+        if not excerpts:
+            return "I couldn't find anything in the document about that. Try rephrasing your question."
+        
+        if not self.async_client:
+            return "Relevant excerpts:\n\n" + '\n\n'.join(excerpts)
+        
+        try:
+            response = await self.async_client.complete(**self._question_request(question, excerpts))
+            return response.choices[0].message.content.strip()
             
-            return {
-                'summary': self._extract_summary(analysis_text),
-                'key_points': self._extract_key_points(analysis_text),
-                'document_type': self._identify_document_type(text),
-                'risks_concerns': self._extract_risks(analysis_text),
-                'recommendations': self._extract_recommendations(analysis_text),
-                'full_analysis': analysis_text
+        except Exception as e:
+            logger.error("Question answering failed: %s", e)
+            return "Sorry, I couldn't answer that right now. Please try again later."
+    
+    def _question_request(self, question: str, excerpts: List[str]) -> Dict[str, Any]:
+        """Completion arguments for answering a question from document excerpts"""
+        context = '\n\n---\n\n'.join(excerpts)
+        prompt = f"""
+        Answer the question using only these excerpts from a legal document. Quote the relevant
+        wording where helpful. If the excerpts do not answer it, say so.
+        
+        Excerpts:
+        {context}
+        
+        Question: {question}
+        """
+        return {
+            'messages': self._analysis_messages(prompt),
+            'max_tokens': self.max_answer_tokens,
+            'temperature': 0.2,
+            'model': self.model
+        }
+    
+    def stream_analysis(self, source: DocumentInput, filename: str = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Analyze a document, yielding (event, data) pairs as each stage finishes
+        
+        Events are ``extracted`` once text extraction is done, ``token`` for each
+        piece of model output, ``section`` whenever a result field is complete,
+        then ``complete`` with the same payload as analyze_document (or ``error``).
+        """
+        try:
+            with open_document(source, filename) as document:
+                text_content = self.extract_text(document)
+                
+                if not text_content.strip():
+                    yield 'error', {'error': EMPTY_DOCUMENT_ERROR}
+                    return
+                
+                cache_key = self._cache_key(document.buffer, text_content)
+                document_id = self._index_clauses(document.buffer, text_content)
+            
+            classification = self.classifier.classify(text_content)
+            yield 'extracted', {
+                'text_length': len(text_content),
+                'word_count': len(text_content.split()),
+                'document_type': classification.document_type,
+                'document_type_confidence': classification.confidence
             }
             
+            emitted = set()
+            plan = None
+            if self.client:
+                plan = self._plan_analysis(text_content, cache_key, classification, document_id)
+            single = plan is not None and len(plan.chunks) == 1 and plan.revision is None
+            analysis = self.cache.get(cache_key) if single else None
+            if single:
+                CACHE_REQUESTS.labels(result='miss' if analysis is None else 'hit').inc()
+            if analysis is None:
+                if single:
+                    analysis = yield from self._stream_single_analysis(plan, cache_key, emitted, classification,
+                                                                       document_id)
+                else:
+                    # Chunked documents and revisions are merged only once every request is done
+                    analysis = self._perform_legal_analysis(text_content, cache_key, classification, document_id,
+                                                            plan)
+            
+            for field in STREAMED_SECTIONS:
+                if field not in emitted:
+                    yield 'section', {'name': field, 'value': analysis[field]}
+            
+            yield 'complete', self._document_result(text_content, analysis, document_id)
+            
         except Exception as e:
-            logger.error(f"AI analysis failed: {str(e)}")
-            return self._get_mock_analysis(text)
+            logger.error("Streaming analysis failed: %s", e)
+            yield 'error', {
+                'error': f'Analysis failed: {str(e)}',
+                'success': False
+            }
     
-    def _create_legal_analysis_prompt(self, text: str) -> str:
-        """Create a structured prompt for legal document analysis"""
-        return f"""
-        Please analyze the following legal document and provide:
+    def _stream_single_analysis(self, plan: AnalysisPlan, cache_key: str, emitted: set,
+                                classification: DocumentTypeScore, document_id: str = None):
+        """Stream one model reply, emitting each section as soon as the next one starts"""
+        compaction, decision = plan.compaction, plan.decision
+        text = compaction.text
+        started = time.perf_counter()
+        if decision is not None and decision.fast_path:
+            result = self._fast_path_analysis(text, classification)
+            result['prompt_compaction'] = compaction.to_dict()
+            self._finish_route(decision, started, result)
+            return self._store_result(cache_key, result, plan, document_id)
         
-        1. SUMMARY: A brief overview of the document's purpose and main content
-        2. DOCUMENT TYPE: What type of legal document this appears to be
-        3. KEY POINTS: The most important terms, clauses, or provisions
-        4. RISKS & CONCERNS: Any potential legal risks or concerning clauses
-        5. RECOMMENDATIONS: Suggestions for review or action
+        prompt = self._create_legal_analysis_prompt(text, document_type=self._type_hint(classification),
+                                                    template=decision.template if decision else 'standard')
+        reply = ''
+        tokenizer = SectionTokenizer()
         
-        Document text:
-        {text[:4000]}  # Limit text to avoid token limits
+        try:
+            stream = self.client.complete(
+                self._analysis_messages(prompt),
+                max_tokens=decision.max_output_tokens if decision else self.max_output_tokens,
+                temperature=0.3,
+                model=decision.model if decision else self.model,
+                stream=True
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                reply += delta
+                yield 'token', {'text': delta}
+                
+                for field in tokenizer.feed(delta):
+                    if field in STREAMED_SECTIONS and field not in emitted:
+                        emitted.add(field)
+                        yield 'section', {'name': field, 'value': tokenizer.result()[field]}
         
-        Please structure your response clearly with these sections.
+        except Exception as e:
+            ERRORS.labels(stage='llm').inc()
+            MOCK_FALLBACKS.labels(reason='llm_error').inc()
+            logger.error("AI analysis stream failed: %s", e)
+            self._finish_route(decision, started)
+            return self._get_mock_analysis(text, classification)
+        
+        tokenizer.close()
+        result = self._result_from_fields(tokenizer.result(), reply, classification)
+        result['prompt_compaction'] = compaction.to_dict()
+        if decision is not None:
+            # Streamed replies carry no usage, so both sides are counted locally
+            decision.add_usage(count_tokens(prompt), count_tokens(reply))
+        self._finish_route(decision, started, result)
+        return self._store_result(cache_key, result, plan, document_id)
+    
+    def _perform_legal_analysis(self, text: str, cache_key: str = None, classification: DocumentTypeScore = None,
+                                document_id: str = None, plan: AnalysisPlan = None) -> Dict[str, Any]:
+        """Perform AI-powered legal analysis of the text
+        
+        ``plan`` is passed by callers that already planned the analysis, e.g. streaming.
         """
+        with IN_FLIGHT_ANALYSES.track_inprogress(), ANALYSIS_SECONDS.time(), log_stage('analysis'):
+            if classification is None:
+                classification = self.classifier.classify(text)
+            
+            early = self._mock_or_cached(text, cache_key, classification, self.client)
+            if early is not None:
+                return early
+            
+            if plan is None:
+                plan = self._plan_analysis(text, cache_key, classification, document_id)
+            compaction, _, _, revision, chunks, decision = plan
+            started = time.perf_counter()
+            
+            try:
+                if revision is not None:
+                    result = self._revision_analysis(*revision, classification, decision)
+                elif decision is not None and decision.fast_path:
+                    result = self._fast_path_analysis(compaction.text, classification)
+                elif len(chunks) == 1:
+                    prompt = self._single_prompt(chunks[0], classification, decision)
+                    result = self._build_result(self._request_analysis(prompt, decision), classification)
+                else:
+                    result = self._map_reduce_analysis(chunks, classification, decision)
+                
+                result['prompt_compaction'] = compaction.to_dict()
+                self._finish_route(decision, started, result)
+                return self._store_result(cache_key, result, plan, document_id)
+                
+            except Exception as e:
+                self._finish_route(decision, started)
+                return self._analysis_failed(e, text, classification)
     
-    def _extract_summary(self, analysis: str) -> str:
-        """Extract summary from analysis text"""
-        lines = analysis.split('\n')
-        for i, line in enumerate(lines):
-            if 'SUMMARY' in line.upper():
-                return lines[i+1] if i+1 < len(lines) else "Summary not available"
-        return "Summary not available"
-    
-    def _extract_key_points(self, analysis: str) -> list:
-        """Extract key points from analysis text"""
-        points = []
-        lines = analysis.split('\n')
-        in_key_points = False
-        
-        for line in lines:
-            if 'KEY POINTS' in line.upper():
-                in_key_points = True
-                continue
-            elif in_key_points and line.startswith(('RISKS', 'RECOMMENDATIONS', 'DOCUMENT TYPE')):
-                break
-            elif in_key_points and line.strip():
-                points.append(line.strip())
+    async def _perform_legal_analysis_async(self, text: str, cache_key: str = None,
+                                            classification: DocumentTypeScore = None,
+                                            document_id: str = None) -> Dict[str, Any]:
+        """Async counterpart of _perform_legal_analysis; chunk requests are awaited concurrently
         
-        return points[:5]  # Limit to 5 key points
+        Cache lookups, planning and storing the result are CPU or SQLite work, so
+        they run on the default executor rather than on the event loop.
+        """
+        with IN_FLIGHT_ANALYSES.track_inprogress(), ANALYSIS_SECONDS.time(), log_stage('analysis'):
+            if classification is None:
+                classification = self.classifier.classify(text)
+            
+            early = await self._offload(self._mock_or_cached, text, cache_key, classification, self.async_client)
+            if early is not None:
+                return early
+            
+            plan = await self._offload(self._plan_analysis, text, cache_key, classification, document_id)
+            compaction, _, _, revision, chunks, decision = plan
+            started = time.perf_counter()
+            
+            try:
+                if revision is not None:
+                    result = await self._revision_analysis_async(*revision, classification, decision)
+                elif decision is not None and decision.fast_path:
+                    result = self._fast_path_analysis(compaction.text, classification)
+                elif len(chunks) == 1:
+                    prompt = self._single_prompt(chunks[0], classification, decision)
+                    result = self._build_result(await self._request_analysis_async(prompt, decision), classification)
+                else:
+                    result = await self._map_reduce_analysis_async(chunks, classification, decision)
+                
+                result['prompt_compaction'] = compaction.to_dict()
+                self._finish_route(decision, started, result)
+                return await self._offload(self._store_result, cache_key, result, plan, document_id)
+                
+            except Exception as e:
+                self._finish_route(decision, started)
+                return self._analysis_failed(e, text, classification)
     
-    def _identify_document_type(self, text: str) -> str:
-        """Identify the type of legal document"""
-        text_lower = text.lower()
-        
-        if 'contract' in text_lower or 'agreement' in text_lower:
-            return 'Contract/Agreement'
-        elif 'will' in text_lower and 'testament' in text_lower:
-            return 'Will/Testament'
-        elif 'lease' in text_lower:
-            return 'Lease Agreement'
-        elif 'nda' in text_lower or 'non-disclosure' in text_lower:
-            return 'Non-Disclosure Agreement'
-        elif 'employment' in text_lower:
-            return 'Employment Document'
+    async def _offload(self, func, *args):
+        """Run blocking work on the default executor, keeping the caller's log context"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+    
+    def _plan_analysis(self, text: str, cache_key: str, classification: DocumentTypeScore,
+                       document_id: str) -> AnalysisPlan:
+        """Compact the text, look for an earlier analysis to reuse, chunk and route it"""
+        compaction = self._compact(text)
+        clauses = self._revision_clauses(compaction)
+        signature = self._signature(compaction)
+        revision = (self._find_revision(clauses, compaction, cache_key)
+                    or self._find_near_duplicate(signature, text, compaction, cache_key, document_id))
+        chunks = split_into_chunks(compaction.text, self.chunk_tokens, count_tokens)
+        return AnalysisPlan(compaction, clauses, signature, revision, chunks, self._route(compaction, classification))
+    
+    def _store_result(self, cache_key: str, result: Dict[str, Any], plan: AnalysisPlan,
+                      document_id: str = None) -> Dict[str, Any]:
+        """Cache a model-produced result and index the document for later revisions and near-duplicates"""
+        self._record_revision(cache_key, plan.clauses, document_id, plan.signature)
+        return self._remember_result(cache_key, result)
+    
+    def _mock_or_cached(self, text: str, cache_key: str, classification: DocumentTypeScore,
+                        client) -> Dict[str, Any]:
+        """Mock analysis without a model client, a cached result, or None when the model must be asked"""
+        if not client:
+            # Return mock analysis if no OpenAI client
+            MOCK_FALLBACKS.labels(reason='no_client').inc()
+            return self._get_mock_analysis(text, classification)
+        
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            CACHE_REQUESTS.labels(result='miss' if cached is None else 'hit').inc()
+            if cached is not None:
+                logger.info("Analysis cache hit: %s", cache_key[:12], extra={'sample': True})
+                return cached
+        return None
+    
+    def _compact(self, text: str) -> CompactionReport:
+        """Compact document text for the prompt, logging and counting the tokens saved"""
+        if self.compactor is None:
+            tokens = count_tokens(text)
+            return CompactionReport(text, tokens, tokens)
+        
+        compaction = self.compactor.compact(text)
+        PROMPT_TOKENS_SAVED.inc(max(compaction.tokens_saved, 0))
+        logger.info("Prompt compaction saved %s of %s tokens (%s boilerplate lines, %s duplicate clauses)",
+                    compaction.tokens_saved, compaction.tokens_before, compaction.boilerplate_lines,
+                    compaction.duplicate_clauses, extra={'sample': True})
+        return compaction
+    
+    def _route(self, compaction: CompactionReport, classification: DocumentTypeScore) -> RoutingDecision:
+        """Routing decision for a compacted document, or None when routing is off"""
+        if self.router is None:
+            return None
+        return self.router.route(compaction.text, classification.document_type, classification.confidence,
+                                 tokens=compaction.tokens_after)
+    
+    def _finish_route(self, decision: RoutingDecision, started: float, result: Dict[str, Any] = None):
+        """Log a routed analysis's latency and spend; a result of None means the model calls failed"""
+        if decision is None:
+            return
+        self.router.log.record(decision, time.perf_counter() - started, 'error' if result is None else 'ok')
+        if result is not None:
+            result['routing'] = decision.to_dict()
+    
+    def _fast_path_analysis(self, text: str, classification: DocumentTypeScore) -> Dict[str, Any]:
+        """Local extractive analysis for short documents the router judged not worth a model call"""
+        clauses = segment_clauses(text) or [text.strip()]
+        sentences = [sentence.strip() for sentence in text.replace('\n', ' ').split('. ') if sentence.strip()]
+        fields = {
+            'summary': f"Short {classification.document_type.lower()}: {sentences[0].rstrip('.')}." if sentences
+                       else MISSING_SUMMARY,
+            'key_points': [' '.join(clause.split())[:200] for clause in clauses[:5]],
+            'risks_concerns': [FAST_PATH_RISK_NOTE],
+            'recommendations': ['Confirm the document is complete; only a short text was provided']
+        }
+        return self._result_from_fields(fields, format_analysis(fields), classification)
+    
+    def _revision_clauses(self, compaction: CompactionReport) -> List[str]:
+        """Clauses compared between revisions (empty when revision tracking is off)"""
+        if self.revisions is None:
+            return []
+        return segment_clauses(compaction.text)
+    
+    def _find_revision(self, clauses: List[str], compaction: CompactionReport,
+                       cache_key: str) -> Tuple[Dict[str, Any], ClauseDiff, bool]:
+        """Cached analysis of an earlier version, the clause diff and True, or None for a full analysis"""
+        if self.revisions is None or not clauses:
+            return None
+        match = self.revisions.find(clauses, exclude=cache_key)
+        if match is None:
+            return None
+        base_key, base_clauses = match
+        base = self.cache.get(base_key)
+        if base is None:
+            return None
+        
+        diff = diff_clauses(base_clauses, clauses)
+        changed_tokens = count_tokens(diff.describe())
+        if changed_tokens > self.revision_max_changed * compaction.tokens_after:
+            logger.info("Revision of %s changes %s tokens; analyzing in full", base_key[:12], changed_tokens)
+            return None
+        logger.info("Revision of %s: %s modified, %s added, %s removed, %s unchanged clauses",
+                    base_key[:12], len(diff.modified), len(diff.added), len(diff.removed), diff.unchanged)
+        return base, diff, True
+    
+    def _signature(self, compaction: CompactionReport) -> array:
+        """MinHash signature of a compacted document (None when near-duplicate detection is off)"""
+        if self.near_duplicates is None:
+            return None
+        return self.near_duplicates.signature(compaction.text)
+    
+    def _find_near_duplicate(self, signature: array, text: str, compaction: CompactionReport, cache_key: str,
+                             document_id: str) -> Tuple[Dict[str, Any], ClauseDiff, bool]:
+        """Cached analysis of a near-identical document, the clause diff against it and False, or None
+        
+        Catches copies of a template with other parties and dates, whose clauses
+        rarely match the revision index exactly. The earlier document's clauses
+        are read back from its clause index. It may belong to another uploader,
+        so the False tells the analysis not to show its summary or clauses.
+        """
+        if signature is None or self.clause_store is None or not document_id:
+            return None
+        match = self.near_duplicates.find(signature, exclude=cache_key)
+        NEAR_DUPLICATE_LOOKUPS.labels(result='miss' if match is None else 'hit').inc()
+        if match is None:
+            return None
+        base_key, base_document_id, similarity = match
+        base = self.cache.get(base_key)
+        if base is None or base_document_id == document_id:
+            return None
+        try:
+            base_index = self.clause_store.get(base_document_id)
+        except Exception as e:
+            logger.error("Could not open clause index of %s: %s", base_document_id[:12], e)
+            return None
+        if base_index is None:
+            return None
+        
+        base_clauses = [base_index.clause(clause_id) for clause_id in range(len(base_index))]
+        diff = diff_clauses(base_clauses, segment_clauses(text, self.clause_store.max_clause_tokens))
+        changed_tokens = count_tokens(diff.describe())
+        if changed_tokens > self.revision_max_changed * compaction.tokens_after:
+            logger.info("Near-duplicate of %s changes %s tokens; analyzing in full", base_key[:12], changed_tokens)
+            return None
+        logger.info("Near-duplicate of %s (similarity %.2f): %s modified, %s added, %s removed, %s unchanged clauses",
+                    base_key[:12], similarity, len(diff.modified), len(diff.added), len(diff.removed), diff.unchanged)
+        return base, diff, False
+    
+    def _record_revision(self, cache_key: str, clauses: List[str], document_id: str = None,
+                         signature: array = None):
+        """Remember an analyzed document so later revisions and near-duplicates can reuse its analysis"""
+        if self.revisions is not None and cache_key and clauses:
+            self.revisions.add(cache_key, clauses)
+        if self.near_duplicates is not None and cache_key and document_id:
+            self.near_duplicates.add(cache_key, document_id, signature)
+    
+    def _revision_analysis(self, base: Dict[str, Any], diff: ClauseDiff, same_document: bool,
+                           classification: DocumentTypeScore, decision: RoutingDecision = None) -> Dict[str, Any]:
+        """Analyze only the changed clauses and merge them into the earlier version's analysis"""
+        if not diff.changed:
+            return self._merge_revision(base, None, diff, same_document)
+        prompt = self._create_revision_prompt(diff, base, self._type_hint(classification), same_document)
+        reply = self._request_analysis(prompt, decision)
+        return self._merge_revision(base, self._build_result(reply, classification), diff, same_document)
+    
+    async def _revision_analysis_async(self, base: Dict[str, Any], diff: ClauseDiff, same_document: bool,
+                                       classification: DocumentTypeScore,
+                                       decision: RoutingDecision = None) -> Dict[str, Any]:
+        """Async counterpart of _revision_analysis"""
+        if not diff.changed:
+            return self._merge_revision(base, None, diff, same_document)
+        prompt = self._create_revision_prompt(diff, base, self._type_hint(classification), same_document)
+        reply = await self._request_analysis_async(prompt, decision)
+        return self._merge_revision(base, self._build_result(reply, classification), diff, same_document)
+    
+    def _merge_revision(self, base: Dict[str, Any], changes: Dict[str, Any], diff: ClauseDiff,
+                        same_document: bool = True) -> Dict[str, Any]:
+        """Analysis of the current version from the changes plus the still valid earlier findings
+        
+        The summary and full analysis come from the changes' analysis. Earlier
+        findings are carried over only while the clause they were drawn from is
+        unchanged (see ClauseDiff.findings_on_unchanged).
+        """
+        what_changed = diff.to_dict(include_earlier=same_document)
+        if changes is None:
+            result = dict(base)
+            what_changed['summary'] = "No substantive changes since the previously analyzed version."
         else:
-            return 'Legal Document'
-    
-    def _extract_risks(self, analysis: str) -> list:
-        """Extract risks and concerns from analysis text"""
-        risks = []
-        lines = analysis.split('\n')
-        in_risks = False
-        
-        for line in lines:
-            if 'RISKS' in line.upper() or 'CONCERNS' in line.upper():
-                in_risks = True
-                continue
-            elif in_risks and line.startswith(('RECOMMENDATIONS', 'SUMMARY')):
+            fields = ('key_points', 'risks_concerns', 'recommendations')
+            still_valid = dict(base, **{field: diff.findings_on_unchanged(base[field]) for field in fields})
+            merged = self._reduce_results([changes, still_valid])
+            result = dict(changes)
+            for field in fields:
+                result[field] = merged[field]
+            what_changed.update({
+                'summary': changes['summary'],
+                'key_points': changes['key_points'],
+                'risks_concerns': changes['risks_concerns']
+            })
+        result['what_changed'] = what_changed
+        return result
+    
+    def _remember_result(self, cache_key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache a model-produced result; mock fallbacks never go through here so are never reused"""
+        if cache_key:
+            self.cache.set(cache_key, result)
+        return result
+    
+    def _analysis_failed(self, error: Exception, text: str, classification: DocumentTypeScore) -> Dict[str, Any]:
+        """Fall back to the mock analysis after a model failure"""
+        ERRORS.labels(stage='llm').inc()
+        MOCK_FALLBACKS.labels(reason='llm_error').inc()
+        logger.error("AI analysis failed: %s", error)
+        return self._get_mock_analysis(text, classification)
+    
+    def _single_prompt(self, text: str, classification: DocumentTypeScore, decision: RoutingDecision = None) -> str:
+        """Prompt for a document that fits in one request"""
+        return self._create_legal_analysis_prompt(text, structured=True, document_type=self._type_hint(classification),
+                                                  template=decision.template if decision else 'standard')
+    
+    def _request_analysis(self, prompt: str, decision: RoutingDecision = None) -> str:
+        """Send one analysis prompt to the model (the routed one, if any) and return its reply"""
+        request = self._analysis_request(prompt, decision)
+        response = self.client.complete(**request)
+        return self._routed_reply(response, request, decision)
+    
+    async def _request_analysis_async(self, prompt: str, decision: RoutingDecision = None) -> str:
+        """Async counterpart of _request_analysis"""
+        request = self._analysis_request(prompt, decision)
+        response = await self.async_client.complete(**request)
+        return self._routed_reply(response, request, decision)
+    
+    def _analysis_request(self, prompt: str, decision: RoutingDecision = None) -> Dict[str, Any]:
+        """Completion arguments for one analysis prompt"""
+        extra = {'response_format': {'type': 'json_object'}} if self.json_mode else {}
+        return {
+            'messages': self._analysis_messages(prompt),
+            'max_tokens': decision.max_output_tokens if decision else self.max_output_tokens,
+            'temperature': 0.3,
+            'model': decision.model if decision else self.model,
+            **extra
+        }
+    
+    def _routed_reply(self, response, request: Dict[str, Any], decision: RoutingDecision) -> str:
+        """Reply text of a completion, charging its token usage to the routing decision"""
+        reply = response.choices[0].message.content
+        if decision is not None:
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                decision.add_usage(usage.prompt_tokens or 0, usage.completion_tokens or 0)
+            else:
+                prompt_tokens = sum(count_tokens(message['content']) for message in request['messages'])
+                decision.add_usage(prompt_tokens, count_tokens(reply or ''))
+        return reply
+    
+    def _analysis_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Chat messages for an analysis request"""
+        return [
+            {"role": "system", "content": "You are a legal document analysis assistant. Provide clear, structured analysis of legal documents."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _build_result(self, analysis_text: str, classification: DocumentTypeScore) -> Dict[str, Any]:
+        """Parse a model reply into the analysis result schema"""
+        with PARSE_SECONDS.time(), log_stage('parse'):
+            fields = parse_json_response(analysis_text)
+            if fields is None:
+                return self._result_from_fields(parse_sections(analysis_text), analysis_text, classification)
+            # JSON replies are rendered as readable text for display
+            return self._result_from_fields(fields, format_analysis(fields), classification)
+    
+    def _result_from_fields(self, fields: Dict[str, Any], analysis_text: str,
+                            classification: DocumentTypeScore) -> Dict[str, Any]:
+        """Assemble the result schema from parsed reply fields"""
+        return {
+            'summary': fields['summary'],
+            'key_points': fields['key_points'],
+            'document_type': classification.document_type,
+            'document_type_confidence': classification.confidence,
+            'risks_concerns': fields['risks_concerns'],
+            'recommendations': fields['recommendations'],
+            'full_analysis': analysis_text
+        }
+    
+    def _select_chunks_within_budget(self, chunks: List[str], document_type: str = None,
+                                     decision: RoutingDecision = None) -> List[str]:
+        """Keep leading chunks whose prompt plus output tokens fit the per-document cap"""
+        selected = []
+        spent = 0
+        max_output_tokens = decision.max_output_tokens if decision else self.max_output_tokens
+        for index, chunk in enumerate(chunks):
+            prompt = self._create_legal_analysis_prompt(chunk, index + 1, len(chunks), structured=True,
+                                                        document_type=document_type,
+                                                        template=decision.template if decision else 'standard')
+            cost = count_tokens(prompt) + max_output_tokens
+            if selected and spent + cost > self.max_document_tokens:
                 break
-            elif in_risks and line.strip():
-                risks.append(line.strip())
+            selected.append(prompt)
+            spent += cost
+        if len(selected) < len(chunks):
+            logger.warning("Token budget of %s reached; analyzing %s of %s chunks",
+                           self.max_document_tokens, len(selected), len(chunks))
+        return selected
+    
+    def _map_reduce_analysis(self, chunks: List[str], classification: DocumentTypeScore,
+                             decision: RoutingDecision = None) -> Dict[str, Any]:
+        """Analyze chunks concurrently and merge them into a single result"""
+        prompts = self._select_chunks_within_budget(chunks, self._type_hint(classification), decision)
+        
+        replies = [None] * len(prompts)
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel_chunks, len(prompts))) as executor:
+            # Chunk requests keep the request's correlation id and stage timings
+            futures = {executor.submit(contextvars.copy_context().run, self._request_analysis, prompt, decision): index
+                       for index, prompt in enumerate(prompts)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    replies[index] = future.result()
+                except Exception as e:
+                    logger.error("Chunk %s/%s analysis failed: %s", index + 1, len(prompts), e)
+        
+        return self._merge_chunk_replies(replies, len(chunks), classification)
+    
+    async def _map_reduce_analysis_async(self, chunks: List[str], classification: DocumentTypeScore,
+                                         decision: RoutingDecision = None) -> Dict[str, Any]:
+        """Async counterpart of _map_reduce_analysis, with at most max_parallel_chunks requests at once"""
+        prompts = self._select_chunks_within_budget(chunks, self._type_hint(classification), decision)
+        semaphore = asyncio.Semaphore(self.max_parallel_chunks)
+        
+        async def request(index: int, prompt: str):
+            async with semaphore:
+                try:
+                    return await self._request_analysis_async(prompt, decision)
+                except Exception as e:
+                    logger.error("Chunk %s/%s analysis failed: %s", index + 1, len(prompts), e)
+                    return None
+        
+        replies = await asyncio.gather(*(request(index, prompt) for index, prompt in enumerate(prompts)))
+        return self._merge_chunk_replies(replies, len(chunks), classification)
+    
+    def _merge_chunk_replies(self, replies: List[str], chunks_total: int,
+                             classification: DocumentTypeScore) -> Dict[str, Any]:
+        """Parse the chunk replies that arrived (None for failures) and merge them"""
+        partials = [self._build_result(reply, classification) for reply in replies if reply is not None]
+        if not partials:
+            raise RuntimeError("All chunk analyses failed")
+        
+        result = self._reduce_results(partials)
+        result['chunks_analyzed'] = len(partials)
+        result['chunks_total'] = chunks_total
+        return result
+    
+    def _reduce_results(self, partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge per-chunk results, drawing list items round-robin so every chunk is represented"""
+        def merge(field: str, limit: int) -> list:
+            merged = []
+            seen = set()
+            for items in zip_longest(*(partial[field] for partial in partials)):
+                for item in items:
+                    if item is not None and item.lower() not in seen:
+                        seen.add(item.lower())
+                        merged.append(item)
+            return merged[:limit]
+        
+        summaries = [p['summary'] for p in partials if p['summary'] != MISSING_SUMMARY]
+        return {
+            'summary': summaries[0] if summaries else MISSING_SUMMARY,
+            'key_points': merge('key_points', 5),
+            'document_type': partials[0]['document_type'],
+            'document_type_confidence': partials[0]['document_type_confidence'],
+            'risks_concerns': merge('risks_concerns', 3),
+            'recommendations': merge('recommendations', 3),
+            'full_analysis': '\n\n'.join(
+                f"--- Part {index} of {len(partials)} ---\n{p['full_analysis']}"
+                for index, p in enumerate(partials, 1)
+            )
+        }
+    
+    def _create_legal_analysis_prompt(self, text: str, part: int = None, total_parts: int = None,
+                                      structured: bool = False, document_type: str = None,
+                                      template: str = 'standard') -> str:
+        """Create a structured prompt for legal document analysis
+        
+        When the document type is already known it is stated up front with what
+        to focus on, and the model is not asked to classify the document. The
+        routing ``template`` adds guidance on how brief or thorough to be.
+        """
+        scope = "legal document"
+        if part is not None:
+            scope = f"excerpt (part {part} of {total_parts}) of a longer legal document"
         
-        return risks[:3]  # Limit to 3 main risks
+        context = ""
+        if document_type:
+            scope = scope.replace("legal document", document_type)
+            context = f"\n        Focus on {TYPE_FOCUS[document_type]}.\n" if document_type in TYPE_FOCUS else ""
+        if TEMPLATES[template]:
+            context += f"\n        {TEMPLATES[template]}\n"
+        
+        if structured and self.json_mode:
+            type_key = "" if document_type else (
+                '\n        "document_type": what type of legal document this appears to be (string)')
+            return f"""
+        Please analyze the following {scope} and respond with a JSON object with these keys:
+        {context}
+        "summary": a brief overview of the document's purpose and main content (string){type_key}
+        "key_points": the most important terms, clauses, or provisions (list of strings)
+        "risks_concerns": any potential legal risks or concerning clauses (list of strings)
+        "recommendations": suggestions for review or action (list of strings)
+        
+        Document text:
+        {text}
+        """
+        
+        sections = ["SUMMARY: A brief overview of the document's purpose and main content"]
+        if not document_type:
+            sections.append("DOCUMENT TYPE: What type of legal document this appears to be")
+        sections += [
+            "KEY POINTS: The most important terms, clauses, or provisions",
+            "RISKS & CONCERNS: Any potential legal risks or concerning clauses",
+            "RECOMMENDATIONS: Suggestions for review or action"
+        ]
+        numbered = '\n        '.join(f"{index}. {section}" for index, section in enumerate(sections, 1))
+        return f"""
+        Please analyze the following {scope} and provide:
+        {context}
+        {numbered}
+        
+        Document text:
+        {text}
+        
+        Please structure your response clearly with these sections.
+        """
     
-    def _extract_recommendations(self, analysis: str) -> list:
-        """Extract recommendations from analysis text"""
-        recommendations = []
-        lines = analysis.split('\n')
-        in_recommendations = False
+    def _create_revision_prompt(self, diff: ClauseDiff, base: Dict[str, Any], document_type: str = None,
+                                same_document: bool = True) -> str:
+        """Create a prompt covering only the clauses changed since a previously analyzed version
+        
+        For a near-duplicate (``same_document`` False) the earlier document's
+        summary and clauses are left out, as they may belong to another uploader.
+        """
+        scope = document_type or "legal document"
+        if same_document:
+            intro = f"""A revised version of a previously analyzed {scope} was uploaded. The earlier version was summarized as:
+        {base['summary']}"""
+        else:
+            intro = f"""A {scope} following a previously analyzed template was uploaded. Only its clauses that
+        differ from the template are shown; the rest follow the template."""
+        if self.json_mode:
+            return f"""
+        {intro}
         
-        for line in lines:
-            if 'RECOMMENDATIONS' in line.upper():
-                in_recommendations = True
-                continue
-            elif in_recommendations and line.strip():
-                recommendations.append(line.strip())
+        Analyze only the changes below and respond with a JSON object with these keys:
+        "summary": the revised document as a whole, including what changed and why it matters (string)
+        "key_points": the most important changed terms (list of strings)
+        "risks_concerns": legal risks introduced or removed by the changes (list of strings)
+        "recommendations": what to review or negotiate in this revision (list of strings)
         
-        return recommendations[:3]  # Limit to 3 recommendations
+        Changes:
+        {diff.describe(include_earlier=same_document)}
+        """
+        
+        return f"""
+        {intro}
+        
+        Analyze only the changes below and provide:
+        
+        1. SUMMARY: The revised document as a whole, including what changed and why it matters
+        2. KEY POINTS: The most important changed terms
+        3. RISKS & CONCERNS: Legal risks introduced or removed by the changes
+        4. RECOMMENDATIONS: What to review or negotiate in this revision
+        
+        Changes:
+        {diff.describe(include_earlier=same_document)}
+        
+        Please structure your response clearly with these sections.
+        """
+    
+    def _identify_document_type(self, text: str) -> str:
+        """Identify the type of legal document"""
+        return self.classifier.classify(text).document_type
+    
+    def _type_hint(self, classification: DocumentTypeScore) -> str:
+        """Detected type to pass to the model, or None when it should classify the document itself"""
+        if classification.document_type == DEFAULT_TYPE or classification.confidence < self.type_hint_confidence:
+            return None
+        return classification.document_type
     
-    def _get_mock_analysis(self, text: str) -> Dict[str, Any]:
+    def _get_mock_analysis(self, text: str, classification: DocumentTypeScore = None) -> Dict[str, Any]:
         """Provide mock analysis when OpenAI is not available"""
+        if classification is None:
+            classification = self.classifier.classify(text)
         return {
             'summary': 'Legal document analysis - OpenAI API not configured. This is a sample analysis.',
             'key_points': [
@@ -228,7 +1081,8 @@ class DocumentAnalyzer:
                 'Multiple clauses and provisions identified',
                 'Requires professional legal review'
             ],
-            'document_type': self._identify_document_type(text),
+            'document_type': classification.document_type,
+            'document_type_confidence': classification.confidence,
             'risks_concerns': [
                 'Unable to perform detailed risk analysis without AI',
                 'Professional legal review recommended'
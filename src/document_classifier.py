@@ -0,0 +1,103 @@
+"""
+Document Classifier Module
+Scores legal document types in one pass with a precompiled weighted lexicon
+"""
+
+import os
+import re
+import json
+import logging
+from collections import namedtuple
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TYPE = 'Legal Document'
+
+# Category -> {term: weight}. Terms match on word boundaries, case-insensitively.
+DEFAULT_LEXICON = {
+    'Contract/Agreement': {
+        'agreement': 1.0, 'contract': 1.5, 'parties': 0.5, 'hereinafter': 0.5,
+        'consideration': 0.5, 'in witness whereof': 1.0, 'services': 0.5
+    },
+    'Lease Agreement': {
+        'lease': 3.0, 'lessor': 3.0, 'lessee': 3.0, 'landlord': 3.0, 'tenant': 3.0,
+        'premises': 1.5, 'rent': 2.0, 'security deposit': 2.0, 'sublet': 2.0
+    },
+    'Non-Disclosure Agreement': {
+        'nda': 4.0, 'non-disclosure': 4.0, 'nondisclosure': 4.0, 'confidentiality agreement': 4.0,
+        'confidential information': 2.5, 'disclosing party': 3.0, 'receiving party': 3.0
+    },
+    'Will/Testament': {
+        'last will': 4.0, 'testament': 4.0, 'testator': 4.0, 'testatrix': 4.0, 'bequeath': 3.0,
+        'executor': 2.0, 'probate': 2.0, 'beneficiary': 1.0, 'codicil': 3.0
+    },
+    'Employment Document': {
+        'employment': 2.5, 'employee': 2.0, 'employer': 2.0, 'salary': 2.0,
+        'job title': 2.0, 'probationary period': 2.0, 'non-compete': 1.5, 'severance': 1.5
+    }
+}
+
+DocumentTypeScore = namedtuple('DocumentTypeScore', ['document_type', 'score', 'confidence'])
+
+
+class DocumentClassifier:
+    """Ranks document types by weighted term matches found in a single regex pass"""
+
+    def __init__(self, lexicon: Dict[str, Dict[str, float]] = None, min_score: float = 1.0,
+                 max_chars: int = 50000):
+        """Compile the lexicon into one alternation"""
+        self.lexicon = lexicon or DEFAULT_LEXICON
+        self.min_score = min_score
+        self.max_chars = max_chars
+
+        self._weights = {}
+        for category, terms in self.lexicon.items():
+            for term, weight in terms.items():
+                self._weights.setdefault(self._normalize(term), []).append((category, weight))
+
+        # Longest terms first so multi-word phrases win over their prefixes
+        alternation = '|'.join(
+            r'\s+'.join(re.escape(word) for word in term.split())
+            for term in sorted(self._weights, key=len, reverse=True)
+        )
+        self._pattern = re.compile(rf'\b(?:{alternation})\b', re.IGNORECASE)
+
+    @classmethod
+    def from_env(cls) -> 'DocumentClassifier':
+        """Build a classifier, loading DOCUMENT_LEXICON_PATH (JSON) when set"""
+        lexicon = None
+        path = os.getenv('DOCUMENT_LEXICON_PATH')
+        if path:
+            with open(path, 'r', encoding='utf-8') as file:
+                lexicon = json.load(file)
+        return cls(
+            lexicon=lexicon,
+            min_score=float(os.getenv('DOCUMENT_TYPE_MIN_SCORE', 1.0)),
+            max_chars=int(os.getenv('DOCUMENT_TYPE_MAX_CHARS', 50000))
+        )
+
+    @staticmethod
+    def _normalize(term: str) -> str:
+        return ' '.join(term.lower().split())
+
+    def rank(self, text: str) -> List[DocumentTypeScore]:
+        """Score every category and return them best first with normalized confidence"""
+        scores = dict.fromkeys(self.lexicon, 0.0)
+        for match in self._pattern.finditer(text, 0, self.max_chars):
+            for category, weight in self._weights[self._normalize(match.group())]:
+                scores[category] += weight
+
+        total = sum(scores.values())
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [
+            DocumentTypeScore(category, score, round(score / total, 3) if total else 0.0)
+            for category, score in ranked if score > 0
+        ]
+
+    def classify(self, text: str) -> DocumentTypeScore:
+        """Best document type, or the generic type when nothing scores high enough"""
+        ranked = self.rank(text)
+        if not ranked or ranked[0].score < self.min_score:
+            return DocumentTypeScore(DEFAULT_TYPE, 0.0, 0.0)
+        return ranked[0]
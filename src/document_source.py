@@ -0,0 +1,151 @@
+"""
+Document Source Module
+Wraps uploaded documents held in memory or spooled to a temporary file
+"""
+
+import io
+import os
+import mmap
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_spool_threshold() -> int:
+    """Upload size in bytes above which uploads are spooled to disk"""
+    return int(os.getenv('UPLOAD_SPOOL_THRESHOLD_KB', 1024)) * 1024
+
+
+class DocumentSource:
+    """A document's bytes, either in memory or in a memory-mapped file"""
+
+    def __init__(self, filename: str, data: Union[bytes, bytearray, memoryview] = None,
+                 path: str = None, owns_path: bool = False):
+        """Initialize from in-memory data or a file path"""
+        self.filename = filename
+        self.path = path
+        self._data = data
+        self._owns_path = owns_path
+        self._mmap = None
+        self._file = None
+
+    @classmethod
+    def from_path(cls, path: str, filename: str = None) -> 'DocumentSource':
+        """Wrap an existing file; the file is left in place on close"""
+        return cls(filename or os.path.basename(path), path=path)
+
+    @classmethod
+    def from_bytes(cls, data: Union[bytes, bytearray, memoryview], filename: str) -> 'DocumentSource':
+        """Wrap an in-memory buffer without copying it"""
+        return cls(filename, data=data)
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, filename: str, spool_threshold: int = None,
+                    spool_dir: str = None) -> 'DocumentSource':
+        """Read an upload stream, spooling to a unique temp file above the threshold"""
+        if spool_threshold is None:
+            spool_threshold = get_spool_threshold()
+
+        head = stream.read(spool_threshold + 1)
+        if len(head) <= spool_threshold:
+            return cls(filename, data=head)
+
+        suffix = '.' + filename.rsplit('.', 1)[-1] if '.' in filename else ''
+        fd, path = tempfile.mkstemp(prefix='jollybot-', suffix=suffix, dir=spool_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(head)
+                shutil.copyfileobj(stream, out, READ_CHUNK_SIZE)
+        except Exception:
+            os.remove(path)
+            raise
+        logger.info("Spooled upload %s to %s", filename, path)
+        return cls(filename, path=path, owns_path=True)
+
+    @property
+    def extension(self) -> str:
+        """Lower-case file extension without the dot"""
+        return self.filename.lower().split('.')[-1]
+
+    @property
+    def size(self) -> int:
+        """Document size in bytes"""
+        if self.path is None:
+            return len(self._data)
+        return os.path.getsize(self.path)
+
+    @property
+    def buffer(self) -> Union[bytes, bytearray, memoryview, mmap.mmap]:
+        """Bytes-like view of the whole document; file-backed sources are memory-mapped"""
+        if self.path is None:
+            return self._data
+        if self._mmap is None:
+            if self.size == 0:
+                return b''
+            self._file = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    @property
+    def location(self) -> Union[str, bytes, bytearray, memoryview]:
+        """File path for file-backed sources, otherwise the in-memory buffer"""
+        return self.path if self.path is not None else self._data
+
+    def open(self) -> BinaryIO:
+        """Open a fresh seekable binary stream over the document"""
+        if self.path is None:
+            return io.BytesIO(self._data)
+        return open(self.path, 'rb')
+
+    def close(self):
+        """Release the memory map and remove any spooled temp file"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._owns_path and self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self) -> 'DocumentSource':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+@contextmanager
+def open_document(source: Union[str, bytes, bytearray, memoryview, BinaryIO, DocumentSource],
+                  filename: Optional[str] = None) -> Iterator[DocumentSource]:
+    """Coerce a path, buffer or stream into a DocumentSource for the duration of a block
+
+    Sources passed in as DocumentSource are left open for their owner to close.
+    """
+    if isinstance(source, DocumentSource):
+        yield source
+        return
+
+    if isinstance(source, (str, os.PathLike)):
+        document = DocumentSource.from_path(os.fspath(source), filename)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        if not filename:
+            raise ValueError("A filename is required to analyze an in-memory document")
+        document = DocumentSource.from_bytes(source, filename)
+    else:
+        name = getattr(source, 'name', None)
+        filename = filename or (os.path.basename(name) if isinstance(name, str) else None)
+        if not filename:
+            raise ValueError("A filename is required to analyze a document stream")
+        document = DocumentSource.from_stream(source, filename)
+
+    try:
+        yield document
+    finally:
+        document.close()
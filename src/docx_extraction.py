@@ -0,0 +1,134 @@
+"""
+DOCX Extraction Module
+Streaming text extraction from the XML parts of a DOCX package
+"""
+
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Iterator, List
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+
+DOCUMENT_PART = 'word/document.xml'
+NOTE_PARTS = ('word/footnotes.xml', 'word/endnotes.xml')
+HEADER_PART = re.compile(r'^word/header(\d*)\.xml$')
+FOOTER_PART = re.compile(r'^word/footer(\d*)\.xml$')
+
+# Run content that stands for a character
+RUN_CHARACTERS = {W + 'tab': '\t', W + 'br': '\n', W + 'cr': '\n', W + 'noBreakHyphen': '-'}
+CELL_SEPARATOR = ' | '
+
+
+def iter_part_lines(part: BinaryIO) -> Iterator[str]:
+    """Yield the paragraphs of one WordprocessingML part in document order
+
+    Table rows are yielded as one line with their cells separated by
+    CELL_SEPARATOR. Elements are discarded as soon as each top-level paragraph
+    or table is finished, so memory stays bounded by the largest table.
+    """
+    paragraphs = []     # text buffers of the open (possibly nested, e.g. text box) paragraphs
+    tables = []         # open tables: per table, [cells of the current row, paragraphs of the current cell]
+    fallback_depth = 0  # inside mc:Fallback, which repeats the mc:Choice content
+    container = None    # element whose children are the top-level blocks (w:body, w:hdr, w:footnote...)
+    container_depth = 0
+    depth = 0
+    ready = []
+
+    for event, elem in ET.iterparse(part, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            depth += 1
+            if tag == MC_FALLBACK:
+                fallback_depth += 1
+            elif fallback_depth:
+                continue
+            elif tag == W + 'p':
+                paragraphs.append([])
+            elif tag == W + 'tbl':
+                tables.append([[], []])
+            elif tag in (W + 'body', W + 'hdr', W + 'ftr', W + 'footnote', W + 'endnote'):
+                container, container_depth = elem, depth
+            continue
+
+        depth -= 1
+        if tag == MC_FALLBACK:
+            fallback_depth -= 1
+        elif fallback_depth:
+            pass
+        elif tag == W + 't':
+            if paragraphs and elem.text:
+                paragraphs[-1].append(elem.text)
+        elif tag in RUN_CHARACTERS:
+            if paragraphs:
+                paragraphs[-1].append(RUN_CHARACTERS[tag])
+        elif tag == W + 'p':
+            text = ''.join(paragraphs.pop()).strip()
+            if tables:
+                if text:
+                    tables[-1][1].append(text)
+            else:
+                ready.append(text)
+        elif tag == W + 'tc':
+            row, cell = tables[-1]
+            row.append(' '.join(cell))
+            tables[-1][1] = []
+        elif tag == W + 'tr':
+            row = tables[-1][0]
+            tables[-1][0] = []
+            line = CELL_SEPARATOR.join(row) if any(row) else ''
+            if len(tables) > 1:
+                # A nested table's rows become paragraphs of the enclosing cell
+                if line:
+                    tables[-2][1].append(line)
+            else:
+                ready.append(line)
+        elif tag == W + 'tbl':
+            tables.pop()
+
+        if container is not None and depth == container_depth:
+            # A top-level block just ended; drop it and everything before it
+            container.clear()
+        if ready:
+            yield from ready
+            ready = []
+
+
+def _numbered_parts(names: List[str], pattern) -> List[str]:
+    """Part names matching ``pattern`` ordered by their number (header1, header2, ...)"""
+    numbered = [(int(match.group(1) or 0), name) for name, match in ((name, pattern.match(name)) for name in names)
+                if match]
+    return [name for _, name in sorted(numbered)]
+
+
+def iter_docx_lines(stream: BinaryIO) -> Iterator[str]:
+    """Yield the non-empty lines of a DOCX: headers, body, footnotes and endnotes, then footers
+
+    Header and footer lines repeated across sections are yielded once.
+    """
+    with zipfile.ZipFile(stream) as package:
+        names = package.namelist()
+        if DOCUMENT_PART not in names:
+            raise ValueError("Not a Word document: word/document.xml is missing")
+
+        parts = ([(name, True) for name in _numbered_parts(names, HEADER_PART)]
+                 + [(DOCUMENT_PART, False)]
+                 + [(name, False) for name in NOTE_PARTS if name in names]
+                 + [(name, True) for name in _numbered_parts(names, FOOTER_PART)])
+        seen = set()
+        for name, repeated in parts:
+            with package.open(name) as part:
+                for line in iter_part_lines(part):
+                    if not line:
+                        continue
+                    if repeated:
+                        if line in seen:
+                            continue
+                        seen.add(line)
+                    yield line
+
+
+def extract_docx_text(stream: BinaryIO) -> str:
+    """Text of a DOCX, one paragraph or table row per line"""
+    return '\n'.join(iter_docx_lines(stream))
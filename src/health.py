@@ -0,0 +1,77 @@
+"""
+Health Module
+Dependency readiness checks with cached results for the /health endpoint
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+UP = 'up'
+DOWN = 'down'
+DISABLED = 'disabled'
+
+
+class HealthChecker:
+    """Runs registered dependency probes, caching each result for ``ttl_seconds``
+
+    A probe returns ``'up'`` or ``'disabled'`` and raises when the dependency
+    is unavailable. Caching keeps frequent load balancer polls from turning
+    into calls to OpenAI or Twilio.
+    """
+
+    def __init__(self, ttl_seconds: float = 30.0):
+        """Initialize with no checks"""
+        self.ttl_seconds = ttl_seconds
+        self._checks = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'HealthChecker':
+        """Build a checker from HEALTH_CHECK_TTL_SECONDS"""
+        return cls(ttl_seconds=float(os.getenv('HEALTH_CHECK_TTL_SECONDS', 30)))
+
+    def register(self, name: str, probe: Callable[[], str], required: bool = False):
+        """Add a dependency; a failing required dependency makes the service unhealthy"""
+        self._checks[name] = (probe, required)
+
+    def _check(self, name: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            cached = self._results.get(name)
+        if cached is not None and now - cached['checked_at'] < self.ttl_seconds:
+            return cached
+
+        probe, required = self._checks[name]
+        started = time.perf_counter()
+        try:
+            result = {'status': probe() or UP}
+        except Exception as e:
+            logger.warning("Health check %s failed: %s", name, e)
+            result = {'status': DOWN, 'error': str(e)}
+        result.update({
+            'required': required,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+            'checked_at': now
+        })
+        with self._lock:
+            self._results[name] = result
+        return result
+
+    def report(self) -> Tuple[Dict[str, Any], bool]:
+        """Overall status with per-dependency results, and whether the service is ready"""
+        dependencies = {name: self._check(name) for name in self._checks}
+        down = [name for name, result in dependencies.items() if result['status'] == DOWN]
+        ready = not any(dependencies[name]['required'] for name in down)
+        if not down:
+            status = 'healthy'
+        elif ready:
+            status = 'degraded'
+        else:
+            status = 'unhealthy'
+        return {'status': status, 'dependencies': dependencies}, ready
@@ -0,0 +1,256 @@
+"""
+Job Queue Module
+Runs document analysis jobs off the request thread and tracks their status
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional
+
+from src.structured_logging import correlation, stage_timings
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the queue is at its maximum depth"""
+
+
+class Job:
+    """A unit of work submitted to the job queue"""
+
+    def __init__(self, job_id: str, metadata: Dict[str, Any] = None):
+        """Initialize a queued job"""
+        self.id = job_id
+        self.status = 'queued'
+        self.metadata = metadata or {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the job has finished, successfully or not"""
+        return self.status in ('completed', 'failed')
+
+    def to_record(self) -> str:
+        """Serialize the job's state for the shared job table"""
+        return json.dumps({
+            'status': self.status, 'metadata': self.metadata, 'result': self.result, 'error': self.error,
+            'created_at': self.created_at, 'started_at': self.started_at, 'finished_at': self.finished_at
+        })
+
+    @classmethod
+    def from_record(cls, job_id: str, record: str) -> 'Job':
+        """Rebuild a job written by ``to_record``, possibly in another process"""
+        fields = json.loads(record)
+        job = cls(job_id, fields.pop('metadata'))
+        for name, value in fields.items():
+            setattr(job, name, value)
+        return job
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the job for the status API"""
+        now = time.time()
+        timing = {
+            'queued_ms': round(((self.started_at or now) - self.created_at) * 1000, 1)
+        }
+        if self.started_at is not None:
+            timing['run_ms'] = round(((self.finished_at or now) - self.started_at) * 1000, 1)
+        if self.finished_at is not None:
+            timing['total_ms'] = round((self.finished_at - self.created_at) * 1000, 1)
+
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'timing': timing
+        }
+        data.update(self.metadata)
+        if self.status == 'completed':
+            data['result'] = self.result
+        elif self.status == 'failed':
+            data['error'] = self.error
+        return data
+
+
+class ThreadPoolBackend:
+    """Default backend running jobs on an in-process thread pool
+
+    Any object with ``submit(fn)`` and ``shutdown()`` can be used as a backend,
+    e.g. one that forwards work to a separately scaled worker service.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        """Initialize the thread pool"""
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jollybot-job')
+
+    def submit(self, fn: Callable[[], None]):
+        """Schedule a zero-argument callable"""
+        self._executor.submit(fn)
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work and optionally wait for running jobs"""
+        self._executor.shutdown(wait=wait)
+
+
+class JobQueue:
+    """Bounded job queue with status tracking and backpressure
+
+    With ``db_path`` set, job state is also written to a SQLite table so a
+    status poll answered by another server worker process finds the job.
+    """
+
+    def __init__(self, backend=None, max_depth: int = 32, max_retained: int = 1000,
+                 db_path: Optional[str] = None):
+        """Initialize the queue with a worker backend"""
+        self.backend = backend or ThreadPoolBackend()
+        self.max_depth = max_depth
+        self.max_retained = max_retained
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, record TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created)')
+            self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> 'JobQueue':
+        """Build a queue from JOB_* environment variables
+
+        Job state is shared through JOB_DB, or the analysis cache's SQLite
+        file when only ANALYSIS_CACHE_DB is set.
+        """
+        return cls(
+            backend=ThreadPoolBackend(max_workers=int(os.getenv('JOB_WORKERS', 4))),
+            max_depth=int(os.getenv('JOB_QUEUE_MAX_DEPTH', 32)),
+            db_path=os.getenv('JOB_DB') or os.getenv('ANALYSIS_CACHE_DB') or None
+        )
+
+    def submit(self, func: Callable[..., Any], *args,
+               metadata: Dict[str, Any] = None, cleanup: Callable[[], None] = None) -> Job:
+        """Enqueue ``func(*args)`` and return its job, or raise QueueFullError"""
+        with self._lock:
+            if self._pending >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({self.max_depth} pending jobs)")
+            job = Job(uuid.uuid4().hex, metadata)
+            self._jobs[job.id] = job
+            self._pending += 1
+            self._prune()
+            self._save(job)
+
+        try:
+            self.backend.submit(lambda: self._run(job, func, args, cleanup))
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self._jobs.pop(job.id, None)
+                if self._db is not None:
+                    self._db.execute('DELETE FROM jobs WHERE id = ?', (job.id,))
+                    self._db.commit()
+            raise
+        # Logged under the submitting request's id; the job's own records use the job id
+        logger.info("Queued job %s", job.id, extra={'sample': True})
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id, including jobs submitted to other processes sharing the job table"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None or self._db is None:
+                return job
+            row = self._db.execute('SELECT record FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return Job.from_record(job_id, row[0]) if row is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth and job counts by status"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                'pending': self._pending,
+                'max_depth': self.max_depth,
+                'jobs': counts
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Shut down the worker backend"""
+        self.backend.shutdown(wait=wait)
+        if wait and self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def _run(self, job: Job, func: Callable[..., Any], args: tuple, cleanup: Optional[Callable[[], None]]):
+        """Execute a job, with its log records correlated by the job id"""
+        with correlation(job.id):
+            self._execute(job, func, args, cleanup)
+
+    def _execute(self, job: Job, func: Callable[..., Any], args: tuple, cleanup: Optional[Callable[[], None]]):
+        """Run a job's function and record its outcome"""
+        job.status = 'running'
+        job.started_at = time.time()
+        with self._lock:
+            self._save(job)
+        try:
+            job.result = func(*args)
+            job.status = 'completed'
+        except Exception as e:
+            logger.error("Job %s failed: %s", job.id, e)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            if cleanup:
+                try:
+                    cleanup()
+                except Exception as e:
+                    logger.warning("Job %s cleanup failed: %s", job.id, e)
+            with self._lock:
+                self._pending -= 1
+                self._save(job)
+            logger.info("Job %s %s in %.0f ms", job.id, job.status, (job.finished_at - job.created_at) * 1000,
+                        extra={'stages': stage_timings()})
+
+    def _save(self, job: Job):
+        """Write a job's state to the shared job table, if any (lock held)"""
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                'INSERT OR REPLACE INTO jobs (id, status, record, created) VALUES (?, ?, ?, ?)',
+                (job.id, job.status, job.to_record(), job.created_at)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning("Could not store job %s state: %s", job.id, e)
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the retention limit (lock held)"""
+        if self._db is not None:
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND id NOT IN "
+                "(SELECT id FROM jobs ORDER BY created DESC LIMIT ?)", (self.max_retained,)
+            )
+        excess = len(self._jobs) - self.max_retained
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done][:excess]:
+            del self._jobs[job_id]
@@ -0,0 +1,419 @@
+"""
+LLM Client Module
+Pooled OpenAI chat client with rate limiting, retries, hedging and call metrics
+"""
+
+import os
+import abc
+import sys
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, List, Optional
+
+from src.chunking import count_tokens
+from src.metrics import IN_FLIGHT_LLM_CALLS, LLM_LATENCY_SECONDS, PROMPT_TOKENS
+from src.rate_limit import TokenBucket
+from src.structured_logging import record_stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# Upper bound on how long a single Retry-After header may make us wait
+MAX_RETRY_AFTER_SECONDS = 60.0
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read the server's requested delay from a failed response, if any"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed call is worth retrying"""
+    openai = sys.modules.get('openai')
+    if openai is None:
+        # The SDK is imported with the first client, so this cannot be one of its errors
+        return False
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+class LLMCallMetrics:
+    """Aggregate and recent per-call latency and token metrics"""
+
+    def __init__(self, history: int = 500):
+        """Initialize empty counters"""
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=history)
+        self._totals = {
+            'calls': 0,
+            'failures': 0,
+            'retries': 0,
+            'hedged': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0
+        }
+
+    def record(self, latency_ms: float, attempts: int, success: bool, hedged: bool = False,
+               prompt_tokens: int = 0, completion_tokens: int = 0):
+        """Record the outcome of one logical call (including its retries)"""
+        with self._lock:
+            self._latencies.append(latency_ms)
+            self._totals['calls'] += 1
+            self._totals['retries'] += attempts - 1
+            self._totals['failures'] += 0 if success else 1
+            self._totals['hedged'] += 1 if hedged else 0
+            self._totals['prompt_tokens'] += prompt_tokens
+            self._totals['completion_tokens'] += completion_tokens
+        LLM_LATENCY_SECONDS.labels(outcome='success' if success else 'failure').observe(latency_ms / 1000)
+        if prompt_tokens:
+            PROMPT_TOKENS.observe(prompt_tokens)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return totals plus latency percentiles over recent calls"""
+        with self._lock:
+            data = dict(self._totals)
+            latencies = sorted(self._latencies)
+        if latencies:
+            data['latency_ms'] = {
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': latencies[-1]
+            }
+        return data
+
+
+class _BaseLLMClient(abc.ABC):
+    """Configuration and policy shared by the sync and async clients"""
+
+    def __init__(self, api_key: str = None, model: str = DEFAULT_MODEL, base_url: str = None,
+                 timeout: float = 60.0, max_retries: int = 3, backoff_base: float = 0.5,
+                 backoff_max: float = 20.0, requests_per_minute: int = None,
+                 tokens_per_minute: int = None, hedge_after: float = None,
+                 max_connections: int = 20, client=None):
+        """Initialize the client; ``client`` injects a pre-built OpenAI-compatible SDK client"""
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.request_bucket = TokenBucket.per_minute(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket.per_minute(tokens_per_minute) if tokens_per_minute else None
+        self.metrics = LLMCallMetrics()
+        self._http_client = None
+        self._sdk_client = client
+        self._sdk_settings = (api_key, base_url, timeout, max_connections)
+        self._sdk_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Build a client from OPENAI_* environment variables"""
+        rpm = os.getenv('OPENAI_RPM')
+        tpm = os.getenv('OPENAI_TPM')
+        hedge_ms = os.getenv('OPENAI_HEDGE_AFTER_MS')
+        settings = {
+            'api_key': os.getenv('OPENAI_API_KEY'),
+            'model': os.getenv('OPENAI_MODEL', DEFAULT_MODEL),
+            'base_url': os.getenv('OPENAI_BASE_URL') or None,
+            'timeout': float(os.getenv('OPENAI_TIMEOUT_SECONDS', 60)),
+            'max_retries': int(os.getenv('OPENAI_MAX_RETRIES', 3)),
+            'requests_per_minute': int(rpm) if rpm else None,
+            'tokens_per_minute': int(tpm) if tpm else None,
+            'hedge_after': int(hedge_ms) / 1000.0 if hedge_ms else None,
+            'max_connections': int(os.getenv('OPENAI_MAX_CONNECTIONS', 20))
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+    @property
+    def _client(self):
+        """SDK client, built on first use so the SDK is only imported when a model call is made"""
+        if self._sdk_client is None:
+            with self._sdk_lock:
+                if self._sdk_client is None:
+                    self._sdk_client = self._build_client(*self._sdk_settings)
+        return self._sdk_client
+
+    @abc.abstractmethod
+    def _build_client(self, api_key: str, base_url: str, timeout: float, max_connections: int):
+        """Create the sync or async OpenAI SDK client"""
+
+    def _limits(self, max_connections: int):
+        import httpx
+        return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+    def _params(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                model: Optional[str], stream: bool, extra: Dict[str, Any]) -> Dict[str, Any]:
+        params = {
+            'model': model or self.model,
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'temperature': temperature
+        }
+        if stream:
+            params['stream'] = True
+        params.update(extra)
+        return params
+
+    def _estimate_request_tokens(self, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Tokens a request may consume against the TPM limit"""
+        return sum(count_tokens(message['content']) for message in messages) + max_tokens
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up"""
+        if attempt > self.max_retries or not is_retryable(error):
+            return None
+        requested = retry_after_seconds(error)
+        if requested is not None:
+            return min(requested, MAX_RETRY_AFTER_SECONDS)
+        # Exponential backoff with jitter so concurrent callers do not retry in lockstep
+        return min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+    def _settle_usage(self, response, reserved_tokens: int) -> tuple:
+        """Refund over-reserved TPM tokens and return (prompt, completion) token counts"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return 0, 0
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        if self.token_bucket is not None and reserved_tokens > prompt_tokens + completion_tokens:
+            self.token_bucket.refund(reserved_tokens - prompt_tokens - completion_tokens)
+        return prompt_tokens, completion_tokens
+
+    def _settle_hedge_loser(self, reserved_tokens: int, future):
+        """Settle the TPM reservation of a hedged request whose response is not used
+
+        Works for both concurrent futures and asyncio tasks; cancelled or failed
+        requests get their whole reservation back.
+        """
+        if future.cancelled() or future.exception() is not None:
+            if self.token_bucket is not None:
+                self.token_bucket.refund(reserved_tokens)
+        else:
+            self._settle_usage(future.result(), reserved_tokens)
+
+
+class LLMClient(_BaseLLMClient):
+    """Synchronous chat client sharing one pooled HTTP connection pool"""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the client and, when hedging is on, its request threads (started on first use)"""
+        super().__init__(*args, **kwargs)
+        self._hedge_pool = (ThreadPoolExecutor(max_workers=8, thread_name_prefix='jollybot-hedge')
+                            if self.hedge_after else None)
+
+    def _build_client(self, api_key: str, base_url: str, timeout: float, max_connections: int):
+        import httpx
+        import openai
+        self._http_client = httpx.Client(limits=self._limits(max_connections), timeout=timeout)
+        return openai.OpenAI(api_key=api_key, base_url=base_url, http_client=self._http_client,
+                             max_retries=0)
+
+    def complete(self, messages: List[Dict[str, str]], max_tokens: int = 1000, temperature: float = 0.3,
+                 model: str = None, stream: bool = False, **extra):
+        """Create a chat completion, waiting for rate limits and retrying transient failures"""
+        params = self._params(messages, max_tokens, temperature, model, stream, extra)
+        reserved = self._estimate_request_tokens(messages, max_tokens)
+        if self.token_bucket is not None:
+            self.token_bucket.acquire(reserved)
+
+        started = time.perf_counter()
+        attempt = 0
+        hedged = False
+        IN_FLIGHT_LLM_CALLS.inc()
+        try:
+            while True:
+                attempt += 1
+                if self.request_bucket is not None:
+                    self.request_bucket.acquire()
+                try:
+                    if self.hedge_after and not stream:
+                        response, hedged = self._hedged_create(params, reserved)
+                    else:
+                        response = self._client.chat.completions.create(**params)
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        self.metrics.record((time.perf_counter() - started) * 1000, attempt, False, hedged)
+                        raise
+                    logger.warning("LLM call failed (%s); retry %s/%s in %.2fs", e, attempt, self.max_retries, delay)
+                    time.sleep(delay)
+        finally:
+            IN_FLIGHT_LLM_CALLS.dec()
+            record_stage('llm', time.perf_counter() - started)
+
+        prompt_tokens, completion_tokens = self._settle_usage(response, reserved)
+        self.metrics.record((time.perf_counter() - started) * 1000, attempt, True, hedged,
+                            prompt_tokens, completion_tokens)
+        return response
+
+    def _hedged_create(self, params: Dict[str, Any], reserved: int) -> tuple:
+        """Send a backup request if the first is slower than ``hedge_after``; first success wins
+
+        The backup reserves its own ``reserved`` TPM tokens; whichever request
+        loses is cancelled if it has not started and settled once it finishes.
+        """
+        create = self._client.chat.completions.create
+
+        primary = self._hedge_pool.submit(create, **params)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result(), False
+
+        if self.request_bucket is not None:
+            self.request_bucket.acquire()
+        if self.token_bucket is not None:
+            self.token_bucket.acquire(reserved)
+        backup = self._hedge_pool.submit(create, **params)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    loser = backup if future is primary else primary
+                    loser.cancel()
+                    loser.add_done_callback(partial(self._settle_hedge_loser, reserved))
+                    return future.result(), True
+                error = error or future.exception()
+        # Both failed: the backup's reservation goes back, the primary's stays with the call
+        if self.token_bucket is not None:
+            self.token_bucket.refund(reserved)
+        raise error
+
+    def ping(self, timeout: float = 5.0):
+        """Cheap authenticated request used by readiness checks; raises when the API is unreachable"""
+        self._client.with_options(timeout=timeout).models.list()
+
+    def close(self):
+        """Close pooled connections and helper threads"""
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        if self._http_client is not None:
+            self._http_client.close()
+
+
+class AsyncLLMClient(_BaseLLMClient):
+    """asyncio chat client with the same policies as LLMClient"""
+
+    def _build_client(self, api_key: str, base_url: str, timeout: float, max_connections: int):
+        import httpx
+        import openai
+        self._http_client = httpx.AsyncClient(limits=self._limits(max_connections), timeout=timeout)
+        return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._http_client,
+                                  max_retries=0)
+
+    async def complete(self, messages: List[Dict[str, str]], max_tokens: int = 1000, temperature: float = 0.3,
+                       model: str = None, stream: bool = False, **extra):
+        """Create a chat completion, waiting for rate limits and retrying transient failures"""
+        params = self._params(messages, max_tokens, temperature, model, stream, extra)
+        reserved = self._estimate_request_tokens(messages, max_tokens)
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire_async(reserved)
+
+        started = time.perf_counter()
+        attempt = 0
+        hedged = False
+        IN_FLIGHT_LLM_CALLS.inc()
+        try:
+            while True:
+                attempt += 1
+                if self.request_bucket is not None:
+                    await self.request_bucket.acquire_async()
+                try:
+                    if self.hedge_after and not stream:
+                        response, hedged = await self._hedged_create(params, reserved)
+                    else:
+                        response = await self._client.chat.completions.create(**params)
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        self.metrics.record((time.perf_counter() - started) * 1000, attempt, False, hedged)
+                        raise
+                    logger.warning("LLM call failed (%s); retry %s/%s in %.2fs", e, attempt, self.max_retries, delay)
+                    await asyncio.sleep(delay)
+        finally:
+            IN_FLIGHT_LLM_CALLS.dec()
+            record_stage('llm', time.perf_counter() - started)
+
+        prompt_tokens, completion_tokens = self._settle_usage(response, reserved)
+        self.metrics.record((time.perf_counter() - started) * 1000, attempt, True, hedged,
+                            prompt_tokens, completion_tokens)
+        return response
+
+    async def _hedged_create(self, params: Dict[str, Any], reserved: int) -> tuple:
+        """Send a backup request if the first is slower than ``hedge_after``; the loser is cancelled
+
+        The backup reserves its own ``reserved`` TPM tokens, which are refunded
+        when it is cancelled or fails, or settled against its usage otherwise.
+        """
+        primary = asyncio.ensure_future(self._client.chat.completions.create(**params))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result(), False
+
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire_async()
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire_async(reserved)
+        backup = asyncio.ensure_future(self._client.chat.completions.create(**params))
+        pending = {primary, backup}
+        loser = backup
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        loser = backup if task is primary else primary
+                        return task.result(), True
+                    error = error or task.exception()
+            raise error
+        finally:
+            # Without a winner the backup's reservation goes back, the primary's stays with the call
+            loser.add_done_callback(partial(self._settle_hedge_loser, reserved))
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        """Close pooled connections"""
+        if self._http_client is not None:
+            await self._http_client.aclose()
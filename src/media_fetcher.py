@@ -0,0 +1,124 @@
+"""
+Media Fetcher Module
+Downloads WhatsApp media attachments over a pooled HTTP session
+"""
+
+import os
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+from src.document_source import DocumentSource
+from src.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Media content types accepted for analysis, mapped to the extension the analyzer expects
+MEDIA_EXTENSIONS = {
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'text/plain': 'txt'
+}
+
+# Where Twilio serves media; redirects from there to its CDN are followed without credentials
+TWILIO_MEDIA_ORIGIN = ('https', 'api.twilio.com')
+
+
+class MediaTooLargeError(ValueError):
+    """Raised when an attachment exceeds the upload size limit"""
+
+
+class UntrustedMediaUrlError(ValueError):
+    """Raised for media URLs outside the Twilio API, which must never receive the account credentials"""
+
+
+def url_origin(url: str) -> Tuple[str, str]:
+    """(scheme, host[:port]) of a URL, lower-cased"""
+    parts = urlsplit(url or '')
+    return parts.scheme.lower(), parts.netloc.lower()
+
+
+class _LimitedReader:
+    """File-like view of a response body that raises MediaTooLargeError once more than ``limit`` bytes are read"""
+
+    def __init__(self, raw, limit: int):
+        self._raw = raw
+        self._limit = limit
+        self._read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        self._read += len(data)
+        if self._read > self._limit:
+            raise MediaTooLargeError(f"Media exceeds {self._limit} bytes")
+        return data
+
+
+def media_extension(content_type: str) -> Optional[str]:
+    """Extension for a media content type, or None if it cannot be analyzed"""
+    return MEDIA_EXTENSIONS.get((content_type or '').split(';')[0].strip().lower())
+
+
+class MediaFetcher:
+    """Streams media URLs into DocumentSource objects, reusing pooled connections
+
+    Only URLs on ``allowed_origins`` (the Twilio API by default) are fetched,
+    since the webhook's MediaUrl fields decide where the credentials are sent.
+    """
+
+    def __init__(self, auth: Tuple[str, str] = None, timeout: float = 30.0,
+                 max_bytes: int = 10 * 1024 * 1024, pool_size: int = 10,
+                 session: requests.Session = None, allowed_origins: Iterable[Tuple[str, str]] = None):
+        """Initialize with Twilio credentials (media URLs require basic auth) and limits"""
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.allowed_origins = set(allowed_origins) if allowed_origins is not None else {TWILIO_MEDIA_ORIGIN}
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        if auth is not None:
+            session.auth = auth
+        self.session = session
+
+    @classmethod
+    def from_env(cls) -> 'MediaFetcher':
+        """Build a fetcher from Twilio credentials and upload limits"""
+        account_sid = os.getenv('TWILIO_ACCOUNT_SID')
+        auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+        allowed_origins = {TWILIO_MEDIA_ORIGIN}
+        if os.getenv('TWILIO_API_BASE_URL'):
+            allowed_origins.add(url_origin(os.getenv('TWILIO_API_BASE_URL')))
+        return cls(
+            auth=(account_sid, auth_token) if account_sid and auth_token else None,
+            timeout=float(os.getenv('WHATSAPP_MEDIA_TIMEOUT_SECONDS', 30)),
+            max_bytes=get_settings().max_file_size_bytes,
+            allowed_origins=allowed_origins
+        )
+
+    def fetch(self, url: str, filename: str) -> DocumentSource:
+        """Download ``url`` into a DocumentSource, spooling large files to disk
+
+        Raises UntrustedMediaUrlError for URLs outside ``allowed_origins``,
+        MediaTooLargeError as soon as more than ``max_bytes`` arrive, and
+        requests exceptions for HTTP failures.
+        """
+        if url_origin(url) not in self.allowed_origins:
+            raise UntrustedMediaUrlError(f"Refusing to fetch media from {url_origin(url)[1] or url!r}")
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            length = response.headers.get('Content-Length')
+            if length is not None and int(length) > self.max_bytes:
+                raise MediaTooLargeError(f"Media is {length} bytes; limit is {self.max_bytes}")
+            response.raw.decode_content = True
+            document = DocumentSource.from_stream(_LimitedReader(response.raw, self.max_bytes), filename)
+
+        logger.info("Fetched media %s (%s bytes)", filename, document.size)
+        return document
+
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
@@ -0,0 +1,177 @@
+"""
+Message Dispatcher Module
+Runs background work on a thread pool or event loop while keeping tasks for the same key in order
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Any, Optional
+
+from src.job_queue import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDispatcher:
+    """Thread pool where tasks sharing a key (e.g. a phone number) run one at a time, in order
+
+    Different keys run concurrently; a key is drained by a single worker until
+    its queue is empty, so replies to one conversation are never reordered.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 1000):
+        """Initialize with a worker count and a bound on queued tasks"""
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jollybot-dispatch')
+        self._queues: Dict[str, deque] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0}
+
+    @classmethod
+    def from_env(cls) -> 'MessageDispatcher':
+        """Build a dispatcher from WHATSAPP_* environment variables"""
+        return cls(
+            max_workers=int(os.getenv('WHATSAPP_WORKERS', 4)),
+            max_pending=int(os.getenv('WHATSAPP_MAX_PENDING', 1000))
+        )
+
+    def submit(self, key: str, func: Callable, *args):
+        """Queue ``func(*args)`` behind any earlier tasks for ``key``
+
+        The task runs in a copy of the caller's context, so its log records keep
+        the correlation id of the webhook call that queued it. Raises
+        QueueFullError when ``max_pending`` tasks are already waiting.
+        """
+        context = contextvars.copy_context()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError(f"Dispatcher is full ({self.max_pending} pending tasks)")
+            self._pending += 1
+            self._stats['submitted'] += 1
+            queue = self._queues.get(key)
+            if queue is not None:
+                # A worker is already draining this key and will pick the task up
+                queue.append((context, func, args))
+                return
+            self._queues[key] = deque([(context, func, args)])
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key: str):
+        """Run queued tasks for one key until none are left"""
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                context, func, args = queue.popleft()
+            try:
+                context.run(func, *args)
+                outcome = 'completed'
+            except Exception as e:
+                logger.error("Dispatched task for %s failed: %s", key, e)
+                outcome = 'failed'
+            with self._lock:
+                self._pending -= 1
+                self._stats[outcome] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Pending and lifetime task counts"""
+        with self._lock:
+            return dict(self._stats, pending=self._pending, active_keys=len(self._queues))
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait until every queued task has run; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._pending == 0:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work and optionally wait for queued tasks"""
+        self._executor.shutdown(wait=wait)
+
+
+class AsyncMessageDispatcher:
+    """asyncio counterpart of MessageDispatcher: coroutines for the same key run one at a time, in order
+
+    Must be used from a running event loop; tasks are awaited on that loop
+    instead of occupying threads, so waiting on Twilio or the model is free.
+    """
+
+    def __init__(self, max_pending: int = 1000):
+        """Initialize with a bound on queued tasks"""
+        self.max_pending = max_pending
+        self._tails: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+        self._pending = 0
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0}
+
+    @classmethod
+    def from_env(cls) -> 'AsyncMessageDispatcher':
+        """Build a dispatcher from WHATSAPP_MAX_PENDING"""
+        return cls(max_pending=int(os.getenv('WHATSAPP_MAX_PENDING', 1000)))
+
+    def submit(self, key: str, func: Callable[..., Awaitable], *args):
+        """Schedule ``await func(*args)`` after any earlier tasks for ``key``
+
+        Raises QueueFullError when ``max_pending`` tasks are already waiting.
+        """
+        if self._pending >= self.max_pending:
+            raise QueueFullError(f"Dispatcher is full ({self.max_pending} pending tasks)")
+        self._pending += 1
+        self._stats['submitted'] += 1
+        task = asyncio.ensure_future(self._run(key, self._tails.get(key), func, args))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: str, previous: Optional[asyncio.Future], func: Callable[..., Awaitable], args: tuple):
+        if previous is not None:
+            # Earlier failures are already counted; they must not stop later tasks
+            await asyncio.wait({previous})
+        try:
+            await func(*args)
+            outcome = 'completed'
+        except Exception as e:
+            logger.error("Dispatched task for %s failed: %s", key, e)
+            outcome = 'failed'
+        self._pending -= 1
+        self._stats[outcome] += 1
+        if self._tails.get(key) is asyncio.current_task():
+            del self._tails[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Pending and lifetime task counts"""
+        return dict(self._stats, pending=self._pending, active_keys=len(self._tails))
+
+    async def join(self, timeout: float = None) -> bool:
+        """Wait until every queued task has run; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Tasks may queue more tasks (e.g. a reply split into parts), so check again after each wait
+            tasks = {task for task in self._tasks if not task.done()}
+            if not tasks:
+                return True
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            _, pending = await asyncio.wait(tasks, timeout=remaining)
+            if pending:
+                return False
+
+    async def shutdown(self, wait: bool = True):
+        """Wait for queued tasks, or cancel them"""
+        if wait:
+            await self.join()
+        for task in list(self._tasks):
+            task.cancel()
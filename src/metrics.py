@@ -0,0 +1,294 @@
+"""
+Metrics Module
+Low-overhead Prometheus-style counters, gauges and histograms with a text exposition endpoint
+"""
+
+import abc
+import math
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default latency buckets in seconds
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple[str, str] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric(abc.ABC):
+    """A named metric family whose labelled children are created on first use"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        """Initialize and register the family"""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A new child metric for one combination of label values"""
+
+    def labels(self, **labels):
+        """Child metric for one combination of label values"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        return self._children[()]
+
+    def collect(self) -> Iterator[str]:
+        """Exposition lines for this family"""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, child in list(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, key)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, key):
+        yield f"{name}{_format_labels(labelnames, key)} {_format_value(self.value)}"
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight"""
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def track_inprogress(self):
+        """Context manager counting the enclosed block while it runs"""
+        return self._default().track_inprogress()
+
+
+class _HistogramChild:
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name, labelnames, key):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels(labelnames, key, ('le', _format_value(bound)))} {cumulative}"
+        yield f"{name}_sum{_format_labels(labelnames, key)} {_format_value(total)}"
+        yield f"{name}_count{_format_labels(labelnames, key)} {cumulative}"
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = TIME_BUCKETS, registry=None):
+        """Initialize with upper bucket bounds (+Inf is implicit)"""
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        """Context manager observing the enclosed block's duration in seconds"""
+        return self._default().time()
+
+
+class _CallbackMetric:
+    """Gauge or counter whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, kind: str, callback: Callable[[], Dict[Tuple, float]],
+                 labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def collect(self) -> Iterator[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in values.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Registry:
+    """Collection of metric families rendered together for /metrics"""
+
+    def __init__(self):
+        """Initialize an empty registry"""
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric family; names must be unique"""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def register_callback(self, name: str, documentation: str, callback: Callable, kind: str = 'gauge',
+                          labelnames: Sequence[str] = ()):
+        """Expose values computed at scrape time, replacing any earlier callback of the same name
+
+        ``callback`` returns a number, or a dict of label value tuples to numbers.
+        """
+        with self._lock:
+            self._metrics[name] = _CallbackMetric(name, documentation, kind, callback, labelnames)
+
+    def render(self) -> str:
+        """Text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.collect())
+            except Exception:
+                # A failing callback must not take down the whole scrape
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 50 * 1024 ** 2)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+UPLOAD_SIZE = Histogram('jollybot_upload_size_bytes', 'Size of documents received for analysis',
+                        buckets=SIZE_BUCKETS)
+EXTRACTION_SECONDS = Histogram('jollybot_extraction_seconds', 'Text extraction time by document format',
+                               ['format'])
+PROMPT_TOKENS = Histogram('jollybot_prompt_tokens', 'Prompt tokens per model call', buckets=TOKEN_BUCKETS)
+PROMPT_TOKENS_SAVED = Counter('jollybot_prompt_tokens_saved_total', 'Document tokens removed by prompt compaction')
+LLM_LATENCY_SECONDS = Histogram('jollybot_llm_latency_seconds', 'Model call latency including retries',
+                                ['outcome'])
+PARSE_SECONDS = Histogram('jollybot_parse_seconds', 'Time to parse a model reply',
+                          buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+ANALYSIS_SECONDS = Histogram('jollybot_analysis_seconds', 'Legal analysis time per document')
+REQUEST_SECONDS = Histogram('jollybot_request_seconds', 'End-to-end HTTP request time',
+                            ['endpoint', 'method', 'status'])
+WEBHOOK_SECONDS = Histogram('jollybot_whatsapp_webhook_seconds', 'WhatsApp webhook handling time')
+
+MOCK_FALLBACKS = Counter('jollybot_mock_fallbacks_total', 'Analyses answered with the mock response', ['reason'])
+ERRORS = Counter('jollybot_errors_total', 'Errors by pipeline stage', ['stage'])
+CACHE_REQUESTS = Counter('jollybot_analysis_cache_requests_total', 'Analysis cache lookups', ['result'])
+NEAR_DUPLICATE_LOOKUPS = Counter('jollybot_near_duplicate_lookups_total',
+                                 'Near-duplicate index lookups for documents not in the analysis cache', ['result'])
+SCHEDULER_REJECTIONS = Counter('jollybot_scheduler_rejections_total', 'Requests shed by admission control',
+                               ['traffic_class', 'reason'])
+SCHEDULER_WAIT_SECONDS = Histogram('jollybot_scheduler_wait_seconds', 'Time analyses waited for a slot',
+                                   ['traffic_class'])
+ROUTE_DECISIONS = Counter('jollybot_route_decisions_total', 'Analyses by model route and outcome', ['route', 'outcome'])
+ROUTE_SECONDS = Histogram('jollybot_route_seconds', 'Analysis time by model route', ['route'])
+ROUTE_COST = Counter('jollybot_route_cost_usd_total', 'Estimated model spend by route', ['route'])
+LOG_RECORDS_DROPPED = Counter('jollybot_log_records_dropped_total',
+                              'Log records dropped because the log queue was full')
+
+IN_FLIGHT_REQUESTS = Gauge('jollybot_in_flight_requests', 'HTTP requests being handled')
+IN_FLIGHT_ANALYSES = Gauge('jollybot_in_flight_analyses', 'Documents being analyzed')
+IN_FLIGHT_LLM_CALLS = Gauge('jollybot_in_flight_llm_calls', 'Model calls in progress')
@@ -0,0 +1,371 @@
+"""
+Model Router Module
+Scores documents locally and routes each to a model tier, output budget and prompt template
+"""
+
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+from logging.handlers import QueueListener
+from typing import Any, Dict, List, Optional
+
+from src.chunking import count_tokens
+from src.clause_index import segment_clauses
+from src.metrics import ROUTE_COST, ROUTE_DECISIONS, ROUTE_SECONDS
+from src.structured_logging import NonBlockingQueueHandler
+
+logger = logging.getLogger(__name__)
+
+# Terms that signal clauses worth a closer (and more expensive) look
+RISK_TERMS = re.compile(
+    r'\b(?:indemnif\w*|liabilit\w*|liable|penalt\w*|liquidated damages|terminat\w*|waive\w*|waiver|'
+    r'arbitrat\w*|non-compet\w*|exclusiv\w*|irrevocabl\w*|perpetu\w*|warrant\w*|breach\w*|forfeit\w*|'
+    r'guarant\w*|default\w*|injunct\w*|governing law|jurisdiction|assign\w*|auto(?:matic(?:ally)?)?[- ]renew\w*)\b',
+    re.IGNORECASE
+)
+
+# Prompt templates a route can pick; each adds its guidance to the analysis prompt
+TEMPLATES = {
+    'brief': "Keep the analysis short: one or two sentences of summary and only the items that matter.",
+    'standard': "",
+    'detailed': "Be thorough: cite clause numbers, and weigh how the clauses interact before listing risks."
+}
+
+# Local route: the document is answered without a model call
+FAST_PATH = 'fast_path'
+
+# Documents shorter than this are scored as if this long when measuring risk density
+MIN_DENSITY_TOKENS = 500
+
+
+class DocumentProfile:
+    """What the router knows about a document, all computed locally"""
+
+    def __init__(self, tokens: int, clauses: int, document_type: str, type_confidence: float, risk_terms: int):
+        """Initialize from the document's measurements"""
+        self.tokens = tokens
+        self.clauses = clauses
+        self.document_type = document_type
+        self.type_confidence = type_confidence
+        self.risk_terms = risk_terms
+
+    @property
+    def risk_density(self) -> float:
+        """Risk terms per 1,000 tokens, scoring short documents as MIN_DENSITY_TOKENS long"""
+        return self.risk_terms * 1000 / max(self.tokens, MIN_DENSITY_TOKENS)
+
+    @property
+    def complexity(self) -> float:
+        """0-1 score: longer, more clauses, denser risk language and an unclear type all raise it"""
+        length = min(self.tokens / 16000, 1.0)
+        structure = min(self.clauses / 200, 1.0)
+        risk = min(self.risk_density / 40, 1.0)
+        uncertainty = 1.0 - self.type_confidence
+        return round(0.35 * length + 0.2 * structure + 0.35 * risk + 0.1 * uncertainty, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Profile as logged and returned with results"""
+        return {
+            'tokens': self.tokens,
+            'clauses': self.clauses,
+            'document_type': self.document_type,
+            'risk_terms': self.risk_terms,
+            'risk_density': round(self.risk_density, 2),
+            'complexity': self.complexity
+        }
+
+
+class ModelTier:
+    """A model and its price per 1,000 prompt and completion tokens (USD)"""
+
+    def __init__(self, name: str, model: str, prompt_cost: float = 0.0, completion_cost: float = 0.0):
+        """Initialize the tier"""
+        self.name = name
+        self.model = model
+        self.prompt_cost = prompt_cost
+        self.completion_cost = completion_cost
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """Price of a call in USD"""
+        return (prompt_tokens * self.prompt_cost + completion_tokens * self.completion_cost) / 1000
+
+
+class Route:
+    """One row of the routing table: conditions a document must meet and how it is then analyzed
+
+    A condition left as None is not checked. ``tier`` is None for the local fast path.
+    """
+
+    def __init__(self, name: str, tier: str = None, max_output_tokens: int = 1000, template: str = 'standard',
+                 max_tokens: int = None, max_clauses: int = None, max_risk_terms: int = None,
+                 max_complexity: float = None):
+        """Initialize the route"""
+        if template not in TEMPLATES:
+            raise ValueError(f"Unknown prompt template: {template}")
+        self.name = name
+        self.tier = tier
+        self.max_output_tokens = max_output_tokens
+        self.template = template
+        self.max_tokens = max_tokens
+        self.max_clauses = max_clauses
+        self.max_risk_terms = max_risk_terms
+        self.max_complexity = max_complexity
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Route':
+        """Route from one entry of a JSON routing table"""
+        return cls(**data)
+
+    def matches(self, profile: DocumentProfile) -> bool:
+        """Whether a document meets every condition of this route"""
+        limits = ((self.max_tokens, profile.tokens), (self.max_clauses, profile.clauses),
+                  (self.max_risk_terms, profile.risk_terms), (self.max_complexity, profile.complexity))
+        return all(limit is None or value <= limit for limit, value in limits)
+
+
+class RoutingDecision:
+    """The route chosen for one analysis, plus the token usage of the calls made under it"""
+
+    def __init__(self, route: Route, tier: Optional[ModelTier], profile: DocumentProfile, scoring_ms: float):
+        """Initialize the decision"""
+        self.route = route
+        self.tier = tier
+        self.profile = profile
+        self.scoring_ms = scoring_ms
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def fast_path(self) -> bool:
+        """Whether the document is answered locally"""
+        return self.tier is None
+
+    @property
+    def model(self) -> Optional[str]:
+        return self.tier.model if self.tier else None
+
+    @property
+    def max_output_tokens(self) -> int:
+        return self.route.max_output_tokens
+
+    @property
+    def template(self) -> str:
+        return self.route.template
+
+    @property
+    def cost(self) -> float:
+        """Price in USD of the calls recorded so far"""
+        return self.tier.cost(self.prompt_tokens, self.completion_tokens) if self.tier else 0.0
+
+    def add_usage(self, prompt_tokens: int, completion_tokens: int):
+        """Record one model call (calls for chunks of a document may run concurrently)"""
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Decision as returned with analysis results"""
+        return {
+            'route': self.route.name,
+            'model': self.model,
+            'max_output_tokens': self.max_output_tokens if self.tier else 0,
+            'template': self.template,
+            'profile': self.profile.to_dict()
+        }
+
+
+class RoutingLog:
+    """Recent routing decisions with their latency and cost outcomes
+
+    Each finished analysis is kept in memory (``summary`` reports per-route
+    latency percentiles and spend), counted in the route metrics and, when
+    ``path`` is set, appended to a JSON-lines file for offline comparison.
+    File writes go through the same kind of bounded queue and listener
+    thread as application logs, so analyses never wait on the disk.
+    """
+
+    def __init__(self, max_entries: int = 1000, path: str = None, queue_size: int = 10000):
+        """Initialize an empty log, starting the file writer thread when ``path`` is set"""
+        self.path = path
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._listener = None
+        if path:
+            output = logging.FileHandler(path, encoding='utf-8', delay=True)
+            output.setFormatter(logging.Formatter('%(message)s'))
+            self._writer = NonBlockingQueueHandler(queue.Queue(queue_size))
+            self._listener = QueueListener(self._writer.queue, output)
+            self._listener.start()
+            atexit.register(self.close)
+
+    def record(self, decision: RoutingDecision, seconds: float, outcome: str) -> Dict[str, Any]:
+        """Log one finished analysis"""
+        entry = {
+            'timestamp': round(time.time(), 3),
+            'route': decision.route.name,
+            'model': decision.model,
+            'outcome': outcome,
+            'latency_ms': round(seconds * 1000, 1),
+            'scoring_ms': round(decision.scoring_ms, 3),
+            'calls': decision.calls,
+            'prompt_tokens': decision.prompt_tokens,
+            'completion_tokens': decision.completion_tokens,
+            'cost_usd': round(decision.cost, 6),
+            'profile': decision.profile.to_dict()
+        }
+        ROUTE_DECISIONS.labels(route=entry['route'], outcome=outcome).inc()
+        ROUTE_SECONDS.labels(route=entry['route']).observe(seconds)
+        ROUTE_COST.labels(route=entry['route']).inc(decision.cost)
+        with self._lock:
+            self._entries.append(entry)
+        if self._writer is not None:
+            self._writer.handle(logging.makeLogRecord({'msg': json.dumps(entry), 'levelno': logging.INFO}))
+        return entry
+
+    def close(self):
+        """Write out queued entries and stop the file writer thread"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+            for output in listener.handlers:
+                output.close()
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Logged decisions, oldest first"""
+        with self._lock:
+            return list(self._entries)
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-route and overall count, p50/p95 latency and spend of the logged analyses"""
+        entries = self.entries()
+        routes = {}
+        for entry in entries:
+            routes.setdefault(entry['route'], []).append(entry)
+        return {
+            'overall': _summarize(entries),
+            'routes': {name: _summarize(group) for name, group in routes.items()}
+        }
+
+
+def _summarize(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    latencies = sorted(entry['latency_ms'] for entry in entries)
+
+    def percentile(fraction: float) -> float:
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else 0.0
+
+    return {
+        'analyses': len(entries),
+        'p50_latency_ms': percentile(0.5),
+        'p95_latency_ms': percentile(0.95),
+        'cost_usd': round(sum(entry['cost_usd'] for entry in entries), 6),
+        'model_calls': sum(entry['calls'] for entry in entries)
+    }
+
+
+def default_tiers(model: str) -> Dict[str, ModelTier]:
+    """Tiers when none are configured: every tier uses ``model`` (gpt-3.5-turbo prices)"""
+    return {name: ModelTier(name, model, 0.0005, 0.0015) for name in ('small', 'standard', 'large')}
+
+
+def default_routes() -> List[Route]:
+    """Routing table when none is configured, checked top to bottom"""
+    return [
+        # A paragraph or two with no risk language: a local summary is as good as the model's
+        Route(FAST_PATH, None, 0, 'brief', max_tokens=120, max_clauses=2, max_risk_terms=0),
+        Route('short', 'small', 500, 'brief', max_tokens=1500, max_complexity=0.3),
+        Route('standard', 'standard', 1000, 'standard', max_complexity=0.6),
+        Route('complex', 'large', 1500, 'detailed')
+    ]
+
+
+class ModelRouter:
+    """Picks a route for each document from a table checked top to bottom
+
+    The last route should have no conditions so that every document matches
+    one; if none matches, the last route is used anyway.
+    """
+
+    def __init__(self, routes: List[Route], tiers: Dict[str, ModelTier], log: RoutingLog = None):
+        """Initialize with routes, the tiers they name and a decision log"""
+        if not routes:
+            raise ValueError("Routing table is empty")
+        missing = {route.tier for route in routes if route.tier is not None} - set(tiers)
+        if missing:
+            raise ValueError(f"Routes name unknown tiers: {', '.join(sorted(missing))}")
+        self.routes = routes
+        self.tiers = tiers
+        self.log = log if log is not None else RoutingLog()
+
+    @classmethod
+    def from_env(cls, model: str) -> Optional['ModelRouter']:
+        """Build a router from ROUTER_* environment variables, or None when disabled
+
+        ROUTER_TABLE names a JSON file with ``tiers`` ({name: {model, prompt_cost,
+        completion_cost}}) and ``routes`` (a list of Route fields); tiers missing
+        from it fall back to ``model``. ROUTER_MODELS (``small=...,large=...``)
+        overrides tier models either way.
+        """
+        if os.getenv('ROUTER_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+            return None
+        tiers = default_tiers(model)
+        routes = default_routes()
+        table_path = os.getenv('ROUTER_TABLE')
+        if table_path:
+            with open(table_path, encoding='utf-8') as file:
+                table = json.load(file)
+            for name, tier in table.get('tiers', {}).items():
+                tiers[name] = ModelTier(name, tier.get('model', model), tier.get('prompt_cost', 0.0),
+                                        tier.get('completion_cost', 0.0))
+            if table.get('routes'):
+                routes = [Route.from_dict(route) for route in table['routes']]
+        for item in os.getenv('ROUTER_MODELS', '').split(','):
+            if '=' in item:
+                name, tier_model = (part.strip() for part in item.split('=', 1))
+                tier = tiers.get(name)
+                tiers[name] = ModelTier(name, tier_model, tier.prompt_cost if tier else 0.0,
+                                        tier.completion_cost if tier else 0.0)
+        log = RoutingLog(max_entries=int(os.getenv('ROUTER_LOG_SIZE', 1000)), path=os.getenv('ROUTER_LOG_PATH') or None)
+        return cls(routes, tiers, log)
+
+    @property
+    def fingerprint(self) -> str:
+        """The routes and each route's model, for cache keys
+
+        Routing is deterministic, so a document analyzed under the same table
+        goes to the same model; changing a tier's model or a route changes this.
+        """
+        return json.dumps([
+            dict(vars(route), model=self.tiers[route.tier].model if route.tier is not None else None)
+            for route in self.routes
+        ], sort_keys=True)
+
+    def profile(self, text: str, document_type: str, type_confidence: float, tokens: int = None) -> DocumentProfile:
+        """Score a (compacted) document locally"""
+        return DocumentProfile(
+            tokens=tokens if tokens is not None else count_tokens(text),
+            clauses=len(segment_clauses(text)),
+            document_type=document_type,
+            type_confidence=type_confidence,
+            risk_terms=len(RISK_TERMS.findall(text))
+        )
+
+    def route(self, text: str, document_type: str, type_confidence: float, tokens: int = None) -> RoutingDecision:
+        """Profile a document and choose its route"""
+        started = time.perf_counter()
+        profile = self.profile(text, document_type, type_confidence, tokens)
+        route = next((route for route in self.routes if route.matches(profile)), self.routes[-1])
+        tier = self.tiers[route.tier] if route.tier is not None else None
+        decision = RoutingDecision(route, tier, profile, (time.perf_counter() - started) * 1000)
+        logger.info("Routing %s-token %s (complexity %s) to %s",
+                    profile.tokens, profile.document_type, profile.complexity, route.name, extra={'sample': True})
+        return decision
@@ -0,0 +1,344 @@
+"""
+Near-Duplicate Index Module
+MinHash signatures of analyzed documents in an array-backed LSH index, persisted to an append-only file
+"""
+
+import os
+import re
+import sys
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'JBMINH01'
+DOC_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+# Signature length, split into BANDS bands of NUM_HASHES // BANDS values for LSH
+NUM_HASHES = 64
+BANDS = 16
+
+# Words per shingle; digits are folded so changed dates and amounts barely move a signature
+SHINGLE_WORDS = 5
+WORD = re.compile(r'\w+')
+DIGIT = re.compile(r'\d')
+
+# Entries per band bucket considered in a lookup, newest first, so that
+# thousands of copies of one template cannot slow lookups down
+MAX_BUCKET_SCAN = 64
+
+UINT32 = 'I' if array('I').itemsize == 4 else 'L'
+UINT64 = 'Q'
+MASK64 = (1 << 64) - 1
+
+
+def _hash64(data: bytes) -> int:
+    """Stable 64-bit hash (Python's own str hash changes between processes)"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def minhash_signature(text: str, num_hashes: int = NUM_HASHES, shingle_words: int = SHINGLE_WORDS) -> Optional[array]:
+    """One-permutation MinHash of a text's word shingles, or None for a text without words
+
+    Each shingle is hashed once: the hash picks a slot and the slot keeps the
+    smallest value seen, so a signature costs one hash per shingle rather than
+    one per slot. Empty slots copy the next filled slot to their right
+    (densification), keeping signatures of short texts comparable.
+    """
+    words = WORD.findall(DIGIT.sub('0', text.lower()))
+    if not words:
+        return None
+    span = min(shingle_words, len(words))
+    slots: List[Optional[int]] = [None] * num_hashes
+    for shingle in {' '.join(words[start:start + span]) for start in range(len(words) - span + 1)}:
+        value = _hash64(shingle.encode('utf-8'))
+        slot = value % num_hashes
+        value >>= 32
+        current = slots[slot]
+        if current is None or value < current:
+            slots[slot] = value
+
+    dense = list(slots)
+    following = None
+    for index in range(2 * num_hashes - 1, -1, -1):
+        value = slots[index % num_hashes]
+        if value is not None:
+            following = value
+        elif index < num_hashes:
+            dense[index] = following
+    return array(UINT32, dense)
+
+
+def signature_similarity(first: array, second: array) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+class NearDuplicateIndex:
+    """LSH index from MinHash signatures to the analysis cache key and document id of analyzed documents
+
+    Signatures, cache keys and document ids are stored in flat arrays indexed
+    by slot. Each band keeps a sorted array of band hashes with their slots,
+    searched by bisection, plus a small dict of entries added since the last
+    merge. With a ``path``, every addition is appended to that file and the
+    index is reloaded from it on first use; the file is only rewritten when
+    the index is trimmed to ``max_documents``.
+    """
+
+    def __init__(self, path: str = None, threshold: float = 0.8, max_documents: int = 100000,
+                 num_hashes: int = NUM_HASHES, bands: int = BANDS, min_words: int = 50,
+                 max_candidates: int = 16, merge_every: int = 1024):
+        """Initialize; an index previously written to ``path`` is loaded on first use"""
+        if num_hashes % bands:
+            raise ValueError(f"{num_hashes} hashes cannot be split into {bands} bands")
+        self.path = path
+        self.threshold = threshold
+        self.max_documents = max_documents
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.min_words = min_words
+        self.max_candidates = max_candidates
+        self.merge_every = merge_every
+        self._record_size = 64 + num_hashes * 4
+        self._header = MAGIC + struct.pack('<HHc', num_hashes, bands, sys.byteorder[0].encode('ascii'))
+        self._lock = threading.Lock()
+        self._loaded = not path
+        self._reset()
+
+    @classmethod
+    def from_env(cls) -> Optional['NearDuplicateIndex']:
+        """Build an index from NEAR_DUPLICATE_* environment variables, or None when disabled"""
+        if os.getenv('NEAR_DUPLICATE_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+            return None
+        return cls(
+            path=os.getenv('NEAR_DUPLICATE_INDEX_PATH') or None,
+            threshold=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8)),
+            max_documents=int(os.getenv('NEAR_DUPLICATE_MAX_DOCUMENTS', 100000))
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_loaded()
+            return self._count
+
+    def signature(self, text: str) -> Optional[array]:
+        """Signature of a document, or None when it is too short to compare reliably"""
+        if len(WORD.findall(text)) < self.min_words:
+            return None
+        return minhash_signature(text, self.num_hashes)
+
+    def add(self, cache_key: str, document_id: str, signature: array) -> bool:
+        """Index an analyzed document; returns False if it was already indexed or cannot be"""
+        if signature is None or not DOC_HASH.match(cache_key or '') or not DOC_HASH.match(document_id or ''):
+            return False
+        key = bytes.fromhex(cache_key)
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            self._ensure_loaded()
+            for slot in self._candidates(band_keys):
+                if self._key(slot) == key:
+                    return False
+            record = key + bytes.fromhex(document_id) + signature.tobytes()
+            self._append(record, band_keys)
+            if self.path:
+                self._write(record)
+            if self._count > self.max_documents:
+                self._trim()
+        return True
+
+    def find(self, signature: array, exclude: str = None) -> Optional[Tuple[str, str, float]]:
+        """(cache key, document id, similarity) of the most similar indexed document above the threshold"""
+        if signature is None:
+            return None
+        excluded = bytes.fromhex(exclude) if exclude and DOC_HASH.match(exclude) else None
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            self._ensure_loaded()
+            best, best_score = None, 0.0
+            for slot, _ in self._candidates(band_keys).most_common(self.max_candidates):
+                if excluded is not None and self._key(slot) == excluded:
+                    continue
+                score = signature_similarity(signature, self._signature(slot))
+                if score >= self.threshold and score > best_score:
+                    best, best_score = slot, score
+            if best is None:
+                return None
+            return self._key(best).hex(), self._document_ids[best * 32:(best + 1) * 32].hex(), best_score
+
+    def _band_keys(self, signature: array) -> List[int]:
+        """Hash of each band of a signature
+
+        Band arrays are rebuilt from the signatures on load, so Python's
+        per-process hash is good enough here and much cheaper than _hash64.
+        """
+        data = signature.tobytes()
+        width = len(data) // self.bands
+        return [hash(data[start:start + width]) & MASK64 for start in range(0, len(data), width)]
+
+    def _candidates(self, band_keys: List[int]) -> Counter:
+        """Slots sharing at least one band with a signature, counted by shared bands (lock held)"""
+        votes = Counter()
+        for band, band_key in enumerate(band_keys):
+            keys = self._sorted_keys[band]
+            low = bisect_left(keys, band_key)
+            if low < len(keys) and keys[low] == band_key:
+                high = bisect_right(keys, band_key, low)
+                votes.update(self._sorted_slots[band][max(low, high - MAX_BUCKET_SCAN):high])
+            recent = self._recent[band].get(band_key)
+            if recent:
+                votes.update(recent[-MAX_BUCKET_SCAN:])
+        return votes
+
+    def _key(self, slot: int) -> bytes:
+        return bytes(self._keys[slot * 32:(slot + 1) * 32])
+
+    def _signature(self, slot: int) -> array:
+        return self._signatures[slot * self.num_hashes:(slot + 1) * self.num_hashes]
+
+    def _reset(self):
+        """Empty the in-memory index"""
+        self._count = 0
+        self._signatures = array(UINT32)
+        self._keys = bytearray()
+        self._document_ids = bytearray()
+        self._sorted_keys = [array(UINT64) for _ in range(self.bands)]
+        self._sorted_slots = [array(UINT32) for _ in range(self.bands)]
+        self._recent: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._recent_count = 0
+
+    def _append(self, record: bytes, band_keys: List[int]):
+        """Add one record to the in-memory index (lock held)"""
+        slot = self._count
+        self._keys += record[:32]
+        self._document_ids += record[32:64]
+        self._signatures.frombytes(record[64:])
+        self._count += 1
+        for band, band_key in enumerate(band_keys):
+            self._recent[band].setdefault(band_key, []).append(slot)
+        self._recent_count += 1
+        if self._recent_count >= self.merge_every:
+            self._merge()
+
+    def _merge(self):
+        """Fold recently added entries into the sorted band arrays (lock held)
+
+        Recent entries are few, so each is placed by bisection and the runs of
+        the old arrays between them are copied as slices.
+        """
+        for band in range(self.bands):
+            keys, slots = self._sorted_keys[band], self._sorted_slots[band]
+            merged_keys, merged_slots = array(UINT64), array(UINT32)
+            position = 0
+            for band_key, new_slots in sorted(self._recent[band].items()):
+                index = bisect_right(keys, band_key, position)
+                merged_keys.extend(keys[position:index])
+                merged_slots.extend(slots[position:index])
+                merged_keys.extend([band_key] * len(new_slots))
+                merged_slots.extend(new_slots)
+                position = index
+            merged_keys.extend(keys[position:])
+            merged_slots.extend(slots[position:])
+            self._sorted_keys[band], self._sorted_slots[band] = merged_keys, merged_slots
+            self._recent[band] = {}
+        self._recent_count = 0
+
+    def _records(self, start: int = 0) -> bytes:
+        """On-disk form of the entries from slot ``start`` on (lock held)"""
+        parts = []
+        for slot in range(start, self._count):
+            parts.append(self._key(slot) + bytes(self._document_ids[slot * 32:(slot + 1) * 32])
+                         + self._signature(slot).tobytes())
+        return b''.join(parts)
+
+    def _trim(self):
+        """Forget the oldest quarter of the index and rewrite it (lock held)"""
+        keep = self.max_documents * 3 // 4
+        records = self._records(self._count - keep)
+        self._reset()
+        self._load_records(records)
+        if self.path:
+            self._rewrite(records)
+        logger.info("Near-duplicate index trimmed to %s documents", keep)
+
+    def _load_records(self, records: bytes):
+        """Rebuild the in-memory index from on-disk records (lock held or during init)
+
+        Band arrays are built with one sort per band instead of entry by entry.
+        """
+        view = memoryview(records)
+        for offset in range(0, len(records), self._record_size):
+            self._keys += view[offset:offset + 32]
+            self._document_ids += view[offset + 32:offset + 64]
+            self._signatures.frombytes(view[offset + 64:offset + self._record_size])
+        self._count = len(self._signatures) // self.num_hashes
+
+        data = self._signatures.tobytes()
+        row = self.num_hashes * 4
+        width = row // self.bands
+        for band in range(self.bands):
+            start = band * width
+            keys = [hash(data[offset:offset + width]) & MASK64 for offset in range(start, len(data), row)]
+            order = sorted(range(self._count), key=keys.__getitem__)
+            self._sorted_keys[band] = array(UINT64, [keys[slot] for slot in order])
+            self._sorted_slots[band] = array(UINT32, order)
+
+    def _ensure_loaded(self):
+        """Read the index file the first time the index is used (lock held)
+
+        Deferred so that processes which never search, such as extraction
+        workers, do not pay for loading a large index.
+        """
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+
+    def _load(self):
+        """Read the index file, starting over if it was written with other settings or on another machine"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as file:
+            data = file.read()
+        if not data.startswith(self._header):
+            logger.warning("Near-duplicate index %s has another format; starting a new one", self.path)
+            self._rewrite(b'')
+            return
+        body = data[len(self._header):]
+        complete = len(body) - len(body) % self._record_size
+        if complete != len(body):
+            # A record cut short by a crash; appends must start on a record boundary
+            with open(self.path, 'r+b') as file:
+                file.truncate(len(self._header) + complete)
+        self._load_records(body[:complete])
+        logger.info("Loaded near-duplicate index with %s documents from %s", self._count, self.path)
+
+    def _write(self, record: bytes):
+        """Append one record to the index file, creating it if needed (lock held)"""
+        try:
+            if not os.path.exists(self.path):
+                self._rewrite(record)
+                return
+            with open(self.path, 'ab') as file:
+                file.write(record)
+        except OSError as e:
+            logger.error("Could not persist near-duplicate index entry: %s", e)
+
+    def _rewrite(self, records: bytes):
+        """Replace the index file atomically"""
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.minhash-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(self._header)
+                out.write(records)
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
@@ -0,0 +1,57 @@
+"""
+Preload Module
+Imports the application's code once in a pre-fork server so workers share it copy-on-write
+"""
+
+import gc
+import time
+import logging
+import importlib
+from typing import Dict, Iterable
+
+from src.chunking import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Application modules, then the SDKs and extractors they import on first use
+PRELOAD_MODULES = (
+    'flask',
+    'src.document_analyzer',
+    'src.whatsapp_bot',
+    'src.batch_analyzer',
+    'src.job_queue',
+    'src.health',
+    'openai',
+    'httpx',
+    'PyPDF2',
+    'twilio.rest',
+    'twilio.twiml.messaging_response',
+    'twilio.http.async_http_client',
+    'aiohttp',
+)
+
+
+def preload_modules(modules: Iterable[str] = PRELOAD_MODULES) -> Dict[str, float]:
+    """Import ``modules`` and warm lazily built tables, then freeze the heap
+
+    Creates no services: threads, sockets and database handles do not survive a
+    fork, so each worker still builds its own (``app.create_app``). Returns the
+    seconds spent importing each module; missing optional modules are skipped.
+    """
+    timings = {}
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Not preloading %s: %s", name, e)
+            continue
+        timings[name] = time.perf_counter() - started
+
+    # Loads the tokenizer's encoding tables when tiktoken is installed
+    count_tokens('preload')
+
+    # Move everything allocated so far out of the collector's reach: collections in
+    # the workers would otherwise write to these objects and unshare their pages
+    gc.freeze()
+    return timings
@@ -0,0 +1,76 @@
+"""
+Rate Limiting Module
+Token-bucket rate limiter shared by outbound API clients
+"""
+
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate`` tokens per second
+
+    Reservations may overdraw the bucket; the caller is told how long to wait
+    before its request fits the rate, which keeps waiters in FIFO order.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        """Initialize a full bucket"""
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, amount: float) -> 'TokenBucket':
+        """Bucket allowing ``amount`` per minute with a one-minute burst"""
+        return cls(rate=amount / 60.0, capacity=amount)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1) -> float:
+        """Take ``amount`` tokens and return the seconds to wait before using them"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= min(amount, self.capacity)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take ``amount`` tokens only if they are available right now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return True
+            return False
+
+    def retry_after(self, amount: float = 1) -> float:
+        """Seconds until ``amount`` tokens would be available"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= amount:
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def refund(self, amount: float):
+        """Return unused tokens, e.g. when a request used fewer than reserved"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def acquire(self, amount: float = 1):
+        """Block until ``amount`` tokens are available"""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, amount: float = 1):
+        """Wait without blocking the event loop until ``amount`` tokens are available"""
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
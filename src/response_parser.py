@@ -0,0 +1,159 @@
+"""
+Response Parser Module
+Turns model replies (JSON or sectioned text) into analysis result fields in one pass
+"""
+
+import re
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+LIST_FIELDS = ('key_points', 'risks_concerns', 'recommendations')
+FIELD_LIMITS = {'key_points': 5, 'risks_concerns': 3, 'recommendations': 3}
+MISSING_SUMMARY = "Summary not available"
+
+# A heading such as "SUMMARY:", "## 3. Key Points", "**RISKS & CONCERNS**" or "Recommendations: ..."
+HEADING = re.compile(
+    r'^[\s#*_]*(?:\d+[.)]\s*)?[*_]*\s*'
+    r'(summary|document type|key points|risks(?:\s*(?:&|and)\s*concerns)?|concerns|recommendations)'
+    r'\b[*_]*\s*(:)?[*_]*\s*(.*)$',
+    re.IGNORECASE
+)
+BULLET = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s+')
+CODE_FENCE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$', re.IGNORECASE)
+
+HEADING_FIELDS = {
+    'summary': 'summary',
+    'document type': 'document_type',
+    'key points': 'key_points',
+    'concerns': 'risks_concerns',
+    'recommendations': 'recommendations'
+}
+
+
+def match_heading(line: str) -> Optional[Tuple[str, str]]:
+    """Return (field, inline text) if the line opens a section
+
+    A heading needs a colon or nothing after it, so prose such as
+    "Risks are low" inside a section does not start a new one.
+    """
+    match = HEADING.match(line)
+    if not match:
+        return None
+    name, colon, rest = match.group(1).lower(), match.group(2), match.group(3).strip()
+    if rest and not colon:
+        return None
+    field = 'risks_concerns' if name.startswith('risks') else HEADING_FIELDS[name]
+    return field, rest
+
+
+class SectionTokenizer:
+    """Incremental single-pass tokenizer for sectioned model replies
+
+    Text may be fed in arbitrary pieces (e.g. streamed tokens); ``feed`` returns
+    the fields whose sections were completed by the new text.
+    """
+
+    def __init__(self):
+        """Initialize with empty sections"""
+        self.sections = {field: [] for field in ('summary', 'document_type') + LIST_FIELDS}
+        self._current = None
+        self._pending = ''
+
+    def feed(self, text: str) -> List[str]:
+        """Consume more reply text and return newly completed fields"""
+        self._pending += text
+        *lines, self._pending = self._pending.split('\n')
+        completed = []
+        for line in lines:
+            field = self._process_line(line)
+            if field is not None:
+                completed.append(field)
+        return completed
+
+    def close(self) -> List[str]:
+        """Consume any trailing partial line and complete the last section"""
+        completed = []
+        if self._pending:
+            field = self._process_line(self._pending)
+            self._pending = ''
+            if field is not None:
+                completed.append(field)
+        if self._current is not None:
+            completed.append(self._current)
+            self._current = None
+        return completed
+
+    def result(self) -> Dict[str, Any]:
+        """Result fields from the sections seen so far"""
+        fields = {
+            'summary': ' '.join(self.sections['summary']) or MISSING_SUMMARY,
+            'document_type': ' '.join(self.sections['document_type'])
+        }
+        for field in LIST_FIELDS:
+            items = [BULLET.sub('', line).strip() for line in self.sections[field]]
+            fields[field] = [item for item in items if item][:FIELD_LIMITS[field]]
+        return fields
+
+    def _process_line(self, line: str) -> Optional[str]:
+        """Route one line to its section; return the previous field if a new section starts"""
+        heading = match_heading(line)
+        if heading is not None:
+            field, rest = heading
+            previous = self._current
+            self._current = field
+            if rest:
+                self.sections[field].append(rest)
+            return previous if previous != field else None
+        if self._current is not None and line.strip():
+            self.sections[self._current].append(line.strip())
+        return None
+
+
+def parse_sections(text: str) -> Dict[str, Any]:
+    """Parse a sectioned plain-text reply in a single scan"""
+    tokenizer = SectionTokenizer()
+    tokenizer.feed(text)
+    tokenizer.close()
+    return tokenizer.result()
+
+
+def parse_json_response(text: str) -> Optional[Dict[str, Any]]:
+    """Parse a JSON-mode reply, or return None if it is not usable JSON"""
+    try:
+        data = json.loads(CODE_FENCE.sub('', text))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict) or not any(key in data for key in ('summary',) + LIST_FIELDS):
+        return None
+
+    fields = {
+        'summary': str(data.get('summary') or '').strip() or MISSING_SUMMARY,
+        'document_type': str(data.get('document_type') or '').strip()
+    }
+    for field in LIST_FIELDS:
+        value = data.get(field) or []
+        if isinstance(value, str):
+            value = value.splitlines()
+        items = [BULLET.sub('', str(item)).strip() for item in value]
+        fields[field] = [item for item in items if item][:FIELD_LIMITS[field]]
+    return fields
+
+
+def parse_analysis_response(text: str) -> Dict[str, Any]:
+    """Parse a model reply, preferring structured JSON and falling back to section headings"""
+    parsed = parse_json_response(text)
+    if parsed is not None:
+        return parsed
+    return parse_sections(text or '')
+
+
+def format_analysis(fields: Dict[str, Any]) -> str:
+    """Render parsed fields as readable sectioned text"""
+    parts = [f"SUMMARY:\n{fields['summary']}"]
+    if fields.get('document_type'):
+        parts.append(f"DOCUMENT TYPE:\n{fields['document_type']}")
+    for heading, field in (('KEY POINTS', 'key_points'), ('RISKS & CONCERNS', 'risks_concerns'),
+                           ('RECOMMENDATIONS', 'recommendations')):
+        if fields[field]:
+            parts.append(f"{heading}:\n" + '\n'.join(f"- {item}" for item in fields[field]))
+    return '\n\n'.join(parts)
@@ -0,0 +1,197 @@
+"""
+Revision Index Module
+Clause-level fingerprints of analyzed documents, used to recognize and diff revised versions
+"""
+
+import os
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+from itertools import zip_longest
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.analysis_cache import normalize_text
+from src.clause_index import tokenize
+
+
+def clause_fingerprint(clause: str) -> str:
+    """Hash of a clause that ignores case and whitespace differences"""
+    return hashlib.sha256(normalize_text(clause).lower().encode('utf-8')).hexdigest()[:16]
+
+
+class ClauseDiff:
+    """Clause-level differences between two versions of a document"""
+
+    def __init__(self, added: List[str], removed: List[str], modified: List[Tuple[str, str]],
+                 unchanged_clauses: List[str]):
+        """Initialize from the added, removed, (before, after) modified and unchanged clauses"""
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+        self.unchanged_clauses = unchanged_clauses
+        self.unchanged = len(unchanged_clauses)
+
+    @property
+    def changed(self) -> bool:
+        """Whether any clause differs"""
+        return bool(self.added or self.removed or self.modified)
+
+    def describe(self, include_earlier: bool = True) -> str:
+        """Changed clauses as prompt text
+
+        Without ``include_earlier`` only the current version's modified and added
+        clauses are listed, for diffs against another uploader's document.
+        """
+        if not include_earlier:
+            current = [after for _, after in self.modified] + self.added
+            return "DIFFERING CLAUSES:\n" + '\n\n'.join(current) if current else ''
+        parts = []
+        if self.modified:
+            parts.append("MODIFIED CLAUSES:\n" + '\n\n'.join(
+                f"Before: {before}\nAfter: {after}" for before, after in self.modified))
+        if self.added:
+            parts.append("ADDED CLAUSES:\n" + '\n\n'.join(self.added))
+        if self.removed:
+            parts.append("REMOVED CLAUSES:\n" + '\n\n'.join(self.removed))
+        return '\n\n'.join(parts)
+
+    def findings_on_unchanged(self, findings: List[str]) -> List[str]:
+        """Findings about the earlier version whose source clause is unchanged
+
+        Each finding is attributed to the earlier clause sharing the most content
+        words with it, and kept only if that clause's fingerprint is among the
+        unchanged ones. Ties go to changed clauses, and findings matching no
+        clause are dropped, so a finding is only carried over when it is safe.
+        """
+        unchanged = {clause_fingerprint(clause) for clause in self.unchanged_clauses}
+        earlier = self.removed + [before for before, _ in self.modified] + self.unchanged_clauses
+        vocabularies = [(clause_fingerprint(clause), set(tokenize(clause))) for clause in earlier]
+        kept = []
+        for finding in findings:
+            words = set(tokenize(finding))
+            source, best = None, 0
+            for fingerprint, vocabulary in vocabularies:
+                overlap = len(words & vocabulary)
+                if overlap > best:
+                    source, best = fingerprint, overlap
+            if source in unchanged:
+                kept.append(finding)
+        return kept
+
+    def to_dict(self, preview_chars: int = 160, max_changes: int = 20,
+                include_earlier: bool = True) -> Dict[str, Any]:
+        """Counts plus a preview of each changed clause (removed ones only with ``include_earlier``)"""
+        def preview(text: str) -> str:
+            text = normalize_text(text)
+            return text if len(text) <= preview_chars else text[:preview_chars - 3] + '...'
+
+        changes = ([{'change': 'modified', 'clause': preview(after)} for _, after in self.modified]
+                   + [{'change': 'added', 'clause': preview(clause)} for clause in self.added]
+                   + [{'change': 'removed', 'clause': preview(clause)} for clause in self.removed
+                      if include_earlier])
+        return {
+            'clauses_modified': len(self.modified),
+            'clauses_added': len(self.added),
+            'clauses_removed': len(self.removed),
+            'clauses_unchanged': self.unchanged,
+            'changes': changes[:max_changes]
+        }
+
+
+def diff_clauses(old: List[str], new: List[str]) -> ClauseDiff:
+    """Align two clause lists by fingerprint; replaced runs are paired into modified clauses"""
+    matcher = SequenceMatcher(None, [clause_fingerprint(c) for c in old], [clause_fingerprint(c) for c in new],
+                              autojunk=False)
+    added, removed, modified, unchanged = [], [], [], []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            unchanged += old[i1:i2]
+        elif tag == 'insert':
+            added += new[j1:j2]
+        elif tag == 'delete':
+            removed += old[i1:i2]
+        else:
+            for before, after in zip_longest(old[i1:i2], new[j1:j2]):
+                if before is None:
+                    added.append(after)
+                elif after is None:
+                    removed.append(before)
+                else:
+                    modified.append((before, after))
+    return ClauseDiff(added, removed, modified, unchanged)
+
+
+class RevisionIndex:
+    """Clauses of recently analyzed documents, keyed by analysis cache key
+
+    ``find`` returns the stored document sharing the most clause fingerprints
+    with a new upload, provided at least ``min_shared`` of the upload's clauses
+    are shared. The analysis itself stays in the analysis cache.
+    """
+
+    def __init__(self, max_documents: int = 64, min_shared: float = 0.5, min_clauses: int = 4):
+        """Initialize an empty index"""
+        self.max_documents = max_documents
+        self.min_shared = min_shared
+        self.min_clauses = min_clauses
+        self._documents = OrderedDict()
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional['RevisionIndex']:
+        """Build an index from REVISION_* environment variables, or None when disabled"""
+        if os.getenv('REVISION_ANALYSIS_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+            return None
+        return cls(
+            max_documents=int(os.getenv('REVISION_INDEX_SIZE', 64)),
+            min_shared=float(os.getenv('REVISION_MIN_SHARED', 0.5))
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._documents)
+
+    def add(self, key: str, clauses: List[str]):
+        """Remember the clauses of an analyzed document"""
+        if len(clauses) < self.min_clauses:
+            return
+        fingerprints = {clause_fingerprint(clause) for clause in clauses}
+        with self._lock:
+            self._discard(key)
+            self._documents[key] = (list(clauses), fingerprints)
+            for fingerprint in fingerprints:
+                self._postings.setdefault(fingerprint, set()).add(key)
+            while len(self._documents) > self.max_documents:
+                self._discard(next(iter(self._documents)))
+
+    def find(self, clauses: List[str], exclude: str = None) -> Optional[Tuple[str, List[str]]]:
+        """(cache key, clauses) of the closest earlier version of a document, or None"""
+        if len(clauses) < self.min_clauses:
+            return None
+        fingerprints = {clause_fingerprint(clause) for clause in clauses}
+        with self._lock:
+            shared = Counter()
+            for fingerprint in fingerprints:
+                shared.update(self._postings.get(fingerprint, ()))
+            shared.pop(exclude, None)
+            if not shared:
+                return None
+            key, count = shared.most_common(1)[0]
+            if count < self.min_shared * len(fingerprints):
+                return None
+            self._documents.move_to_end(key)
+            return key, self._documents[key][0]
+
+    def _discard(self, key: str):
+        """Drop a document and its postings (lock held)"""
+        entry = self._documents.pop(key, None)
+        if entry is None:
+            return
+        for fingerprint in entry[1]:
+            keys = self._postings.get(fingerprint)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[fingerprint]
@@ -0,0 +1,301 @@
+"""
+Scheduler Module
+Admission control and weighted priority scheduling for analyses across traffic classes
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+from src.metrics import SCHEDULER_REJECTIONS, SCHEDULER_WAIT_SECONDS
+from src.rate_limit import TokenBucket
+from src.structured_logging import record_stage
+
+logger = logging.getLogger(__name__)
+
+# Traffic classes, from most to least latency sensitive
+INTERACTIVE = 'interactive'   # web UI uploads and streams
+WHATSAPP = 'whatsapp'         # WhatsApp documents and questions
+API = 'api'                   # /api/analyze and document questions
+BATCH = 'batch'               # batch uploads and queued async jobs
+TRAFFIC_CLASSES = (INTERACTIVE, WHATSAPP, API, BATCH)
+
+DEFAULT_WEIGHTS = {INTERACTIVE: 8, WHATSAPP: 4, API: 2, BATCH: 1}
+# Requests per minute allowed per client (IP address or phone number); 0 is unlimited
+DEFAULT_CLIENT_RPM = {INTERACTIVE: 30, WHATSAPP: 10, API: 60, BATCH: 0}
+
+
+class Overloaded(Exception):
+    """A request was refused: 429 when its client is over its rate, 503 when the server is saturated"""
+
+    def __init__(self, status: int, retry_after: float, reason: str):
+        """Initialize with the HTTP status, seconds to wait before retrying and a short reason"""
+        super().__init__(f"{reason} (retry after {retry_after:.1f}s)")
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def retry_after_header(self) -> str:
+        """Retry-After value in whole seconds"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Slot:
+    """Permission to run one analysis; release it (or leave its ``with`` block) when done"""
+
+    def __init__(self, scheduler: 'AnalysisScheduler'):
+        """Initialize a held slot"""
+        self._scheduler = scheduler
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        """Give the slot to the next waiter (idempotent)"""
+        if not self._released:
+            self._released = True
+            self._scheduler._release(time.monotonic() - self._started)
+
+    def __enter__(self) -> 'Slot':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class _Waiter:
+    """A queued request for a slot, woken by a thread event or an event loop future"""
+
+    def __init__(self, traffic_class: str, loop: asyncio.AbstractEventLoop = None):
+        self.traffic_class = traffic_class
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        """Signal the waiter that it holds a slot (scheduler lock held)"""
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AnalysisScheduler:
+    """Limits analyses in flight and decides who runs next when they are all busy
+
+    ``admit`` charges a per-client token bucket for the request's traffic class
+    and refuses clients over their rate with a 429. ``acquire`` then takes one of
+    ``max_in_flight`` slots; when none is free the request waits in its class's
+    queue. Freed slots go to the queues by smooth weighted round robin, so with
+    the default weights interactive uploads get 8 turns for each batch job but
+    no class is starved. When ``max_queue`` requests are already waiting, or a
+    request has waited ``max_wait`` seconds, it is refused with a 503 and a
+    Retry-After estimated from recent analysis times.
+    """
+
+    def __init__(self, max_in_flight: int = 8, max_queue: int = 64, max_wait: float = 20.0,
+                 weights: Dict[str, int] = None, client_rpm: Dict[str, float] = None, max_clients: int = 10000):
+        """Initialize an idle scheduler"""
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.client_rpm = dict(DEFAULT_CLIENT_RPM, **(client_rpm or {}))
+        self.max_clients = max_clients
+        self._queues = {traffic_class: deque() for traffic_class in self.weights}
+        self._credit = {traffic_class: 0 for traffic_class in self.weights}
+        self._buckets = OrderedDict()
+        self._in_flight = 0
+        # Moving average of slot hold times, used for Retry-After
+        self._service_seconds = 1.0
+        self._admitted = dict.fromkeys(self.weights, 0)
+        self._rejected = dict.fromkeys(self.weights, 0)
+        self._waited = dict.fromkeys(self.weights, 0.0)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional['AnalysisScheduler']:
+        """Build a scheduler from SCHEDULER_* environment variables, or None when disabled"""
+        if os.getenv('SCHEDULER_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+            return None
+        return cls(
+            max_in_flight=int(os.getenv('SCHEDULER_MAX_IN_FLIGHT', 8)),
+            max_queue=int(os.getenv('SCHEDULER_MAX_QUEUE', 64)),
+            max_wait=float(os.getenv('SCHEDULER_MAX_WAIT_SECONDS', 20)),
+            weights={name: int(value) for name, value in _parse_pairs(os.getenv('SCHEDULER_WEIGHTS', '')).items()},
+            client_rpm=_parse_pairs(os.getenv('SCHEDULER_CLIENT_RPM', ''))
+        )
+
+    def admit(self, traffic_class: str, client_id: str):
+        """Charge the client's bucket for one request, raising Overloaded (429) when it is empty"""
+        rpm = self.client_rpm.get(traffic_class, 0)
+        if not rpm:
+            return
+        with self._lock:
+            key = (traffic_class, client_id or 'anonymous')
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket.per_minute(rpm)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        if not bucket.try_acquire():
+            self._reject(traffic_class, 'client_rate')
+            raise Overloaded(429, bucket.retry_after(), f"Too many {traffic_class} requests from this client")
+
+    def acquire(self, traffic_class: str, timeout: float = -1) -> Slot:
+        """Wait for a slot; ``timeout`` defaults to ``max_wait`` and None waits as long as it takes"""
+        waiter = self._enqueue(traffic_class)
+        if waiter is None:
+            return Slot(self)
+        timeout = self.max_wait if timeout == -1 else timeout
+        waiter.event.wait(timeout)
+        return self._finish_wait(waiter)
+
+    async def acquire_async(self, traffic_class: str, timeout: float = -1) -> Slot:
+        """Async counterpart of acquire; waits without holding a thread"""
+        waiter = self._enqueue(traffic_class, asyncio.get_running_loop())
+        if waiter is None:
+            return Slot(self)
+        timeout = self.max_wait if timeout == -1 else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The request went away; hand back a slot granted in the meantime
+            with self._lock:
+                self._withdraw(waiter)
+            if waiter.granted:
+                Slot(self).release()
+            raise
+        return self._finish_wait(waiter)
+
+    def run(self, traffic_class: str, client_id: str, func, *args, **kwargs) -> Any:
+        """Admit, wait for a slot, then call ``func``"""
+        self.admit(traffic_class, client_id)
+        with self.acquire(traffic_class):
+            return func(*args, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """In-flight count and per-class queue depth, oldest wait and totals"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'classes': {
+                    traffic_class: {
+                        'weight': self.weights[traffic_class],
+                        'queued': len(queue),
+                        'oldest_wait_seconds': round(now - queue[0].enqueued, 3) if queue else 0.0,
+                        'admitted': self._admitted[traffic_class],
+                        'rejected': self._rejected[traffic_class],
+                        'wait_seconds_total': round(self._waited[traffic_class], 3)
+                    }
+                    for traffic_class, queue in self._queues.items()
+                }
+            }
+
+    def _enqueue(self, traffic_class: str, loop: asyncio.AbstractEventLoop = None) -> Optional[_Waiter]:
+        """Take a free slot (None) or join the class queue (the waiter); raises Overloaded when full"""
+        if traffic_class not in self._queues:
+            raise ValueError(f"Unknown traffic class: {traffic_class}")
+        with self._lock:
+            queued = sum(len(queue) for queue in self._queues.values())
+            if self._in_flight < self.max_in_flight and not queued:
+                self._in_flight += 1
+                self._admitted[traffic_class] += 1
+                waiter = None
+            elif queued >= self.max_queue:
+                retry_after = self._estimate_wait(queued)
+                waiter = False
+            else:
+                waiter = _Waiter(traffic_class, loop)
+                self._queues[traffic_class].append(waiter)
+        if waiter is False:
+            self._reject(traffic_class, 'queue_full')
+            raise Overloaded(503, retry_after, "Analysis queue is full")
+        if waiter is None:
+            SCHEDULER_WAIT_SECONDS.labels(traffic_class=traffic_class).observe(0)
+        return waiter
+
+    def _finish_wait(self, waiter: _Waiter) -> Slot:
+        """Slot for a granted waiter; a waiter still queued is withdrawn and refused"""
+        waited = time.monotonic() - waiter.enqueued
+        with self._lock:
+            if not waiter.granted:
+                self._withdraw(waiter)
+                retry_after = self._estimate_wait(sum(len(queue) for queue in self._queues.values()))
+            self._waited[waiter.traffic_class] += waited
+        SCHEDULER_WAIT_SECONDS.labels(traffic_class=waiter.traffic_class).observe(waited)
+        record_stage('scheduler_wait', waited)
+        if not waiter.granted:
+            self._reject(waiter.traffic_class, 'wait_timeout')
+            raise Overloaded(503, retry_after, f"No analysis slot within {waited:.0f}s")
+        return Slot(self)
+
+    def _withdraw(self, waiter: _Waiter):
+        """Remove a waiter that gave up from its queue (lock held)"""
+        try:
+            self._queues[waiter.traffic_class].remove(waiter)
+        except ValueError:
+            pass
+
+    def _release(self, held_seconds: float):
+        """Free a slot and grant freed slots to the next waiters by weight"""
+        with self._lock:
+            self._in_flight -= 1
+            self._service_seconds += 0.2 * (held_seconds - self._service_seconds)
+            while self._in_flight < self.max_in_flight:
+                waiter = self._next_waiter()
+                if waiter is None:
+                    break
+                self._in_flight += 1
+                self._admitted[waiter.traffic_class] += 1
+                waiter.wake()
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Pop the head of the next queue by smooth weighted round robin (lock held)"""
+        ready = [traffic_class for traffic_class, queue in self._queues.items() if queue]
+        if not ready:
+            return None
+        for traffic_class in ready:
+            self._credit[traffic_class] += self.weights[traffic_class]
+        chosen = max(ready, key=lambda traffic_class: self._credit[traffic_class])
+        self._credit[chosen] -= sum(self.weights[traffic_class] for traffic_class in ready)
+        return self._queues[chosen].popleft()
+
+    def _estimate_wait(self, queued: int) -> float:
+        """Seconds until ``queued`` waiters ahead would be served at the recent pace (lock held)"""
+        return (queued // max(1, self.max_in_flight) + 1) * self._service_seconds
+
+    def _reject(self, traffic_class: str, reason: str):
+        with self._lock:
+            self._rejected[traffic_class] += 1
+        SCHEDULER_REJECTIONS.labels(traffic_class=traffic_class, reason=reason).inc()
+        logger.warning("Shedding %s request: %s", traffic_class, reason)
+
+
+def _parse_pairs(value: str) -> Dict[str, float]:
+    """Parse ``name=number,name=number`` settings"""
+    pairs = {}
+    for item in value.split(','):
+        if '=' in item:
+            name, number = item.split('=', 1)
+            pairs[name.strip()] = float(number)
+    return pairs
@@ -0,0 +1,221 @@
+"""
+Session Store Module
+Per-conversation state for WhatsApp follow-up questions about the last document
+"""
+
+import os
+import abc
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from src.clause_index import ClauseIndex, segment_clauses
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationSession:
+    """The last document a user sent: its clauses, their BM25 index and the analysis"""
+
+    def __init__(self, filename: str, clauses: List[str], analysis: Dict[str, Any], created: float = None):
+        """Initialize; the clause index is built on the first question"""
+        self.filename = filename
+        self.clauses = clauses
+        self.analysis = analysis
+        self.created = created if created is not None else time.time()
+        self._index = None
+        # Memory budget charge: clause text dominates, so only the small analysis is serialized
+        self.size = sum(len(clause) for clause in clauses) + len(json.dumps(analysis)) + len(filename)
+
+    @classmethod
+    def from_text(cls, filename: str, text: str, analysis: Dict[str, Any],
+                  clause_tokens: int = 200) -> 'ConversationSession':
+        """Split extracted text into clauses of at most ``clause_tokens``"""
+        return cls(filename, segment_clauses(text, clause_tokens), analysis)
+
+    @property
+    def index(self) -> ClauseIndex:
+        """In-memory clause index, the same BM25 index the document question API uses"""
+        if self._index is None:
+            self._index = ClauseIndex.from_clauses(self.clauses)
+        return self._index
+
+    def relevant_clauses(self, question: str, k: int = 3) -> List[str]:
+        """Clauses most relevant to the question, in document order"""
+        ids = sorted(clause_id for clause_id, _ in self.index.search(question, k))
+        return [self.clauses[clause_id] for clause_id in ids]
+
+    def to_json(self) -> str:
+        """Serialize for storage (the index is rebuilt from the clauses when needed)"""
+        return json.dumps({
+            'filename': self.filename,
+            'clauses': self.clauses,
+            'analysis': self.analysis,
+            'created': self.created
+        })
+
+    @classmethod
+    def from_json(cls, payload: str) -> 'ConversationSession':
+        """Rebuild a session saved with to_json"""
+        data = json.loads(payload)
+        return cls(data['filename'], data['clauses'], data['analysis'], created=data['created'])
+
+
+class SessionStore(abc.ABC):
+    """Interface shared by the session store backends"""
+
+    @classmethod
+    def from_env(cls) -> 'SessionStore':
+        """SQLite store when WHATSAPP_SESSION_DB is set, otherwise in-process"""
+        ttl_seconds = float(os.getenv('WHATSAPP_SESSION_TTL_SECONDS', 86400))
+        max_bytes = int(os.getenv('WHATSAPP_SESSION_MAX_MB', 64)) * 1024 * 1024
+        db_path = os.getenv('WHATSAPP_SESSION_DB')
+        if db_path:
+            return SQLiteSessionStore(db_path, ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+        return InMemorySessionStore(ttl_seconds=ttl_seconds, max_bytes=max_bytes)
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[ConversationSession]:
+        """Session for a phone number, or None if absent or expired"""
+
+    @abc.abstractmethod
+    def set(self, key: str, session: ConversationSession):
+        """Replace the number's session, evicting others to stay within the byte budget"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Forget a number's session"""
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Session count, stored bytes and evictions"""
+
+
+class InMemorySessionStore(SessionStore):
+    """Sessions kept in process, evicted by TTL and least recent use beyond a byte budget"""
+
+    def __init__(self, ttl_seconds: float = 86400, max_bytes: int = 64 * 1024 * 1024):
+        """Initialize an empty store"""
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def get(self, key: str) -> Optional[ConversationSession]:
+        """Session for a phone number, or None if absent or expired"""
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            session, size, updated = entry
+            if time.time() - updated > self.ttl_seconds:
+                self._drop(key)
+                return None
+            self._sessions[key] = (session, size, time.time())
+            self._sessions.move_to_end(key)
+            return session
+
+    def set(self, key: str, session: ConversationSession):
+        """Replace the number's session, evicting others to stay within the byte budget"""
+        size = session.size
+        with self._lock:
+            if key in self._sessions:
+                self._drop(key)
+            self._sessions[key] = (session, size, time.time())
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                self._drop(oldest)
+                self._evictions += 1
+
+    def delete(self, key: str):
+        """Forget a number's session"""
+        with self._lock:
+            if key in self._sessions:
+                self._drop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Session count, memory use and evictions"""
+        with self._lock:
+            return {'sessions': len(self._sessions), 'bytes': self._bytes, 'evictions': self._evictions}
+
+    def _drop(self, key: str):
+        _, size, _ = self._sessions.pop(key)
+        self._bytes -= size
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions persisted in SQLite so they survive restarts and are shared between workers"""
+
+    def __init__(self, db_path: str, ttl_seconds: float = 86400, max_bytes: int = 64 * 1024 * 1024):
+        """Open (or create) the session table"""
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS whatsapp_sessions ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, updated REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS idx_whatsapp_sessions_updated ON whatsapp_sessions (updated)')
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[ConversationSession]:
+        """Session for a phone number, or None if absent or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value, updated FROM whatsapp_sessions WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._db.execute('DELETE FROM whatsapp_sessions WHERE key = ?', (key,))
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE whatsapp_sessions SET updated = ? WHERE key = ?', (now, key))
+            self._db.commit()
+        return ConversationSession.from_json(row[0])
+
+    def set(self, key: str, session: ConversationSession):
+        """Replace the number's session, evicting others to stay within the byte budget"""
+        now = time.time()
+        payload = session.to_json()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO whatsapp_sessions (key, value, size, updated) VALUES (?, ?, ?, ?)',
+                (key, payload, len(payload), now)
+            )
+            self._db.execute('DELETE FROM whatsapp_sessions WHERE updated < ?', (now - self.ttl_seconds,))
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM whatsapp_sessions').fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in self._db.execute(
+                        'SELECT key, size FROM whatsapp_sessions WHERE key != ? ORDER BY updated ASC',
+                        (key,)).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute('DELETE FROM whatsapp_sessions WHERE key = ?', (old_key,))
+                    total -= size
+                    self._evictions += 1
+            self._db.commit()
+
+    def delete(self, key: str):
+        """Forget a number's session"""
+        with self._lock:
+            self._db.execute('DELETE FROM whatsapp_sessions WHERE key = ?', (key,))
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Session count, stored bytes and evictions"""
+        with self._lock:
+            count, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM whatsapp_sessions'
+            ).fetchone()
+        return {'sessions': count, 'bytes': size, 'evictions': self._evictions}
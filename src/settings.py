@@ -0,0 +1,67 @@
+"""
+Settings Module
+Application settings parsed once from the environment
+"""
+
+import os
+import threading
+from typing import FrozenSet, Optional
+
+
+class Settings:
+    """Typed application settings
+
+    Read once at startup (``get_settings``) instead of on every request, so
+    request paths such as ``allowed_file`` do no environment parsing.
+    """
+
+    def __init__(self, secret_key: str = 'dev-secret-key', max_file_size_mb: int = 10,
+                 allowed_extensions: FrozenSet[str] = frozenset({'pdf', 'docx', 'txt'}),
+                 log_level: str = 'INFO', port: int = 5000, debug: bool = False):
+        """Initialize settings"""
+        self.secret_key = secret_key
+        self.max_file_size_mb = max_file_size_mb
+        self.allowed_extensions = frozenset(extension.strip().lower().lstrip('.')
+                                            for extension in allowed_extensions if extension.strip())
+        self.log_level = log_level.upper()
+        self.port = port
+        self.debug = debug
+
+    @classmethod
+    def from_env(cls) -> 'Settings':
+        """Build settings from FLASK_*, MAX_FILE_SIZE_MB, ALLOWED_EXTENSIONS, LOG_LEVEL and PORT"""
+        return cls(
+            secret_key=os.getenv('FLASK_SECRET_KEY', 'dev-secret-key'),
+            max_file_size_mb=int(os.getenv('MAX_FILE_SIZE_MB', 10)),
+            allowed_extensions=frozenset(os.getenv('ALLOWED_EXTENSIONS', 'pdf,docx,txt').split(',')),
+            log_level=os.getenv('LOG_LEVEL', 'INFO'),
+            port=int(os.getenv('PORT', 5000)),
+            debug=os.getenv('FLASK_ENV') == 'development'
+        )
+
+    @property
+    def max_file_size_bytes(self) -> int:
+        """Upload size limit in bytes"""
+        return self.max_file_size_mb * 1024 * 1024
+
+
+_settings: Optional[Settings] = None
+_settings_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    """Process-wide settings, read from the environment on first use"""
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings.from_env()
+    return _settings
+
+
+def configure(settings: Optional[Settings] = None) -> Settings:
+    """Replace the process-wide settings (re-reading the environment when none are given)"""
+    global _settings
+    with _settings_lock:
+        _settings = settings if settings is not None else Settings.from_env()
+    return _settings
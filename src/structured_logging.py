@@ -0,0 +1,314 @@
+"""
+Structured Logging Module
+Non-blocking JSON logging with request/job correlation ids, stage timings, sampling and redaction
+"""
+
+import os
+import re
+import json
+import time
+import queue
+import uuid
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+
+from src.metrics import LOG_RECORDS_DROPPED
+
+# Id of the request, job or WhatsApp message being handled, and its stage timings
+_correlation_id: ContextVar[Optional[str]] = ContextVar('correlation_id', default=None)
+_stages: ContextVar[Optional['StageTimings']] = ContextVar('stages', default=None)
+
+# Header carrying a request's correlation id in and out
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Client-supplied ids are only reused when they are this harmless
+VALID_CORRELATION_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+# E.164 numbers (as Twilio sends them, e.g. whatsapp:+15551234567) and 555-123-4567 style numbers
+PHONE_NUMBER = re.compile(r'\+\d{7,15}\b|\b\d{3}[-. ]\d{3}[-. ]\d{4}\b')
+
+# ``extra`` fields that may hold message bodies or document text
+REDACTED_FIELDS = ('text', 'body', 'message_body', 'document_text')
+
+# Attributes every LogRecord has; anything else was passed in ``extra``
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'correlation_id',
+                                                                  'stages', 'sample', 'taskName'}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+
+
+class StageTimings:
+    """Milliseconds spent per pipeline stage for one request or job (stages may repeat and overlap)"""
+
+    def __init__(self):
+        """Initialize with no stages"""
+        self._totals: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        """Add time to a stage; chunk requests running on other threads may add concurrently"""
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds * 1000
+
+    def to_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {stage: round(ms, 1) for stage, ms in self._totals.items()}
+
+
+def new_correlation_id() -> str:
+    """Fresh random id"""
+    return uuid.uuid4().hex[:16]
+
+
+def bind_correlation(correlation_id: str = None) -> tuple:
+    """Start correlating log records in this context under ``correlation_id`` (a new id if missing or unsafe)
+
+    Returns a token for ``reset_correlation``; prefer ``correlation`` where a
+    ``with`` block fits.
+    """
+    if not correlation_id or not VALID_CORRELATION_ID.match(correlation_id):
+        correlation_id = new_correlation_id()
+    return _correlation_id.set(correlation_id), _stages.set(StageTimings())
+
+
+def reset_correlation(token: tuple):
+    """Restore the correlation id and stage timings that were current before bind_correlation"""
+    id_token, stages_token = token
+    _stages.reset(stages_token)
+    _correlation_id.reset(id_token)
+
+
+@contextmanager
+def correlation(correlation_id: str = None):
+    """Correlate the log records of the enclosed block; yields the id in use"""
+    token = bind_correlation(correlation_id)
+    try:
+        yield _correlation_id.get()
+    finally:
+        reset_correlation(token)
+
+
+def current_correlation_id() -> Optional[str]:
+    """Id of the request, job or message being handled, or None outside of one"""
+    return _correlation_id.get()
+
+
+def record_stage(stage: str, seconds: float):
+    """Add time to a stage of the current request or job (ignored outside of one)"""
+    timings = _stages.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def log_stage(stage: str):
+    """Add the enclosed block's duration to the current request's stage timings"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def stage_timings() -> Dict[str, float]:
+    """Stage durations (ms) recorded so far for the current request or job"""
+    timings = _stages.get()
+    return timings.to_dict() if timings is not None else {}
+
+
+def redact(text: str) -> str:
+    """Mask all but the last four digits of phone numbers"""
+    return PHONE_NUMBER.sub(lambda match: re.sub(r'\d(?=(?:\D*\d){4})', '*', match.group()), text)
+
+
+class RedactionFilter(logging.Filter):
+    """Masks phone numbers, replaces message bodies and document text, and caps message length
+
+    Runs on the output handlers, i.e. on the listener thread, not on the request path.
+    """
+
+    def __init__(self, max_message_chars: int = 2000):
+        """Initialize with the longest message kept whole (0 for no limit)"""
+        super().__init__()
+        self.max_message_chars = max_message_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, '_redacted', False):
+            return True
+        message = redact(record.getMessage())
+        if self.max_message_chars and len(message) > self.max_message_chars:
+            message = f"{message[:self.max_message_chars]}... [{len(message) - self.max_message_chars} chars dropped]"
+        record.msg, record.args = message, None
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        for field in REDACTED_FIELDS:
+            value = getattr(record, field, None)
+            if isinstance(value, str):
+                setattr(record, field, f"<redacted: {len(value)} chars>")
+        record._redacted = True
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one in every ``1 / rate`` high-volume INFO records, counted per message template
+
+    Only records logged with ``extra={'sample': True}`` at INFO or below are
+    sampled; warnings and errors are always kept.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        """Initialize with the share of sampled records to keep"""
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sample', False) or record.levelno > logging.INFO:
+            return True
+        if not self.every:
+            return False
+        key = (record.name, record.msg)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % self.every == 0
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread without waiting on I/O; drops (and counts) them when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Attach the correlation id and resolve the message on the calling thread; formatting happens later"""
+        record.correlation_id = _correlation_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks reference frames that must not outlive the call
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class _Listener(QueueListener):
+    """QueueListener whose stop may be called more than once (by its owner and at exit)"""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, correlation id, stages and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', None)
+        }
+        stages = getattr(record, 'stages', None)
+        if stages:
+            entry['stages_ms'] = stages
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, plus the correlation id"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, 'correlation_id'):
+            record.correlation_id = _correlation_id.get()
+        record.correlation_id = record.correlation_id or '-'
+        return super().format(record)
+
+
+class LoggingConfig:
+    """Where logs go and how they are shaped"""
+
+    def __init__(self, level: str = 'INFO', console_format: str = 'text', file: str = 'jollybot.log',
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5, sample_rate: float = 0.1,
+                 queue_size: int = 10000, max_message_chars: int = 2000):
+        """Initialize the configuration; an empty ``file`` logs to the console only"""
+        self.level = level
+        self.console_format = console_format
+        self.file = file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.sample_rate = sample_rate
+        self.queue_size = queue_size
+        self.max_message_chars = max_message_chars
+
+    @classmethod
+    def from_env(cls, level: str = 'INFO') -> 'LoggingConfig':
+        """Read LOG_* environment variables"""
+        return cls(
+            level=level,
+            console_format=os.getenv('LOG_FORMAT', 'text').lower(),
+            file=os.getenv('LOG_FILE', 'jollybot.log'),
+            max_bytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+            backup_count=int(os.getenv('LOG_BACKUP_COUNT', 5)),
+            sample_rate=float(os.getenv('LOG_SAMPLE_RATE', 0.1)),
+            queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+            max_message_chars=int(os.getenv('LOG_MAX_MESSAGE_CHARS', 2000))
+        )
+
+
+def configure_logging(config: LoggingConfig, root: logging.Logger = None) -> Optional[QueueListener]:
+    """Send ``root``'s records through a queue to a listener thread that writes them out
+
+    The console gets ``config.console_format`` (text, json or none) and ``config.file``
+    gets JSON, rotated at ``max_bytes``. Like ``logging.basicConfig``, does nothing
+    and returns None when the logger already has handlers; otherwise returns the
+    started listener, which is stopped (flushing queued records) at exit.
+    """
+    root = root if root is not None else logging.getLogger()
+    if root.handlers:
+        return None
+
+    outputs = []
+    if config.console_format != 'none':
+        console = logging.StreamHandler()
+        console.setFormatter(JsonFormatter() if config.console_format == 'json' else TextFormatter())
+        outputs.append(console)
+    if config.file:
+        file_handler = RotatingFileHandler(config.file, maxBytes=config.max_bytes, backupCount=config.backup_count,
+                                           encoding='utf-8', delay=True)
+        file_handler.setFormatter(JsonFormatter())
+        outputs.append(file_handler)
+    redaction = RedactionFilter(config.max_message_chars)
+    for output in outputs:
+        output.addFilter(redaction)
+
+    handler = NonBlockingQueueHandler(queue.Queue(config.queue_size))
+    handler.addFilter(SamplingFilter(config.sample_rate))
+    listener = _Listener(handler.queue, *outputs, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, config.level.upper(), logging.INFO))
+    return listener
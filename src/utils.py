@@ -3,32 +3,26 @@ Utility functions for the JollyLLBot application
 """
 
 import os
-import logging
 from typing import Set
 
+from src.settings import get_settings
+from src.structured_logging import LoggingConfig, configure_logging
+
 
 def allowed_file(filename: str) -> bool:
     """Check if file extension is allowed"""
-    allowed_extensions = set(os.getenv('ALLOWED_EXTENSIONS', 'pdf,docx,txt').split(','))
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in allowed_extensions
+           filename.rsplit('.', 1)[1].lower() in get_settings().allowed_extensions
 
 
 def get_allowed_extensions() -> Set[str]:
     """Get set of allowed file extensions"""
-    return set(os.getenv('ALLOWED_EXTENSIONS', 'pdf,docx,txt').split(','))
+    return set(get_settings().allowed_extensions)
 
 
 def setup_logging(log_level: str = 'INFO'):
-    """Setup logging configuration"""
-    logging.basicConfig(
-        level=getattr(logging, log_level),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.StreamHandler(),
-            logging.FileHandler('jollybot.log') if os.path.exists('.') else logging.NullHandler()
-        ]
-    )
+    """Setup logging configuration: queued, non-blocking handlers configured from LOG_* variables"""
+    return configure_logging(LoggingConfig.from_env(log_level))
 
 
 def validate_file_size(file_path: str, max_size_mb: int = 10) -> bool:
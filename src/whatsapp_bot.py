@@ -4,82 +4,553 @@ Handles WhatsApp integration using Twilio
 """
 
 import os
+import sys
+import time
+import asyncio
+import hashlib
 import logging
+import threading
+import requests
+from contextlib import nullcontext
 from flask import request
-from twilio.rest import Client
-from twilio.twiml.messaging_response import MessagingResponse
+
+from src.analysis_cache import AnalysisCache
+from src.job_queue import QueueFullError
+from src.media_fetcher import MediaFetcher, MediaTooLargeError, UntrustedMediaUrlError, media_extension
+from src.message_dispatcher import AsyncMessageDispatcher, MessageDispatcher
+from src.metrics import ERRORS, WEBHOOK_SECONDS
+from src.rate_limit import TokenBucket
+from src.scheduler import WHATSAPP, AnalysisScheduler, Overloaded
+from src.session_store import ConversationSession, SessionStore
 
 logger = logging.getLogger(__name__)
 
+BUSY_MESSAGE = "⏳ I'm handling a lot of requests right now. Please try again in a minute."
+RATE_LIMITED_MESSAGE = "⏳ You're sending messages faster than I can keep up. Please wait a moment and try again."
+
+# What MessagingResponse renders with no messages
+EMPTY_TWIML = '<?xml version="1.0" encoding="UTF-8"?><Response />'
+
+# WhatsApp rejects message bodies longer than this
+MESSAGE_LIMIT = 1600
+
+# Messages treated as commands even while a document conversation is active
+COMMANDS = ('hello', 'hi', 'start', 'help', 'analyze', 'status', 'reset')
+
+# Header carrying Twilio's HMAC signature of the webhook URL and form fields
+SIGNATURE_HEADER = 'X-Twilio-Signature'
+
+
+class InvalidSignatureError(Exception):
+    """Raised for webhook calls that were not signed by Twilio with the account's auth token"""
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """Split text into messages within ``limit``, breaking on lines where possible
+
+    Parts are numbered "(1/3)" when more than one is needed.
+    """
+    if len(text) <= limit:
+        return [text]
+    
+    budget = limit - len('(99/99)\n')
+    parts = []
+    current = ''
+    for line in text.split('\n'):
+        while len(line) > budget:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(line[:budget])
+            line = line[budget:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > budget:
+            parts.append(current)
+            candidate = line
+        current = candidate
+    if current.strip():
+        parts.append(current)
+    return [f"({index}/{len(parts)})\n{part.strip()}" for index, part in enumerate(parts, 1)]
+
 
 class WhatsAppBot:
     """WhatsApp bot for legal document analysis"""
     
-    def __init__(self):
-        """Initialize Twilio client"""
+    def __init__(self, client=None, dispatcher: MessageDispatcher = None, analyzer=None,
+                 fetcher: MediaFetcher = None, sessions: SessionStore = None,
+                 scheduler: AnalysisScheduler = None):
+        """Initialize Twilio client
+        
+        The client is created on first use (only then importing the Twilio SDK)
+        and reused so its HTTP connection pool is shared by every outbound
+        message. ``client`` may be any object with a Twilio-style
+        ``messages.create``, e.g. a fake in tests. Documents sent
+        as media are analyzed with ``analyzer`` after being downloaded by
+        ``fetcher``, and kept in ``sessions`` for follow-up questions. With a
+        ``scheduler``, each sender is rate limited and analyses and answers
+        wait for a slot in the WhatsApp traffic class.
+        """
         account_sid = os.getenv('TWILIO_ACCOUNT_SID')
         auth_token = os.getenv('TWILIO_AUTH_TOKEN')
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.api_base_url = os.getenv('TWILIO_API_BASE_URL')
+        # Public URL Twilio posts to, when it differs from the URL the app sees (e.g. behind a proxy)
+        self.webhook_url = os.getenv('TWILIO_WEBHOOK_URL')
+        self.validate_signatures = os.getenv('TWILIO_VALIDATE_SIGNATURE', 'true').lower() in ('1', 'true', 'yes')
         self.whatsapp_number = os.getenv('TWILIO_WHATSAPP_NUMBER', 'whatsapp:+14155238886')
+        self.max_retries = int(os.getenv('TWILIO_MAX_RETRIES', 3))
+        self.backoff_base = float(os.getenv('TWILIO_BACKOFF_BASE_SECONDS', 0.5))
+        self.backoff_max = float(os.getenv('TWILIO_BACKOFF_MAX_SECONDS', 8))
+        self.rate_limiter = TokenBucket(float(os.getenv('TWILIO_MESSAGES_PER_SECOND', 10)))
+        self.dispatcher = dispatcher if dispatcher is not None else MessageDispatcher.from_env()
+        # Used by the *_async methods in place of the thread pool dispatcher and blocking client
+        self.async_dispatcher = AsyncMessageDispatcher.from_env()
+        self._async_client = None
+        self.analyzer = analyzer
+        self.fetcher = fetcher if fetcher is not None else MediaFetcher.from_env()
+        # Analyses of recently received media by content hash, so re-forwarded documents reply instantly
+        self.media_results = AnalysisCache(max_entries=int(os.getenv('WHATSAPP_MEDIA_CACHE_SIZE', 256)))
+        self.sessions = sessions if sessions is not None else SessionStore.from_env()
+        self.qa_chunk_tokens = int(os.getenv('WHATSAPP_QA_CHUNK_TOKENS', 200))
+        self.qa_top_k = int(os.getenv('WHATSAPP_QA_TOP_K', 3))
+        self.scheduler = scheduler
         
-        if account_sid and auth_token:
-            self.client = Client(account_sid, auth_token)
-            logger.info("Twilio client initialized successfully")
-        else:
-            self.client = None
+        self._client = client
+        self._client_ready = client is not None or not (account_sid and auth_token)
+        self._client_lock = threading.Lock()
+        if client is None and self._client_ready:
             logger.warning("Twilio credentials not found. WhatsApp bot will use mock responses.")
     
+    @property
+    def client(self):
+        """Twilio client, or None without credentials"""
+        if not self._client_ready:
+            with self._client_lock:
+                if not self._client_ready:
+                    self._client = self._build_client()
+                    self._client_ready = True
+                    logger.info("Twilio client initialized successfully")
+        return self._client
+    
+    @client.setter
+    def client(self, client):
+        self._client = client
+        self._client_ready = True
+    
+    @property
+    def configured(self) -> bool:
+        """Whether messages are sent through Twilio, without building the client"""
+        return self._client is not None if self._client_ready else True
+    
+    def _build_client(self, http_client=None):
+        """Twilio client for the configured account, pointed at TWILIO_API_BASE_URL when set"""
+        from twilio.rest import Client
+        client = Client(self.account_sid, self.auth_token, http_client=http_client)
+        if self.api_base_url:
+            # e.g. a local fake Twilio endpoint
+            client.api.base_url = self.api_base_url.rstrip('/')
+        return client
+    
+    def _get_async_client(self):
+        """Twilio client with an aiohttp transport, created on first use inside the serving event loop"""
+        if self._async_client is None and self.account_sid and self.auth_token:
+            from twilio.http.async_http_client import AsyncTwilioHttpClient
+            self._async_client = self._build_client(AsyncTwilioHttpClient())
+        return self._async_client
+    
     def handle_message(self, request):
-        """Handle incoming WhatsApp message"""
-        try:
-            # Get message details
-            from_number = request.values.get('From', '')
-            message_body = request.values.get('Body', '').strip().lower()
-            
-            logger.info(f"Received WhatsApp message from {from_number}: {message_body}")
-            
-            # Create response
-            response = MessagingResponse()
-            msg = response.message()
+        """Handle incoming WhatsApp message
+        
+        The webhook is acknowledged straight away with an empty TwiML response;
+        the reply is worked out and sent from the background dispatcher, in
+        order per sender. Without Twilio credentials replies can only be
+        returned inline. Raises InvalidSignatureError for unsigned calls.
+        """
+        return self._acknowledge(request.form, self.dispatcher, self._process_message, self._process_media,
+                                 request.url, request.headers.get(SIGNATURE_HEADER))
+    
+    async def handle_message_async(self, values, url: str = None, signature: str = None) -> str:
+        """Async counterpart of handle_message; ``values`` are the webhook's form fields
+        
+        Replies are worked out and sent as tasks on the running event loop.
+        """
+        return self._acknowledge(values, self.async_dispatcher, self._process_message_async,
+                                 self._process_media_async, url, signature)
+    
+    def verify_request(self, url: str, values, signature: str):
+        """Raise InvalidSignatureError unless ``signature`` is Twilio's signature of ``url`` and ``values``
+        
+        Skipped without an auth token: the bot then only replies inline and
+        never downloads media with credentials.
+        """
+        if not self.validate_signatures or not self.auth_token:
+            return
+        from twilio.request_validator import RequestValidator
+        if not signature or not RequestValidator(self.auth_token).validate(self.webhook_url or url, values, signature):
+            raise InvalidSignatureError("Webhook call is not signed by Twilio")
+    
+    def _acknowledge(self, values, dispatcher, process_message, process_media, url: str = None,
+                     signature: str = None) -> str:
+        """Queue the work for one verified webhook call on ``dispatcher`` and return the TwiML acknowledgement"""
+        self.verify_request(url, values, signature)
+        with WEBHOOK_SECONDS.time():
+            try:
+                # Get message details
+                from_number = values.get('From', '')
+                message_body = values.get('Body', '').strip()
+                num_media = int(values.get('NumMedia', 0) or 0)
+                
+                # Message text stays out of the logs; only its size is recorded
+                logger.info("Received WhatsApp message %s from %s (%s chars, %s attachments)",
+                            values.get('MessageSid', ''), from_number, len(message_body), num_media,
+                            extra={'sample': True})
+                
+                if not self.configured:
+                    if num_media:
+                        return self._twiml("📄 Document analysis over WhatsApp is not configured yet. "
+                                           "Please upload your document through our web app.")
+                    return self._twiml(self._reply_for(message_body))
+                
+                if self.scheduler is not None:
+                    try:
+                        self.scheduler.admit(WHATSAPP, from_number)
+                    except Overloaded:
+                        return self._twiml(RATE_LIMITED_MESSAGE)
+                
+                try:
+                    if num_media:
+                        for index in range(num_media):
+                            dispatcher.submit(
+                                from_number, process_media, from_number,
+                                values.get(f'MediaUrl{index}', ''),
+                                values.get(f'MediaContentType{index}', '')
+                            )
+                    else:
+                        dispatcher.submit(from_number, process_message, from_number, message_body)
+                except QueueFullError:
+                    logger.warning("WhatsApp dispatcher full; asking %s to retry", from_number)
+                    return self._twiml(BUSY_MESSAGE)
+                
+                return self._twiml()
             
-            # Process message based on content
-            if message_body in ['hello', 'hi', 'start', 'help']:
-                reply_text = self._get_welcome_message()
-            elif 'analyze' in message_body or 'document' in message_body:
-                reply_text = self._get_document_instructions()
-            elif 'status' in message_body:
-                reply_text = self._get_status_message()
+            except Exception as e:
+                ERRORS.labels(stage='whatsapp').inc()
+                logger.error("Error handling WhatsApp message: %s", e)
+                return self._twiml("Sorry, I encountered an error. Please try again later.")
+    
+    def _twiml(self, reply_text: str = None) -> str:
+        """TwiML response, optionally with an inline reply"""
+        if reply_text is None:
+            # The plain acknowledgement every webhook returns needs no SDK
+            return EMPTY_TWIML
+        from twilio.twiml.messaging_response import MessagingResponse
+        response = MessagingResponse()
+        if reply_text is not None:
+            response.message().body(reply_text)
+        return str(response)
+    
+    def _process_message(self, from_number: str, message_body: str):
+        """Work out the reply to one message and send it (runs on the dispatcher)
+        
+        While the sender has a document session, anything that is not a command
+        is taken as a question about that document.
+        """
+        command = message_body.lower()
+        if command == 'reset':
+            self.sessions.delete(from_number)
+            self.send_message(from_number, "🗑️ Done. Send a new document whenever you're ready.")
+            return
+        
+        session = self.sessions.get(from_number) if command not in COMMANDS else None
+        if session is not None:
+            self._answer_question(from_number, message_body, session)
+        else:
+            self.send_message(from_number, self._reply_for(message_body))
+    
+    async def _process_message_async(self, from_number: str, message_body: str):
+        """Async counterpart of _process_message (runs on the event loop)"""
+        command = message_body.lower()
+        if command == 'reset':
+            self.sessions.delete(from_number)
+            await self.send_message_async(from_number, "🗑️ Done. Send a new document whenever you're ready.")
+            return
+        
+        session = self.sessions.get(from_number) if command not in COMMANDS else None
+        if session is not None:
+            await self._answer_question_async(from_number, message_body, session)
+        else:
+            await self.send_message_async(from_number, self._reply_for(message_body))
+    
+    def _answer_question(self, from_number: str, question: str, session: ConversationSession):
+        """Answer from the clauses of the session's document that match the question"""
+        excerpts = session.relevant_clauses(question, self.qa_top_k)
+        logger.info("Answering question from %s with %s of %s clauses of %s",
+                    from_number, len(excerpts), len(session.clauses), session.filename)
+        try:
+            with self._slot():
+                answer = self.analyzer.answer_question(question, excerpts)
+        except Overloaded:
+            self.send_message(from_number, BUSY_MESSAGE)
+            return
+        for part in split_message(answer):
+            self.send_message(from_number, part)
+    
+    async def _answer_question_async(self, from_number: str, question: str, session: ConversationSession):
+        """Async counterpart of _answer_question"""
+        excerpts = session.relevant_clauses(question, self.qa_top_k)
+        logger.info("Answering question from %s with %s of %s clauses of %s",
+                    from_number, len(excerpts), len(session.clauses), session.filename)
+        try:
+            with await self._slot_async():
+                answer = await self.analyzer.answer_question_async(question, excerpts)
+        except Overloaded:
+            await self.send_message_async(from_number, BUSY_MESSAGE)
+            return
+        for part in split_message(answer):
+            await self.send_message_async(from_number, part)
+    
+    def _process_media(self, from_number: str, media_url: str, content_type: str):
+        """Download one attachment, analyze it and send back a condensed result (runs on the dispatcher)"""
+        extension = media_extension(content_type)
+        if self.analyzer is None or extension is None:
+            self.send_message(from_number, "📄 I can analyze PDF, DOCX or TXT files. "
+                                           "Please send your document in one of those formats.")
+            return
+        
+        filename = f"whatsapp-document.{extension}"
+        try:
+            document = self.fetcher.fetch(media_url, filename)
+        except MediaTooLargeError:
+            self.send_message(from_number, "📄 That file is too large to analyze here. "
+                                           "Please upload it through our web app.")
+            return
+        except (requests.RequestException, UntrustedMediaUrlError) as e:
+            logger.error("Failed to fetch media from %s: %s", from_number, e)
+            self.send_message(from_number, "Sorry, I couldn't download your document. Please try again.")
+            return
+        
+        with document:
+            # Repeats are recognised by their bytes, before any extraction work
+            digest = hashlib.sha256(document.buffer).hexdigest()
+            cached = self.media_results.get(digest)
+            if cached is None:
+                self.send_message(from_number, "⏳ Got your document, analyzing it now...")
+                try:
+                    text = self.analyzer.extract_text(document)
+                except Exception as e:
+                    logger.error("Failed to read media from %s: %s", from_number, e)
+                    text = ''
+                try:
+                    with self._slot():
+                        result = self.analyzer.analyze_text(text, document.buffer)
+                except Overloaded:
+                    self.send_message(from_number, BUSY_MESSAGE)
+                    return
+                session = self._media_session(digest, filename, text, result)
             else:
-                reply_text = self._get_default_message()
-            
-            msg.body(reply_text)
-            
-            return str(response)
-            
-        except Exception as e:
-            logger.error(f"Error handling WhatsApp message: {str(e)}")
-            response = MessagingResponse()
-            msg = response.message()
-            msg.body("Sorry, I encountered an error. Please try again later.")
-            return str(response)
+                logger.info("Reusing analysis of media %s for %s", digest[:12], from_number)
+                result = cached['result']
+                session = ConversationSession(filename, cached['clauses'], result['analysis'])
+        
+        if not result.get('success'):
+            self.send_message(from_number, f"Sorry, I couldn't analyze that document. "
+                                           f"{result.get('error', '')}".strip())
+            return
+        
+        self.sessions.set(from_number, session)
+        for part in split_message(self._format_analysis_message(filename, result['analysis'])):
+            self.send_message(from_number, part)
+    
+    async def _process_media_async(self, from_number: str, media_url: str, content_type: str):
+        """Async counterpart of _process_media; the download runs in a thread, analysis is awaited"""
+        extension = media_extension(content_type)
+        if self.analyzer is None or extension is None:
+            await self.send_message_async(from_number, "📄 I can analyze PDF, DOCX or TXT files. "
+                                                       "Please send your document in one of those formats.")
+            return
+        
+        filename = f"whatsapp-document.{extension}"
+        try:
+            document = await asyncio.get_running_loop().run_in_executor(
+                None, self.fetcher.fetch, media_url, filename)
+        except MediaTooLargeError:
+            await self.send_message_async(from_number, "📄 That file is too large to analyze here. "
+                                                       "Please upload it through our web app.")
+            return
+        except (requests.RequestException, UntrustedMediaUrlError) as e:
+            logger.error("Failed to fetch media from %s: %s", from_number, e)
+            await self.send_message_async(from_number, "Sorry, I couldn't download your document. "
+                                                       "Please try again.")
+            return
+        
+        with document:
+            digest = hashlib.sha256(document.buffer).hexdigest()
+            cached = self.media_results.get(digest)
+            if cached is None:
+                await self.send_message_async(from_number, "⏳ Got your document, analyzing it now...")
+                try:
+                    text = await self.analyzer.extract_text_async(document)
+                except Exception as e:
+                    logger.error("Failed to read media from %s: %s", from_number, e)
+                    text = ''
+                try:
+                    with await self._slot_async():
+                        result = await self.analyzer.analyze_text_async(text, document.buffer)
+                except Overloaded:
+                    await self.send_message_async(from_number, BUSY_MESSAGE)
+                    return
+                session = self._media_session(digest, filename, text, result)
+            else:
+                logger.info("Reusing analysis of media %s for %s", digest[:12], from_number)
+                result = cached['result']
+                session = ConversationSession(filename, cached['clauses'], result['analysis'])
+        
+        if not result.get('success'):
+            await self.send_message_async(from_number, f"Sorry, I couldn't analyze that document. "
+                                                       f"{result.get('error', '')}".strip())
+            return
+        
+        self.sessions.set(from_number, session)
+        for part in split_message(self._format_analysis_message(filename, result['analysis'])):
+            await self.send_message_async(from_number, part)
+    
+    def _media_session(self, digest: str, filename: str, text: str, result: dict) -> ConversationSession:
+        """Session for a freshly analyzed attachment, caching the result and clauses under its content hash
+        
+        Returns None when the analysis failed.
+        """
+        if not result.get('success'):
+            return None
+        session = ConversationSession.from_text(filename, text, result['analysis'], self.qa_chunk_tokens)
+        self.media_results.set(digest, {'result': result, 'clauses': session.clauses})
+        return session
+    
+    def _slot(self):
+        """Scheduler slot for one analysis or answer; a no-op without a scheduler"""
+        return self.scheduler.acquire(WHATSAPP) if self.scheduler is not None else nullcontext()
+    
+    async def _slot_async(self):
+        """Async counterpart of _slot"""
+        return await self.scheduler.acquire_async(WHATSAPP) if self.scheduler is not None else nullcontext()
+    
+    def _format_analysis_message(self, filename: str, analysis: dict) -> str:
+        """Condensed analysis for chat"""
+        lines = [
+            "✅ Document Analysis Complete!",
+            "",
+            f"📄 File: {filename}",
+            f"📑 Type: {analysis['document_type']}",
+            f"📋 Summary: {analysis['summary']}"
+        ]
+        if analysis.get('what_changed'):
+            lines += ["", f"🔄 What Changed: {analysis['what_changed']['summary']}"]
+        for title, field in (("🔑 Key Points", 'key_points'), ("⚠️ Risks & Concerns", 'risks_concerns'),
+                             ("💡 Recommendations", 'recommendations')):
+            if analysis.get(field):
+                lines += ["", f"{title}:"] + [f"• {item}" for item in analysis[field]]
+        lines += ["", "💬 Ask me anything about this document, or send 'reset' to start over."]
+        return '\n'.join(lines)
+    
+    def _reply_for(self, message_body: str) -> str:
+        """Reply text for a message body"""
+        message_body = message_body.lower()
+        
+        # Process message based on content
+        if message_body in ['hello', 'hi', 'start', 'help']:
+            return self._get_welcome_message()
+        elif 'analyze' in message_body or 'document' in message_body:
+            return self._get_document_instructions()
+        elif 'status' in message_body:
+            return self._get_status_message()
+        else:
+            return self._get_default_message()
+    
+    def queue_message(self, to_number: str, message: str):
+        """Send a message from the dispatcher, after anything already queued for the number"""
+        self.dispatcher.submit(to_number, self.send_message, to_number, message)
     
     def send_message(self, to_number: str, message: str):
-        """Send a message to a WhatsApp number"""
+        """Send a message to a WhatsApp number, retrying transient failures with backoff"""
         if not self.client:
             logger.warning("Cannot send message - Twilio client not initialized")
             return False
         
-        try:
-            message = self.client.messages.create(
-                body=message,
-                from_=self.whatsapp_number,
-                to=to_number
-            )
-            logger.info(f"Message sent to {to_number}: {message.sid}")
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                sent = self.client.messages.create(
+                    body=message,
+                    from_=self.whatsapp_number,
+                    to=to_number
+                )
+                logger.info("Message sent to %s: %s", to_number, sent.sid, extra={'sample': True})
+                return True
+                
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    logger.error("Failed to send message: %s", e)
+                    return False
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                logger.warning("Send to %s failed (%s); retrying in %.1fs", to_number, e, delay)
+                time.sleep(delay)
+    
+    async def send_message_async(self, to_number: str, message: str):
+        """Async counterpart of send_message; waits for Twilio without holding a thread"""
+        client = self._get_async_client()
+        if client is None:
+            if not self.client:
+                logger.warning("Cannot send message - Twilio client not initialized")
+                return False
+            # An injected blocking client has no async transport; keep it off the event loop
+            return await asyncio.get_running_loop().run_in_executor(None, self.send_message, to_number, message)
+        
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire_async()
+            try:
+                sent = await client.messages.create_async(
+                    body=message,
+                    from_=self.whatsapp_number,
+                    to=to_number
+                )
+                logger.info("Message sent to %s: %s", to_number, sent.sid, extra={'sample': True})
+                return True
+                
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    logger.error("Failed to send message: %s", e)
+                    return False
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                logger.warning("Send to %s failed (%s); retrying in %.1fs", to_number, e, delay)
+                await asyncio.sleep(delay)
+    
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """Rate limits, server errors and network failures are worth retrying"""
+        # The SDKs are imported lazily; an error can only come from one that is already loaded
+        twilio_exceptions = sys.modules.get('twilio.base.exceptions')
+        if twilio_exceptions is not None and isinstance(error, twilio_exceptions.TwilioRestException):
+            return error.status == 429 or error.status >= 500
+        aiohttp = sys.modules.get('aiohttp')
+        if aiohttp is not None and isinstance(error, aiohttp.ClientError):
             return True
-            
-        except Exception as e:
-            logger.error(f"Failed to send message: {str(e)}")
-            return False
+        return isinstance(error, (requests.RequestException, asyncio.TimeoutError))
+    
+    def ping(self):
+        """Fetch the Twilio account, raising if the API is unreachable or the credentials are rejected"""
+        self.client.api.v2010.accounts(self.account_sid).fetch()
+    
+    def shutdown(self, wait: bool = True):
+        """Stop the background dispatcher and release pooled connections"""
+        self.dispatcher.shutdown(wait=wait)
+        self.fetcher.close()
+    
+    async def shutdown_async(self, wait: bool = True):
+        """Finish (or cancel) event loop tasks and close the async Twilio session"""
+        await self.async_dispatcher.shutdown(wait=wait)
+        if self._async_client is not None:
+            await self._async_client.http_client.close()
+            self._async_client = None
     
     def _get_welcome_message(self) -> str:
         """Get welcome message for new users"""
@@ -93,7 +564,7 @@ I can help you analyze legal documents. Here's what I can do:
 💡 Legal Recommendations
 
 To get started:
-1. Visit our web app to upload documents
+1. Send a PDF, DOCX or TXT file here, or use our web app
 2. Type 'analyze' for document analysis instructions
 3. Type 'help' for more options
 
@@ -103,7 +574,9 @@ How can I assist you today?"""
         """Get document analysis instructions"""
         return """📄 Document Analysis Instructions:
 
-Currently, document upload is available through our web interface. 
+📱 On WhatsApp:
+• Send a PDF, DOCX, or TXT file as an attachment
+• Receive the summary, key points, risks and recommendations here
 
 🌐 Web App Features:
 • Upload PDF, DOCX, or TXT files
@@ -112,7 +585,6 @@ Currently, document upload is available through our web interface.
 • Download analysis reports
 
 📱 Coming Soon:
-• Direct document upload via WhatsApp
 • Voice message analysis
 • Quick legal Q&A
 
@@ -144,6 +616,7 @@ Try these commands:
 • 'analyze' - Document analysis info
 • 'help' - Show available options  
 • 'status' - Check system status
+• 'reset' - Forget the last document
 
 Or visit our web app for document upload and analysis!"""
     
@@ -31,6 +31,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
             
+            // Render results progressively when the browser can read streamed responses
+            if (uploadForm.dataset.streamUrl && window.ReadableStream && window.TextDecoder) {
+                e.preventDefault();
+                streamAnalysis(uploadForm, file);
+                return;
+            }
+            
             showLoadingState();
         });
     }
@@ -114,6 +121,138 @@ async function analyzeDocumentAPI(file) {
     }
 }
 
+// Streaming analysis (Server-Sent Events over a POST response)
+async function streamAnalysis(form, file) {
+    const btn = document.getElementById('analyzeBtn');
+    const formData = new FormData();
+    formData.append('file', file);
+    
+    if (btn) {
+        btn.disabled = true;
+        btn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Analyzing...';
+    }
+    
+    resetStreamResults(file.name);
+    
+    try {
+        const response = await fetch(form.dataset.streamUrl, {
+            method: 'POST',
+            body: formData
+        });
+        
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            const messages = buffer.split('\n\n');
+            buffer = messages.pop();
+            messages.forEach(handleStreamMessage);
+        }
+    } catch (error) {
+        console.error('Streaming analysis error:', error);
+        // Fall back to the regular form submission
+        showLoadingState();
+        form.submit();
+        return;
+    }
+    
+    if (btn) {
+        btn.disabled = false;
+        btn.innerHTML = '<i class="fas fa-brain me-2"></i>Analyze Document';
+    }
+}
+
+function resetStreamResults(filename) {
+    const container = document.getElementById('streamResults');
+    if (!container) return;
+    
+    container.classList.remove('d-none');
+    document.getElementById('streamStatus').textContent = 'Extracting text...';
+    document.getElementById('streamFilename').textContent = filename;
+    document.getElementById('streamWordCount').textContent = '...';
+    document.getElementById('streamDocumentType').textContent = '...';
+    document.getElementById('streamFullAnalysis').textContent = '';
+    container.querySelectorAll('[data-section]').forEach(function(section) {
+        section.innerHTML = '<p class="text-muted mb-0"><i class="fas fa-spinner fa-spin me-2"></i>Waiting for analysis...</p>';
+    });
+    container.scrollIntoView({ behavior: 'smooth' });
+}
+
+function handleStreamMessage(message) {
+    let event = 'message';
+    const dataLines = [];
+    
+    message.split('\n').forEach(function(line) {
+        if (line.startsWith('event:')) {
+            event = line.slice(6).trim();
+        } else if (line.startsWith('data:')) {
+            dataLines.push(line.slice(5).trim());
+        }
+    });
+    
+    if (!dataLines.length) return;
+    const data = JSON.parse(dataLines.join('\n'));
+    
+    switch (event) {
+        case 'extracted':
+            document.getElementById('streamStatus').textContent = 'Analyzing document...';
+            document.getElementById('streamWordCount').textContent = data.word_count;
+            document.getElementById('streamDocumentType').textContent = data.document_type;
+            break;
+        case 'token':
+            document.getElementById('streamFullAnalysis').textContent += data.text;
+            break;
+        case 'section':
+            renderStreamSection(data.name, data.value);
+            break;
+        case 'complete':
+            document.getElementById('streamStatus').textContent = 'Analysis complete';
+            document.getElementById('streamDocumentType').textContent = data.analysis.analysis.document_type;
+            document.getElementById('streamFullAnalysis').textContent = data.analysis.analysis.full_analysis;
+            break;
+        case 'error':
+            document.getElementById('streamStatus').textContent = 'Analysis failed';
+            showAlert(data.error, 'danger');
+            break;
+    }
+}
+
+function renderStreamSection(name, value) {
+    const section = document.querySelector(`#streamResults [data-section="${name}"]`);
+    if (!section) return;
+    
+    section.innerHTML = '';
+    if (Array.isArray(value)) {
+        if (!value.length) {
+            section.innerHTML = '<p class="text-muted mb-0">Nothing identified</p>';
+            return;
+        }
+        const list = document.createElement('ul');
+        list.className = 'list-group list-group-flush';
+        value.forEach(function(item) {
+            const li = document.createElement('li');
+            li.className = 'list-group-item border-0 px-0';
+            li.textContent = item;
+            list.appendChild(li);
+        });
+        section.appendChild(list);
+    } else {
+        const p = document.createElement('p');
+        p.className = 'card-text';
+        p.textContent = value;
+        section.appendChild(p);
+    }
+}
+
 // Utility functions
 function formatFileSize(bytes) {
     if (bytes === 0) return '0 Bytes';
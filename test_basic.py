@@ -5,11 +5,279 @@ Basic test script for JollyLLBot functionality
 
 import os
 import sys
+import json
+import queue
+import asyncio
+import logging
+import time
+import hashlib
 import tempfile
-from src.document_analyzer import DocumentAnalyzer
-from src.whatsapp_bot import WhatsAppBot
+import threading
+from io import BytesIO
+from types import SimpleNamespace
+from src.analysis_cache import AnalysisCache
+from src import chunking
+from src.chunking import count_tokens, estimate_tokens, split_into_chunks
+from src.clause_index import ClauseIndex, ClauseIndexStore
+from src.compaction import PromptCompactor
+from src.document_source import DocumentSource
+from src.extraction import PAGE_BREAK, PdfExtractionEngine
+from src.llm_client import AsyncLLMClient, LLMClient
+from src.media_fetcher import MediaTooLargeError, _LimitedReader
+from src.message_dispatcher import MessageDispatcher
+from src.metrics import LOG_RECORDS_DROPPED, Counter, Gauge, Histogram, Registry
+from src.model_router import FAST_PATH, TEMPLATES, ModelRouter, ModelTier, default_routes
+from src.near_duplicate import NearDuplicateIndex, minhash_signature, signature_similarity
+from src.response_parser import SectionTokenizer, parse_analysis_response
+from src.scheduler import API, BATCH, INTERACTIVE, WHATSAPP, AnalysisScheduler, Overloaded
+from src.document_classifier import DocumentClassifier
+from src.job_queue import JobQueue, QueueFullError, ThreadPoolBackend
+from src.document_analyzer import FAST_PATH_RISK_NOTE, DocumentAnalyzer, _worker_pdf_engine
+from src.structured_logging import (
+    LoggingConfig, NonBlockingQueueHandler, configure_logging, correlation, current_correlation_id, log_stage,
+    stage_timings
+)
+from src.session_store import ConversationSession, InMemorySessionStore, SessionStore, SQLiteSessionStore
+from src.whatsapp_bot import WhatsAppBot, split_message
 from src.utils import allowed_file, setup_logging
 
+SAMPLE_ANALYSIS = """SUMMARY:
+A services agreement between parties A and B.
+KEY POINTS:
+- Term of two years
+- Monthly fee of $500
+RISKS & CONCERNS:
+- Broad indemnification clause
+RECOMMENDATIONS:
+- Negotiate a liability cap"""
+
+
+def use_fake_llm(analyzer, **kwargs):
+    """Route an analyzer's model calls to a FakeOpenAIClient and return the fake
+    
+    Model routing is switched off so the short test documents reach the model
+    instead of the local fast path (test_model_router covers routing).
+    """
+    fake = FakeOpenAIClient(**kwargs)
+    analyzer.client = LLMClient(client=fake)
+    analyzer.router = None
+    return fake
+
+class StubOpenAIServer:
+    """Local HTTP server speaking the chat completions API with scripted behaviours"""
+    
+    def __init__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        stub = self
+        self.requests = 0
+        self.script = []
+        self._lock = threading.Lock()
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_GET(self):
+                payload = json.dumps({'object': 'list', 'data': [
+                    {'id': 'gpt-3.5-turbo', 'object': 'model', 'created': 0, 'owned_by': 'stub'}
+                ]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    status, headers, delay = stub.script.pop(0) if stub.script else (200, {}, 0)
+                time.sleep(delay)
+                if status == 200:
+                    body = {
+                        'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': 0,
+                        'model': 'gpt-3.5-turbo',
+                        'choices': [{'index': 0, 'finish_reason': 'stop',
+                                     'message': {'role': 'assistant', 'content': SAMPLE_ANALYSIS}}],
+                        'usage': {'prompt_tokens': 50, 'completion_tokens': 40, 'total_tokens': 90}
+                    }
+                else:
+                    body = {'error': {'message': 'stub error', 'type': 'stub'}}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class StubTwilioServer:
+    """Local HTTP server accepting Twilio Messages API calls, with scripted failure statuses
+    
+    GET requests serve media registered in ``media`` as {path: (content_type, bytes)}.
+    """
+    
+    def __init__(self, delay=0.0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs
+        stub = self
+        self.delay = delay
+        self.requests = 0
+        self.messages = []
+        self.script = []
+        self.media = {}
+        self._lock = threading.Lock()
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_GET(self):
+                if self.path not in stub.media:
+                    self.send_error(404)
+                    return
+                content_type, payload = stub.media[self.path]
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+                time.sleep(stub.delay)
+                with stub._lock:
+                    stub.requests += 1
+                    status = stub.script.pop(0) if stub.script else 201
+                    if status == 201:
+                        stub.messages.append((form['To'][0], form['Body'][0]))
+                        body = {'sid': f'SM{stub.requests:032d}', 'status': 'queued'}
+                    else:
+                        body = {'code': 20000 + status, 'message': 'stub error', 'status': status}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def webhook_request(fields, url='http://localhost/webhook/whatsapp'):
+    """Request-like object for WhatsAppBot.handle_message, unsigned"""
+    return SimpleNamespace(form=fields, url=url, headers={})
+
+def twilio_signature(url, fields, auth_token='token'):
+    """X-Twilio-Signature value Twilio would send for a webhook call"""
+    from twilio.request_validator import RequestValidator
+    return RequestValidator(auth_token).compute_signature(url, fields)
+
+def asgi_call(application, method, path, body=b'', content_type=None, extra_headers=()):
+    """Send one HTTP request straight to an ASGI app and return (status, headers, body)"""
+    messages = []
+    pending = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    
+    async def receive():
+        if pending:
+            return pending.pop()
+        await asyncio.sleep(3600)
+    
+    async def send(message):
+        messages.append(message)
+    
+    headers = [(b'content-type', content_type.encode())] if content_type else []
+    headers += [(name.lower().encode(), value.encode()) for name, value in extra_headers]
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': headers,
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1)}
+    
+    async def call():
+        await application(scope, receive, send)
+        return (messages[0]['status'], dict(messages[0]['headers']),
+                b''.join(message.get('body', b'') for message in messages[1:]))
+    return call()
+
+def multipart_upload(filename, content):
+    """Multipart body and content type for a single 'file' upload"""
+    from werkzeug.datastructures import FileStorage
+    from werkzeug.test import encode_multipart
+    boundary, body = encode_multipart({'file': FileStorage(BytesIO(content), filename)})
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def parse_sse(body):
+    """Split a Server-Sent Events body into (event, data) pairs"""
+    events = []
+    for message in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+def make_pdf(page_texts):
+    """Build a minimal text PDF with one line of text per page"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+    
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+class FakeOpenAIClient:
+    """Minimal stand-in for the OpenAI client that counts completion calls"""
+    
+    def __init__(self, content=SAMPLE_ANALYSIS, delay=0.0):
+        self.calls = 0
+        self.content = content
+        self.delay = delay
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.last_request = kwargs
+        time.sleep(self.delay)
+        if kwargs.get('stream'):
+            return self._stream()
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+    
+    def _stream(self):
+        for start in range(0, len(self.content), 12):
+            delta = SimpleNamespace(content=self.content[start:start + 12])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
 def test_document_analyzer():
     """Test document analyzer functionality"""
     print("Testing DocumentAnalyzer...")
@@ -39,6 +307,1449 @@ def test_document_analyzer():
     
     print("DocumentAnalyzer tests passed!\n")
 
+def test_analysis_cache():
+    """Test analysis result caching"""
+    print("Testing AnalysisCache...")
+    
+    cache = AnalysisCache(max_entries=2)
+    cache.set('a', {'summary': 'A'})
+    cache.set('b', {'summary': 'B'})
+    assert cache.get('a')['summary'] == 'A', "Cached value not returned"
+    cache.set('c', {'summary': 'C'})
+    assert cache.get('b') is None, "Least recently used entry should be evicted"
+    assert cache.stats()['evictions'] == 1, "Eviction not counted"
+    print("✓ LRU eviction working")
+    
+    expired = AnalysisCache(ttl_seconds=-1)
+    expired.set('a', {'summary': 'A'})
+    assert expired.get('a') is None, "Expired entry should not be returned"
+    print("✓ TTL expiry working")
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, 'cache.db')
+        AnalysisCache(db_path=db_path).set('a', {'summary': 'A'})
+        reopened = AnalysisCache(db_path=db_path)
+        assert reopened.get('a')['summary'] == 'A', "Disk tier did not persist"
+        assert reopened.stats()['disk_hits'] == 1, "Disk hit not counted"
+        
+        tiny = AnalysisCache(db_path=os.path.join(tmpdir, 'tiny.db'), max_disk_bytes=40)
+        tiny.set('a', {'summary': 'A' * 10})
+        tiny.set('b', {'summary': 'B' * 10})
+        assert tiny.stats()['disk_entries'] == 1, "Disk tier exceeded its size limit"
+    print("✓ Disk tier persistence and size eviction working")
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer)
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+        f.write("This is a test contract agreement between parties A and B.")
+        test_file = f.name
+    
+    try:
+        first = analyzer.analyze_document(test_file)
+        second = analyzer.analyze_document(test_file)
+        assert first == second, "Cached analysis differs from original"
+        assert fake.calls == 1, "Repeat upload should not call the model"
+        assert analyzer.cache.stats()['hits'] == 1, "Cache hit not counted"
+        print("✓ Repeat upload served from cache")
+    finally:
+        os.unlink(test_file)
+    
+    print("AnalysisCache tests passed!\n")
+
+def test_chunked_analysis():
+    """Test map-reduce analysis of long documents"""
+    print("Testing chunked analysis...")
+    
+    clauses = [f"Section {i}. The tenant shall comply with obligation number {i} "
+               f"as described herein. " * 8 for i in range(1, 41)]
+    text = "\n\n".join(clauses)
+    chunks = split_into_chunks(text, 300)
+    assert len(chunks) > 1, "Long document should be split"
+    assert all(estimate_tokens(chunk) <= 300 for chunk in chunks), "Chunk exceeds token budget"
+    assert all(chunk.startswith("Section") for chunk in chunks), "Chunks should start on section boundaries"
+    assert "Section 40." in chunks[-1], "Text past the old 4000 character limit was lost"
+    print(f"✓ Split into {len(chunks)} section-aligned chunks")
+    
+    # Without tiktoken counts fall back to the estimate, with one warning
+    warnings = []
+    handler = logging.Handler()
+    handler.emit = warnings.append
+    saved = chunking.tiktoken, chunking._encoding
+    chunking.tiktoken, chunking._encoding = None, None
+    chunking.logger.addHandler(handler)
+    try:
+        assert count_tokens(text) == estimate_tokens(text) and count_tokens("a b c") == estimate_tokens("a b c")
+    finally:
+        chunking.logger.removeHandler(handler)
+        chunking.tiktoken, chunking._encoding = saved
+    assert [record.levelno for record in warnings] == [logging.WARNING], "Fallback should warn exactly once"
+    print("✓ Estimated token counts are reported once")
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer, delay=0.2)
+    analyzer.chunk_tokens = 300
+    analyzer.max_parallel_chunks = len(chunks)
+    analyzer.max_document_tokens = 10 ** 6
+    started = time.time()
+    result = analyzer._perform_legal_analysis(text)
+    elapsed = time.time() - started
+    assert fake.calls == len(chunks), "Every chunk should be analyzed"
+    assert elapsed < 0.2 * len(chunks) / 2, "Chunks should be analyzed concurrently"
+    assert result['chunks_analyzed'] == len(chunks), "Chunk count missing"
+    assert result['key_points'] == ['Term of two years', 'Monthly fee of $500'], "Key points not merged"
+    print(f"✓ {len(chunks)} chunks analyzed in {elapsed:.2f}s")
+    
+    fake = use_fake_llm(analyzer)
+    analyzer.max_document_tokens = 2 * (300 + analyzer.max_output_tokens + 200)
+    result = analyzer._perform_legal_analysis(text)
+    assert fake.calls == 2, "Token cap should limit analyzed chunks"
+    assert result['chunks_total'] == len(chunks), "Total chunk count missing"
+    print("✓ Per-document token cap enforced")
+    
+    print("Chunked analysis tests passed!\n")
+
+def test_prompt_compaction():
+    """Test boilerplate, whitespace and duplicate clause removal before prompting"""
+    print("Testing prompt compaction...")
+    
+    duties = ["deliver the Services", "maintain insurance", "keep records", "appoint a manager", "report monthly"]
+    pages = []
+    for number in range(1, 6):
+        pages.append('\n'.join([
+            "ACME Corp  -  Confidential",
+            f"{number}.1 The Contractor shall   {duties[number - 1]} as described in Schedule {number}.",
+            f"{number}.2 Payment is due within thirty days of a valid invoice, subject to termi-",
+            "nation rights.",
+            "(a) Standard notices are to be delivered in writing to the registered office.",
+            f"{number}.3 The Client may request changes to the {duties[-number]} obligation.",
+            f"Page {number} of 5"
+        ]))
+    text = PAGE_BREAK.join(pages)
+    compaction = PromptCompactor().compact(text)
+    assert "ACME Corp" not in compaction.text and "Page 3 of 5" not in compaction.text, "Boilerplate kept"
+    assert compaction.boilerplate_lines == 10, "Headers and footers should be counted"
+    assert "termination rights" in compaction.text and compaction.hyphenations == 5, "Hyphenation not joined"
+    assert "shall deliver" in compaction.text and "  " not in compaction.text, "Whitespace not normalized"
+    assert compaction.text.count("Standard notices") == 1 and compaction.duplicate_clauses == 4, "Duplicates kept"
+    assert all(f"{number}.1 The Contractor" in compaction.text and f"{number}.3 The Client" in compaction.text
+               for number in range(1, 6)), "Content was lost"
+    assert compaction.tokens_after < compaction.tokens_before * 0.8, "Too few tokens saved"
+    print(f"✓ Saved {compaction.tokens_saved} of {compaction.tokens_before} tokens")
+    
+    short = PromptCompactor().compact("Header\nThe Tenant shall pay rent.\f\nHeader\nThe Tenant shall keep the premises.")
+    assert short.text.startswith("Header"), "Two pages are too few to infer boilerplate"
+    
+    engine = PdfExtractionEngine(max_workers=1)
+    extracted = engine.extract(make_pdf(["First page", "Second page"])).text
+    assert extracted == f"First page{PAGE_BREAK}Second page", "Pages should be separated by PAGE_BREAK"
+    print("✓ PDF pages separated for boilerplate detection")
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer)
+    result = analyzer._perform_legal_analysis(text)
+    prompt = fake.last_request['messages'][-1]['content']
+    assert "ACME Corp" not in prompt and "Page 2 of 5" not in prompt, "Prompt should use compacted text"
+    assert result['prompt_compaction']['tokens_saved'] == compaction.tokens_saved, "Savings not reported"
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    analyzer.compactor = None
+    fake = use_fake_llm(analyzer)
+    result = analyzer._perform_legal_analysis(text)
+    assert result['prompt_compaction']['tokens_saved'] == 0, "Disabled compaction should save nothing"
+    print("✓ Analyses prompt with compacted text and report the savings")
+    
+    print("Prompt compaction tests passed!\n")
+
+def test_revision_analysis():
+    """Test that a revised document only sends its changed clauses to the model"""
+    print("Testing revision analysis...")
+    
+    subjects = ["fees", "deliverables", "insurance", "audits", "subcontracting", "warranties", "records",
+                "personnel", "security", "notices"]
+    clauses = [f"{number}. The Supplier shall meet its obligations on {subjects[number % 10]} under schedule "
+               f"{number}, within {number + 10} business days of a written request by the Customer, at no "
+               f"additional cost and in accordance with the service levels set out in annex {number}."
+               for number in range(1, 41)]
+    original = '\n'.join(clauses)
+    revised_clauses = list(clauses)
+    revised_clauses[16] = revised_clauses[16].replace("at no additional cost", "at the Customer's expense")
+    revised_clauses.insert(30, "30.1 The Customer may terminate this Agreement for convenience on ninety days notice.")
+    del revised_clauses[25]
+    revised = '\n'.join(revised_clauses)
+    original_analysis = """SUMMARY:
+A supply agreement under which the Supplier bears all costs.
+KEY POINTS:
+- Personnel obligations under schedule 17 come at no additional cost
+- Records under schedule 26 are kept for annex 26
+- Audits under schedule 33 are requested by the Customer"""
+    revision_analysis = """SUMMARY:
+A supply agreement the Customer may now terminate for convenience.
+KEY POINTS:
+- Personnel under schedule 17 are now at the Customer's expense
+- The Customer may terminate for convenience on ninety days notice"""
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer, content=original_analysis)
+    full = analyzer._perform_legal_analysis(original, cache_key='v1')
+    full_calls = fake.calls
+    assert full_calls > 1 and 'what_changed' not in full, "First version should be analyzed in full"
+    
+    fake = use_fake_llm(analyzer, content=revision_analysis)
+    result = analyzer._perform_legal_analysis(revised, cache_key='v2')
+    prompt = fake.last_request['messages'][-1]['content']
+    assert fake.calls == 1, "Only the changes should be sent"
+    assert "at the Customer's expense" in prompt and "terminate this Agreement for convenience" in prompt, \
+        "Changed clauses missing from the prompt"
+    assert "annex 5." not in prompt, "Unchanged clauses should not be sent"
+    assert count_tokens(prompt) < full['prompt_compaction']['tokens_after'] / 5, "Revision prompt too large"
+    changes = result['what_changed']
+    assert (changes['clauses_modified'], changes['clauses_added'], changes['clauses_removed']) == (1, 1, 1), \
+        "Clause diff wrong"
+    assert changes['clauses_unchanged'] == 38 and changes['summary'], "What changed section incomplete"
+    assert result['summary'] != full['summary'] and "terminate for convenience" in result['summary'], \
+        "Summary should describe the current version"
+    points = '\n'.join(result['key_points'])
+    assert "schedule 17 are now at the Customer's expense" in points, "Edited clause's finding should be new"
+    assert "no additional cost" not in points and "schedule 26" not in points, \
+        "Findings on edited or removed clauses should be dropped"
+    assert "Audits under schedule 33" in points, "Findings on unchanged clauses should be kept"
+    assert "schedule 26" not in result['full_analysis'], "Earlier full analysis should not be carried over"
+    print(f"✓ Revision analyzed with 1 model call instead of {full_calls}")
+    
+    fake = use_fake_llm(analyzer)
+    again = analyzer._perform_legal_analysis(revised.replace('\n', '\n\n'), cache_key='v2-resaved')
+    assert fake.calls == 0 and again['what_changed']['clauses_modified'] == 0, "Unchanged text needs no model call"
+    
+    rewritten = '\n'.join(clause.replace("The Supplier", "The Vendor") for clause in revised_clauses)
+    result = analyzer._perform_legal_analysis(rewritten, cache_key='v3')
+    assert fake.calls > 1 and 'what_changed' not in result, "Heavily revised documents should be analyzed in full"
+    print("✓ Unchanged uploads reuse the analysis and rewrites are analyzed in full")
+    
+    print("Revision analysis tests passed!\n")
+
+def test_near_duplicate_analysis():
+    """Test that a lightly edited copy of an analyzed template reuses its analysis"""
+    print("Testing near-duplicate analysis...")
+    
+    topics = ["confidential information", "permitted disclosures", "standard of care", "return of materials",
+              "term of the obligations", "remedies", "no licence", "no warranty", "assignment", "notices",
+              "governing law", "entire agreement", "severability", "counterparts", "publicity", "non-solicitation"]
+    
+    def nda(discloser, recipient, date):
+        clauses = [f"MUTUAL NON-DISCLOSURE AGREEMENT dated {date} between {discloser} (the Discloser) and "
+                   f"{recipient} (the Recipient), each acting through its authorised representatives."]
+        clauses += [f"{number}. {topic.capitalize()}: the Recipient shall comply with the provisions on {topic} "
+                    f"for as long as it holds any information received from the Discloser, and any dispute on "
+                    f"{topic} shall be resolved under the terms on {topic} agreed by the parties."
+                    for number, topic in enumerate(topics, 1)]
+        clauses.append(f"Signed for {discloser} and for {recipient} on {date} by their authorised signatories.")
+        return '\n'.join(clauses)
+    
+    unrelated = '\n'.join(
+        f"{number}. The Tenant shall pay rent of {number * 100} dollars monthly for unit {number}, keep the premises "
+        f"in good repair and allow the Landlord to inspect them on reasonable notice during business hours."
+        for number in range(1, 11))
+    first = nda("Acme Holdings Limited", "Jane Smith Consulting", "1 March 2024")
+    copy = nda("Globex Trading Corporation", "Northwind Advisory Partners", "15 June 2025")
+    first_signature, copy_signature = minhash_signature(first), minhash_signature(copy)
+    assert signature_similarity(first_signature, copy_signature) >= 0.8, "Template copies should be similar"
+    assert signature_similarity(first_signature, minhash_signature(unrelated)) < 0.3, "Unrelated texts too similar"
+    print("✓ MinHash signatures separate template copies from unrelated documents")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'near-duplicates.minhash')
+        analyzer = DocumentAnalyzer(cache=AnalysisCache(), clause_store=ClauseIndexStore(directory),
+                                    near_duplicates=NearDuplicateIndex(path))
+        # Only whole-document similarity should find the copy
+        analyzer.revisions = None
+        fake = use_fake_llm(analyzer, content="""SUMMARY:
+A mutual NDA between Acme Holdings Limited and Jane Smith Consulting.
+KEY POINTS:
+- Acme Holdings Limited is the Discloser
+- Remedies: disputes on remedies are resolved under the agreed terms""")
+        full = analyzer.analyze_text(first, first.encode('utf-8'))['analysis']
+        full_calls = fake.calls
+        assert 'what_changed' not in full and len(analyzer.near_duplicates) == 1, "First copy should be analyzed in full"
+        
+        fake = use_fake_llm(analyzer, content="""SUMMARY:
+A mutual NDA between Globex Trading Corporation and Northwind Advisory Partners.
+KEY POINTS:
+- Globex Trading Corporation is the Discloser""")
+        result = analyzer.analyze_text(copy, copy.encode('utf-8'))['analysis']
+        prompt = fake.last_request['messages'][-1]['content']
+        assert fake.calls == 1, "Only the differing clauses should be sent"
+        assert "Globex Trading Corporation" in prompt and "remedies" not in prompt, "Prompt should hold only the changes"
+        assert "Acme" not in prompt and "Jane Smith" not in prompt, "Prompt should not show the other document"
+        assert result['what_changed']['clauses_modified'] == 2, "Party and signature clauses should differ"
+        assert "Globex" in result['summary'] and "Northwind" in result['summary'], "Summary should name the new parties"
+        assert "Acme" not in json.dumps(result) and "Jane Smith" not in json.dumps(result), \
+            "The template document's parties should not leak into the copy's analysis"
+        assert any("Remedies" in point for point in result['key_points']), "Findings on shared clauses should be kept"
+        print(f"✓ Template copy analyzed with 1 model call instead of {full_calls}")
+        
+        planned_on = []
+        plan_analysis = analyzer._plan_analysis
+        def tracking_plan(*args):
+            planned_on.append(threading.current_thread())
+            return plan_analysis(*args)
+        async def complete(**request):
+            return analyzer.client.complete(**request)
+        analyzer._plan_analysis = tracking_plan
+        analyzer.async_client = SimpleNamespace(complete=complete)
+        fake = use_fake_llm(analyzer)
+        third = nda("Initech Software LLC", "Umbrella Research Partners", "2 July 2025")
+        result = asyncio.run(analyzer.analyze_text_async(third, third.encode('utf-8')))['analysis']
+        assert fake.calls == 1 and 'what_changed' in result, "Async analysis should reuse the template analysis"
+        assert planned_on == [planned_on[0]] and planned_on[0] is not threading.main_thread(), \
+            "Async planning should run off the event loop"
+        fourth = nda("Hooli Incorporated", "Pied Piper Holdings", "9 August 2025")
+        events = list(analyzer.stream_analysis(fourth.encode('utf-8'), 'nda.txt'))
+        assert events[-1][0] == 'complete' and 'what_changed' in events[-1][1]['analysis'], "Stream should reuse it"
+        assert len(planned_on) == 2, "Streaming fallback planned the analysis twice"
+        del analyzer._plan_analysis
+        analyzer.async_client = None
+        print("✓ Async analysis planned off the event loop; streaming plans once")
+        
+        reloaded = NearDuplicateIndex(path)
+        assert len(reloaded) == 4, "Index should be persisted"
+        key, document_id, similarity = reloaded.find(minhash_signature(copy))
+        assert document_id == hashlib.sha256(copy.encode('utf-8')).hexdigest() and similarity == 1.0, \
+            "Reloaded index should find the copy"
+        assert reloaded.find(minhash_signature(unrelated)) is None, "Unrelated documents should not match"
+        
+        fake = use_fake_llm(analyzer)
+        other = analyzer.analyze_text(unrelated, unrelated.encode('utf-8'))['analysis']
+        assert fake.calls >= 1 and 'what_changed' not in other, "Unrelated documents should be analyzed in full"
+        print("✓ Index is persisted, reloaded and ignores unrelated documents")
+    
+    print("Near-duplicate analysis tests passed!\n")
+
+def test_pdf_extraction_engine():
+    """Test page-parallel PDF extraction"""
+    print("Testing PdfExtractionEngine...")
+    
+    pages = [f"Page {i} of the master services agreement" for i in range(40)]
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(make_pdf(pages))
+        test_file = f.name
+    
+    engine = PdfExtractionEngine(max_workers=2, pages_per_task=4, parallel_min_pages=8)
+    try:
+        serial = PdfExtractionEngine(max_workers=1).extract(test_file)
+        parallel = engine.extract(test_file)
+        assert parallel.text == serial.text, "Parallel extraction changed the text"
+        assert [page.index for page in parallel.pages] == list(range(40)), "Pages out of order"
+        assert "Page 39" in parallel.text, "Last page missing"
+        assert len(parallel.page_timings) == 40, "Per-page timings missing"
+        print(f"✓ Extracted {parallel.pages_total} pages in {parallel.elapsed_ms:.0f} ms")
+        
+        limited = engine.extract(test_file, token_budget=30)
+        assert limited.truncated and len(limited.pages) < 40, "Token budget should stop extraction"
+        assert limited.text.startswith("Page 0"), "Early stop should keep leading pages"
+        print(f"✓ Stopped after {len(limited.pages)} pages at the token budget")
+        
+        analyzer = DocumentAnalyzer(cache=AnalysisCache(), pdf_engine=engine)
+        assert analyzer.extract_text(test_file) == serial.text, "Analyzer should use the engine"
+        print("✓ DocumentAnalyzer extracts PDFs through the engine")
+        
+        # With the default configuration (clause index on) analysis extraction still stops early
+        with tempfile.TemporaryDirectory() as index_dir:
+            os.environ['CLAUSE_INDEX_DIR'] = index_dir
+            try:
+                analyzer = DocumentAnalyzer(cache=AnalysisCache(), pdf_engine=engine)
+            finally:
+                del os.environ['CLAUSE_INDEX_DIR']
+            assert analyzer.clause_store is not None, "Clause index should be on by default"
+            analyzer.max_document_tokens = 30
+            use_fake_llm(analyzer)
+            with open(test_file, 'rb') as f:
+                pdf_bytes = f.read()
+            result = analyzer.analyze_document(pdf_bytes, 'long.pdf')
+            assert result['success'] and result['text_length'] < len(serial.text), "Extraction should stop early"
+            analyzer._index_pool.shutdown(wait=True)
+            index = analyzer.clause_store.get(result['document_id'])
+            clauses = [index.clause(clause_id) for clause_id in range(len(index))]
+            assert any("Page 39" in clause for clause in clauses), "Clause index should cover every page"
+        print("✓ Budgeted extraction for analysis; every page indexed in the background")
+    finally:
+        engine.shutdown()
+        os.unlink(test_file)
+    
+    print("PdfExtractionEngine tests passed!\n")
+
+def test_document_source():
+    """Test analyzing uploads from memory and spooled streams"""
+    print("Testing DocumentSource...")
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    content = b"This employment agreement is made between the employer and the employee."
+    
+    assert analyzer.extract_text(content, 'offer.txt') == content.decode(), "Bytes extraction failed"
+    assert analyzer.extract_text(memoryview(content), 'offer.txt') == content.decode(), "Memoryview extraction failed"
+    assert analyzer.extract_text(BytesIO(content), 'offer.txt') == content.decode(), "Stream extraction failed"
+    print("✓ Bytes, memoryview and stream inputs working")
+    
+    small = DocumentSource.from_stream(BytesIO(content), 'offer.txt', spool_threshold=1024)
+    assert small.path is None, "Small uploads should stay in memory"
+    
+    spooled = DocumentSource.from_stream(BytesIO(content), 'offer.txt', spool_threshold=16)
+    spooled_path = spooled.path
+    assert spooled_path and os.path.exists(spooled_path), "Large uploads should be spooled"
+    assert bytes(spooled.buffer) == content, "Spooled upload should be memory-mapped"
+    assert analyzer.extract_text(spooled) == content.decode(), "Spooled extraction failed"
+    spooled.close()
+    assert not os.path.exists(spooled_path), "Spooled file should be removed on close"
+    print("✓ Spooling above the threshold working")
+    
+    import docx
+    doc = docx.Document()
+    doc.add_paragraph("Mutual non-disclosure agreement")
+    doc.add_paragraph("Confidential information shall not be disclosed.")
+    docx_buffer = BytesIO()
+    doc.save(docx_buffer)
+    docx_text = analyzer.extract_text(docx_buffer.getvalue(), 'nda.docx')
+    assert docx_text == "Mutual non-disclosure agreement\nConfidential information shall not be disclosed.", \
+        "DOCX extraction from memory failed"
+    
+    pdf_text = analyzer.extract_text(make_pdf(["Lease of premises"]), 'lease.pdf')
+    assert "Lease of premises" in pdf_text, "PDF extraction from memory failed"
+    print("✓ DOCX and PDF parsed from memory")
+    
+    import app as webapp
+    client = webapp.app.test_client()
+    for body in (b"First contract agreement text.", b"Second lease agreement text."):
+        response = client.post('/api/analyze', data={'file': (BytesIO(body), 'contract.txt')})
+        assert response.get_json()['analysis']['text_length'] == len(body), "Upload analyzed the wrong file"
+    print("✓ Uploads analyzed without touching the upload folder")
+    
+    print("DocumentSource tests passed!\n")
+
+def test_docx_extraction():
+    """Test streaming DOCX extraction of tables, headers, footers and footnotes"""
+    print("Testing DOCX extraction...")
+    import docx
+    import zipfile
+    
+    doc = docx.Document()
+    doc.sections[0].header.paragraphs[0].text = "ACME Services Agreement - Draft 3"
+    doc.sections[0].footer.paragraphs[0].text = "Confidential"
+    doc.add_heading("1. FEES", level=2)
+    doc.add_paragraph("The Client shall pay the fees below.")
+    table = doc.add_table(rows=2, cols=3)
+    for cell, text in zip(table.rows[0].cells + table.rows[1].cells,
+                          ("Milestone", "Due", "Fee", "Design", "Month 1", "$5,000")):
+        cell.text = text
+    run = doc.add_paragraph("Fees exclude VAT.").add_run()
+    run.add_tab()
+    run.add_text("See note 1.")
+    doc.add_paragraph("Signed for the Client")
+    buffer = BytesIO()
+    doc.save(buffer)
+    
+    # python-docx cannot write footnotes, so add the part directly
+    footnotes = ('<w:footnotes xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                 '<w:footnote w:type="separator" w:id="-1"><w:p><w:r><w:separator/></w:r></w:p></w:footnote>'
+                 '<w:footnote w:id="1"><w:p><w:r><w:t>Rates are reviewed annually.</w:t></w:r></w:p></w:footnote>'
+                 '</w:footnotes>')
+    with zipfile.ZipFile(buffer, 'a') as package:
+        package.writestr('word/footnotes.xml', footnotes)
+    
+    analyzer = DocumentAnalyzer()
+    text = analyzer.extract_text(buffer.getvalue(), 'services.docx')
+    assert text.splitlines() == [
+        "ACME Services Agreement - Draft 3",
+        "1. FEES",
+        "The Client shall pay the fees below.",
+        "Milestone | Due | Fee",
+        "Design | Month 1 | $5,000",
+        "Fees exclude VAT.\tSee note 1.",
+        "Signed for the Client",
+        "Rates are reviewed annually.",
+        "Confidential"
+    ], f"Unexpected DOCX text: {text!r}"
+    print("✓ Tables, header, footer and footnotes extracted in order")
+    
+    from src.docx_extraction import iter_docx_lines
+    big = docx.Document()
+    for index in range(3000):
+        big.add_paragraph(f"{index}. The Supplier shall perform obligation {index} diligently.")
+    buffer = BytesIO()
+    big.save(buffer)
+    started = time.perf_counter()
+    legacy = [p.text for p in docx.Document(BytesIO(buffer.getvalue())).paragraphs]
+    legacy_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    lines = list(iter_docx_lines(BytesIO(buffer.getvalue())))
+    streaming_seconds = time.perf_counter() - started
+    assert lines == legacy, "Streaming extraction should match python-docx paragraphs"
+    print(f"✓ 3000 paragraphs in {streaming_seconds * 1000:.0f} ms (python-docx {legacy_seconds * 1000:.0f} ms)")
+    
+    print("DOCX extraction tests passed!\n")
+
+def test_streaming_analysis():
+    """Test the Server-Sent Events analysis endpoint"""
+    print("Testing streaming analysis...")
+    
+    import app as webapp
+    original_client = webapp.document_analyzer.client
+    use_fake_llm(webapp.document_analyzer)
+    try:
+        client = webapp.app.test_client()
+        response = client.post('/api/analyze/stream', data={
+            'file': (BytesIO(b"This services agreement is between parties A and B."), 'services.txt')
+        })
+        assert response.mimetype == 'text/event-stream', "Stream should be an event stream"
+        events = parse_sse(response.get_data(as_text=True))
+    finally:
+        webapp.document_analyzer.client = original_client
+    
+    names = [event for event, _ in events]
+    assert names[0] == 'extracted' and names[-1] == 'complete', "Unexpected event order"
+    assert names.index('section') < len(names) - 1 - names[::-1].index('token'), \
+        "Sections should be emitted while tokens are still streaming"
+    sections = {data['name']: data['value'] for event, data in events if event == 'section'}
+    assert sections['summary'] == 'A services agreement between parties A and B.', "Summary section wrong"
+    assert sections['key_points'] == ['Term of two years', 'Monthly fee of $500'], "Key points wrong"
+    assert set(sections) == {'summary', 'key_points', 'risks_concerns', 'recommendations'}, "Missing sections"
+    streamed = ''.join(data['text'] for event, data in events if event == 'token')
+    complete = events[-1][1]
+    assert complete['analysis']['analysis']['full_analysis'] == streamed, "Streamed text incomplete"
+    assert complete['filename'] == 'services.txt', "Filename missing"
+    print(f"✓ {len(events)} events streamed with sections ahead of completion")
+    
+    print("Streaming analysis tests passed!\n")
+
+def test_llm_client():
+    """Test retries, hedging and metrics against a local stub server"""
+    print("Testing LLMClient...")
+    
+    import asyncio
+    import openai
+    from src.llm_client import AsyncLLMClient
+    from src.rate_limit import TokenBucket
+    
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0 and bucket.reserve() == 0, "Burst capacity should be available"
+    assert 0.05 < bucket.reserve() <= 0.1, "Third request should wait for a refill"
+    print("✓ Token bucket rate limiting working")
+    
+    stub = StubOpenAIServer()
+    messages = [{'role': 'user', 'content': 'Analyze this lease.'}]
+    try:
+        llm = LLMClient(api_key='test', base_url=stub.base_url, max_retries=2)
+        stub.script = [(429, {'Retry-After': '0.05'}, 0), (503, {}, 0)]
+        response = llm.complete(messages)
+        assert response.choices[0].message.content == SAMPLE_ANALYSIS, "Wrong completion"
+        assert stub.requests == 3, "Transient failures should be retried"
+        metrics = llm.metrics.snapshot()
+        assert metrics['retries'] == 2 and metrics['prompt_tokens'] == 50, "Call metrics not recorded"
+        print("✓ Retries honor Retry-After and record metrics")
+        
+        stub.script = [(400, {}, 0)]
+        try:
+            llm.complete(messages)
+            raise AssertionError("Bad requests should not be retried")
+        except openai.BadRequestError:
+            pass
+        
+        hedging = LLMClient(api_key='test', base_url=stub.base_url, hedge_after=0.05)
+        hedging.token_bucket = TokenBucket(rate=1e-9, capacity=10000)
+        stub.script = [(200, {}, 1.0)]
+        started = time.time()
+        hedging.complete(messages)
+        assert time.time() - started < 0.5, "Hedged request should beat the slow primary"
+        assert hedging.metrics.snapshot()['hedged'] == 1, "Hedge not counted"
+        hedging._hedge_pool.shutdown(wait=True)
+        assert round(10000 - hedging.token_bucket._tokens) == 2 * 90, "Both hedged requests should use TPM tokens"
+        print("✓ Slow requests are hedged within the TPM limit")
+        
+        async def run_async():
+            client = AsyncLLMClient(api_key='test', base_url=stub.base_url, max_retries=1)
+            stub.script = [(429, {'Retry-After': '0'}, 0)]
+            try:
+                return await client.complete(messages)
+            finally:
+                await client.aclose()
+        
+        response = asyncio.run(run_async())
+        assert response.choices[0].message.content == SAMPLE_ANALYSIS, "Async completion failed"
+        print("✓ Async client working")
+        
+        llm.close()
+        hedging.close()
+    finally:
+        stub.close()
+    
+    print("LLMClient tests passed!\n")
+
+def test_batch_analysis():
+    """Test the batch analysis endpoint and worker fan-out"""
+    print("Testing batch analysis...")
+    
+    import zipfile
+    from src.batch_analyzer import BatchAnalyzer, BatchItem
+    
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('nda.txt', "This non-disclosure agreement protects confidential information.")
+        zf.writestr('copies/nda-copy.txt', "This non-disclosure agreement protects confidential information.")
+        zf.writestr('lease.txt', "This lease is between the landlord and the tenant.")
+        zf.writestr('tool.exe', b"MZ")
+    archive.seek(0)
+    
+    import app as webapp
+    client = webapp.app.test_client()
+    response = client.post('/api/analyze/batch', data={'files': [
+        (archive, 'dataroom.zip'),
+        (BytesIO(b"This employment agreement covers salary and duties."), 'offer.txt')
+    ]})
+    assert response.mimetype == 'application/x-ndjson', "Batch results should be NDJSON"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    summary = lines[-1]['summary']
+    assert summary == dict(summary, files=5, analyzed=3, duplicates=1, skipped=1, failed=0), "Wrong summary"
+    by_name = {line['filename']: line for line in lines[:-1]}
+    assert by_name['copies/nda-copy.txt']['duplicate_of'] == 'nda.txt', "Duplicate not detected"
+    assert by_name['tool.exe']['status'] == 'skipped', "Invalid member should be skipped"
+    assert by_name['offer.txt']['analysis']['success'] == True, "Plain upload not analyzed"
+    print("✓ ZIP members and files analyzed with duplicates reused")
+    
+    from src.batch_analyzer import iter_zip_items
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('big.txt', "Clause. " * 400_000)
+        zf.writestr('small.txt', "A short agreement.")
+    archive.seek(0)
+    items = {item.filename: item for item in iter_zip_items(archive, 10, 1024 * 1024)}
+    assert items['big.txt'].error == 'File too large', "Oversized member not rejected"
+    assert items['small.txt'].document.path is None, "Members should be read into memory, not spooled"
+    print("✓ ZIP members read into memory up to the file size limit")
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer, delay=0.2)
+    batch = BatchAnalyzer(analyzer, max_workers=4)
+    items = [BatchItem(f'doc{i}.txt', DocumentSource.from_bytes(f"Agreement number {i}.".encode(), f'doc{i}.txt'), None)
+             for i in range(8)]
+    started = time.time()
+    lines = list(batch.iter_results(items))
+    elapsed = time.time() - started
+    assert fake.calls == 8 and lines[-1]['summary']['analyzed'] == 8, "Every document should be analyzed"
+    assert elapsed < 8 * 0.2 / 2, "Batch should be analyzed concurrently"
+    print(f"✓ 8 documents analyzed in {elapsed:.2f}s with 4 workers")
+    
+    print("Batch analysis tests passed!\n")
+
+def test_response_parser():
+    """Test single-pass parsing of structured and sectioned replies"""
+    print("Testing response parser...")
+    
+    reply = """## 1. Summary:
+A **commercial lease** for office space.
+**KEY POINTS**
+- Rent of $2000/month
+- Risks of early termination are shared equally
+- Summary judgment clause applies
+RISKS & CONCERNS:
+1. Personal guarantee required
+Recommendations: Negotiate the guarantee"""
+    parsed = parse_analysis_response(reply)
+    assert parsed['summary'] == "A **commercial lease** for office space.", "Summary not parsed"
+    assert parsed['key_points'] == ['Rent of $2000/month', 'Risks of early termination are shared equally',
+                                    'Summary judgment clause applies'], "Key point containing 'Risks' ended the section"
+    assert parsed['risks_concerns'] == ['Personal guarantee required'], "Risks not parsed"
+    assert parsed['recommendations'] == ['Negotiate the guarantee'], "Inline recommendation not parsed"
+    print("✓ Sectioned replies parsed in one pass")
+    
+    tokenizer = SectionTokenizer()
+    completed = []
+    for start in range(0, len(reply), 7):
+        completed += tokenizer.feed(reply[start:start + 7])
+    completed += tokenizer.close()
+    assert completed == ['summary', 'key_points', 'risks_concerns', 'recommendations'], "Wrong section order"
+    assert tokenizer.result() == parsed, "Incremental parse differs from single pass"
+    print("✓ Incremental tokenizer matches single pass")
+    
+    structured = json.dumps({
+        'summary': 'A mutual NDA.',
+        'document_type': 'Non-Disclosure Agreement',
+        'key_points': ['Two year term', 'Mutual obligations'],
+        'risks_concerns': ['No carve-out for residuals'],
+        'recommendations': ['Add a residuals clause']
+    })
+    parsed = parse_analysis_response(f"```json\n{structured}\n```")
+    assert parsed['summary'] == 'A mutual NDA.' and parsed['key_points'] == ['Two year term', 'Mutual obligations'], \
+        "JSON reply not parsed"
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer, content=structured)
+    result = analyzer._perform_legal_analysis("This mutual non-disclosure agreement protects information.")
+    assert fake.last_request['response_format'] == {'type': 'json_object'}, "JSON mode not requested"
+    assert result['recommendations'] == ['Add a residuals clause'], "Structured reply not used"
+    assert result['full_analysis'].startswith('SUMMARY:\nA mutual NDA.'), "Structured reply not rendered"
+    print("✓ JSON-mode replies parsed into the result schema")
+    
+    print("Response parser tests passed!\n")
+
+def test_document_classifier():
+    """Test weighted single-pass document type classification"""
+    print("Testing DocumentClassifier...")
+    
+    classifier = DocumentClassifier()
+    assert classifier.classify("I am willing to proceed.").document_type == 'Legal Document', \
+        "'willing' matched 'will'"
+    lease = "This Lease Agreement is made between the Landlord and the Tenant. Rent is due monthly."
+    ranked = classifier.rank(lease)
+    assert ranked[0].document_type == 'Lease Agreement', "'agreement' outranked lease terms"
+    assert ranked[1].document_type == 'Contract/Agreement' and ranked[0].confidence > ranked[1].confidence, \
+        "Categories not ranked by score"
+    assert classifier.classify("MUTUAL NON-DISCLOSURE AGREEMENT\nThe Receiving  Party shall").document_type == \
+        'Non-Disclosure Agreement', "NDA not detected"
+    assert classifier.classify("Last Will and Testament of the testator").document_type == 'Will/Testament', \
+        "Will not detected"
+    print("✓ Word-boundary matching and weighted ranking working")
+    
+    custom = DocumentClassifier(lexicon={'Power of Attorney': {'attorney-in-fact': 3, 'principal': 1}})
+    result = custom.classify("The principal appoints an attorney-in-fact.")
+    assert result.document_type == 'Power of Attorney' and result.confidence == 1.0, "Custom lexicon not used"
+    print("✓ Custom lexicon working")
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer)
+    result = analyzer._perform_legal_analysis(lease)
+    prompt = fake.last_request['messages'][1]['content']
+    assert 'Lease Agreement' in prompt and '"document_type"' not in prompt, "Detected type not used in prompt"
+    assert result['document_type'] == 'Lease Agreement' and result['document_type_confidence'] > 0.6, \
+        "Classification missing from result"
+    print("✓ Confident classification skips model classification")
+    
+    print("DocumentClassifier tests passed!\n")
+
+def wait_for_job(client, job_id, timeout=5):
+    """Poll the job status API until the job finishes"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = client.get(f'/api/jobs/{job_id}').get_json()
+        if data['status'] in ('completed', 'failed'):
+            return data
+        time.sleep(0.01)
+    raise AssertionError("Job did not finish in time")
+
+def test_job_queue():
+    """Test asynchronous analysis jobs"""
+    print("Testing JobQueue...")
+    
+    release = threading.Event()
+    queue = JobQueue(backend=ThreadPoolBackend(max_workers=1), max_depth=1)
+    job = queue.submit(lambda: release.wait(5) and 'done')
+    try:
+        queue.submit(lambda: None)
+        raise AssertionError("Full queue should reject new jobs")
+    except QueueFullError:
+        pass
+    release.set()
+    queue.shutdown()
+    assert job.status == 'completed' and job.result == 'done', "Job did not complete"
+    assert 'run_ms' in job.to_dict()['timing'], "Job timing missing"
+    print("✓ Backpressure and job timing working")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'jobs.db')
+        worker_a = JobQueue(backend=ThreadPoolBackend(max_workers=1), db_path=db_path)
+        worker_b = JobQueue(backend=ThreadPoolBackend(max_workers=1), db_path=db_path)
+        job = worker_a.submit(lambda: {'summary': 'ok'}, metadata={'filename': 'a.txt'})
+        worker_a.shutdown()
+        shared = worker_b.get(job.id)
+        assert shared is not None and shared.to_dict()['result'] == {'summary': 'ok'}, \
+            "Job status not visible to another worker"
+        assert shared.to_dict()['filename'] == 'a.txt' and worker_b.get('missing') is None
+        worker_b.shutdown()
+    print("✓ Job status shared between worker processes through SQLite")
+    
+    import app as webapp
+    client = webapp.app.test_client()
+    response = client.post('/api/analyze?async=1', data={
+        'file': (BytesIO(b"This lease agreement is between a landlord and a tenant."), 'lease.txt')
+    })
+    assert response.status_code == 202, "Async analysis should be accepted"
+    job_id = response.get_json()['job_id']
+    data = wait_for_job(client, job_id)
+    assert data['status'] == 'completed', "Async job failed"
+    assert data['result']['success'] == True, "Async analysis failed"
+    assert data['filename'] == 'lease.txt', "Job metadata missing"
+    assert client.get('/api/jobs/unknown').status_code == 404, "Unknown job should 404"
+    print("✓ Async API and job status endpoint working")
+    
+    print("JobQueue tests passed!\n")
+
+def test_scheduler():
+    """Test admission control and weighted priority scheduling"""
+    print("Testing AnalysisScheduler...")
+    
+    # Per-client buckets refuse a client over its rate with 429, independently of other clients
+    scheduler = AnalysisScheduler(max_in_flight=1, client_rpm={API: 2})
+    scheduler.admit(API, 'a')
+    scheduler.admit(API, 'a')
+    scheduler.admit(API, 'b')
+    try:
+        scheduler.admit(API, 'a')
+        raise AssertionError("Client over its rate should be refused")
+    except Overloaded as e:
+        assert e.status == 429 and e.retry_after > 0 and int(e.retry_after_header) >= 1
+    print("✓ Per-client rate limits working")
+    
+    # Freed slots go to interactive waiters before batch ones that queued earlier
+    order = []
+    slot = scheduler.acquire(INTERACTIVE)
+    
+    def wait_for_slot(traffic_class):
+        with scheduler.acquire(traffic_class, timeout=5):
+            order.append(traffic_class)
+    
+    waiters = []
+    for traffic_class in [BATCH] * 3 + [INTERACTIVE] * 3:
+        waiters.append(threading.Thread(target=wait_for_slot, args=(traffic_class,)))
+        waiters[-1].start()
+        while scheduler.stats()['queued'] < len(waiters):
+            time.sleep(0.001)
+    time.sleep(0.01)
+    stats = scheduler.stats()
+    assert stats['in_flight'] == 1 and stats['classes'][BATCH]['queued'] == 3
+    assert stats['classes'][BATCH]['oldest_wait_seconds'] > 0
+    slot.release()
+    slot.release()
+    for waiter in waiters:
+        waiter.join(5)
+    assert order == [INTERACTIVE] * 3 + [BATCH] * 3, order
+    assert scheduler.stats()['in_flight'] == 0
+    print("✓ Weighted priority queues working")
+    
+    # Saturated: a full queue or a long wait is refused fast with 503
+    scheduler = AnalysisScheduler(max_in_flight=1, max_queue=1, max_wait=0.05)
+    slot = scheduler.acquire(API)
+    started = time.perf_counter()
+    try:
+        scheduler.acquire(API)
+        raise AssertionError("Waiting past max_wait should be refused")
+    except Overloaded as e:
+        assert e.status == 503 and e.retry_after > 0
+    assert time.perf_counter() - started < 1
+    
+    async def hold_queue():
+        waiting = asyncio.ensure_future(scheduler.acquire_async(BATCH, timeout=None))
+        while not scheduler.stats()['queued']:
+            await asyncio.sleep(0.001)
+        try:
+            scheduler.acquire(API)
+            raise AssertionError("A full queue should be refused")
+        except Overloaded as e:
+            assert e.status == 503
+        threading.Timer(0.02, slot.release).start()
+        return await waiting
+    
+    with asyncio.run(hold_queue()):
+        assert scheduler.stats()['in_flight'] == 1
+    assert scheduler.stats()['in_flight'] == 0
+    assert scheduler.stats()['classes'][API]['rejected'] == 2
+    print("✓ Load shedding and async waiting working")
+    
+    # Endpoints answer 429/503 with Retry-After instead of timing out
+    import app as webapp
+    original = webapp.scheduler
+    client = webapp.app.test_client()
+    upload = lambda: {'file': (BytesIO(b"This lease agreement is between a landlord and a tenant."), 'lease.txt')}
+    try:
+        webapp.scheduler = AnalysisScheduler(max_in_flight=1, max_queue=0, client_rpm={API: 1})
+        assert client.post('/api/analyze', data=upload()).status_code == 200
+        response = client.post('/api/analyze', data=upload())
+        assert response.status_code == 429 and int(response.headers['Retry-After']) >= 1
+        assert response.get_json()['retry_after'] >= 1
+        
+        webapp.scheduler = AnalysisScheduler(max_in_flight=1, max_queue=0)
+        with webapp.scheduler.acquire(INTERACTIVE):
+            response = client.post('/api/analyze', data=upload())
+            assert response.status_code == 503 and 'Retry-After' in response.headers
+            response = client.post('/upload', data=upload())
+            assert response.status_code == 503 and b'try again' in response.data
+            assert client.post('/api/analyze/stream', data=upload()).status_code == 503
+        response = client.post('/api/analyze/stream', data=upload())
+        assert b'event: complete' in response.data
+        response.close()
+        assert webapp.scheduler.stats()['in_flight'] == 0, "Stream should release its slot"
+        assert 'jollybot_scheduler_queue_depth{traffic_class="batch"} 0' in client.get('/metrics').get_data(as_text=True)
+    finally:
+        webapp.scheduler = original
+    print("✓ Fast 429/503 responses with Retry-After")
+    
+    # WhatsApp senders are rate limited per number and told to slow down
+    twilio = SimpleNamespace(messages=SimpleNamespace(create=lambda body, from_, to: SimpleNamespace(sid='SM1')))
+    bot = WhatsAppBot(client=twilio, scheduler=AnalysisScheduler(client_rpm={WHATSAPP: 1}))
+    message = webhook_request({'From': 'whatsapp:+15550000009', 'Body': 'status'})
+    assert '<Message>' not in bot.handle_message(message)
+    assert "faster than I can keep up" in bot.handle_message(message)
+    bot.shutdown()
+    print("✓ WhatsApp per-number limits working")
+    
+    print("AnalysisScheduler tests passed!\n")
+
+def test_session_store():
+    """Test per-conversation sessions and follow-up questions"""
+    print("Testing session store...")
+    
+    text = "\n\n".join([
+        "1. TERM. This lease runs for twelve months from the commencement date.",
+        "2. RENT. Rent of $1,500 is payable on the first day of each month.",
+        "3. TERMINATION. Either party may terminate with sixty days written notice.",
+        "4. PETS. No pets are allowed on the premises without consent."
+    ] + [f"{index}. MISCELLANEOUS. Boilerplate provision number {index}." for index in range(5, 40)])
+    session = ConversationSession.from_text('lease.txt', text, {'summary': 'A lease.'}, clause_tokens=20)
+    excerpts = session.relevant_clauses("What's the termination notice period?", k=1)
+    assert len(excerpts) == 1 and 'sixty days' in excerpts[0], "Wrong clause retrieved"
+    assert isinstance(session.index, ClauseIndex), "Sessions should search a clause index"
+    print(f"✓ Relevant clause found among {len(session.clauses)}")
+    
+    store = InMemorySessionStore(ttl_seconds=60, max_bytes=session.size * 2 + 10)
+    for number in ('a', 'b', 'c'):
+        store.set(number, session)
+    assert store.get('a') is None and store.get('c') is not None, "Byte budget not enforced LRU-first"
+    assert store.stats()['bytes'] == session.size * 2, "Store should charge each session its tracked size"
+    try:
+        SessionStore()
+        raise AssertionError("SessionStore is abstract")
+    except TypeError:
+        pass
+    store.ttl_seconds = 0
+    time.sleep(0.01)
+    assert store.get('c') is None, "Expired session returned"
+    print("✓ TTL and memory-bounded eviction working")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'sessions.db')
+        SQLiteSessionStore(db_path).set('whatsapp:+1', session)
+        restored = SQLiteSessionStore(db_path).get('whatsapp:+1')
+        assert restored.clauses == session.clauses and restored.relevant_clauses('pets allowed', 1) == \
+            session.relevant_clauses('pets allowed', 1), "SQLite session not restored"
+    print("✓ SQLite backend persists sessions")
+    
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer, content="Sixty days written notice.")
+    sent = []
+    twilio = SimpleNamespace(messages=SimpleNamespace(
+        create=lambda body, from_, to: sent.append((to, body)) or SimpleNamespace(sid='SM1')))
+    bot = WhatsAppBot(client=twilio, analyzer=analyzer, sessions=InMemorySessionStore())
+    bot.sessions.set('whatsapp:+1', session)
+    bot._process_message('whatsapp:+1', "What's the termination notice period?")
+    prompt = fake.last_request['messages'][1]['content']
+    assert sent[-1] == ('whatsapp:+1', "Sixty days written notice."), "Answer not sent"
+    assert 'sixty days' in prompt and 'Boilerplate provision' not in prompt, "Whole document sent to the model"
+    assert len(prompt) < len(text) / 2, "Question prompt not compact"
+    bot._process_message('whatsapp:+1', 'status')
+    assert 'Status' in sent[-1][1], "Commands should still work during a session"
+    bot._process_message('whatsapp:+1', 'reset')
+    assert bot.sessions.get('whatsapp:+1') is None, "Reset did not clear the session"
+    bot.shutdown()
+    print(f"✓ Follow-up answered from {len(prompt)} prompt chars instead of {len(text)}")
+    
+    print("Session store tests passed!\n")
+
+def test_clause_index():
+    """Test clause segmentation, BM25 retrieval, persistence and the ask endpoint"""
+    print("Testing clause index...")
+    
+    filler = ["rent", "premises", "tenant", "landlord", "payment", "repairs", "insurance", "utilities"]
+    clauses = [f"{page}.{number} The {filler[(page + number) % 8]} obligations of the parties under this "
+               f"provision apply to the {filler[(page * number) % 8]} and continue for the full term."
+               for page in range(1, 301) for number in range(1, 4)]
+    clauses.insert(450, "451.1 FORCE MAJEURE. Neither party is liable for delay caused by earthquake, "
+                        "flood, pandemic or war.")
+    text = '\n\n'.join(clauses)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ClauseIndexStore(tmp)
+        doc_hash = hashlib.sha256(text.encode()).hexdigest()
+        store.ensure(doc_hash, text)
+        index = store.get(doc_hash)
+        assert len(index) == len(clauses), "Clauses not segmented on numbered provisions"
+        
+        started = time.perf_counter()
+        matches = index.search("What happens if a pandemic delays performance?", k=3)
+        elapsed = time.perf_counter() - started
+        assert 'FORCE MAJEURE' in index.clause(matches[0][0]), "Wrong clause ranked first"
+        assert elapsed < 1.0, f"Retrieval took {elapsed:.3f}s"
+        assert ClauseIndex.build(text).search("pandemic earthquake", 2) == index.search("pandemic earthquake", 2), \
+            "Memory-mapped index differs from in-memory index"
+        print(f"✓ {len(index)} clauses searched in {elapsed * 1000:.1f}ms from a memory-mapped index")
+        
+        import app as webapp
+        original_store = webapp.document_analyzer.clause_store
+        original_client = webapp.document_analyzer.client
+        fake = use_fake_llm(webapp.document_analyzer, content="Neither party is liable for pandemic delays.")
+        webapp.document_analyzer.clause_store = store
+        try:
+            client = webapp.app.test_client()
+            response = client.post('/api/analyze', data={
+                'file': (BytesIO(text.encode()), 'lease.txt')
+            })
+            document_id = response.get_json()['analysis']['document_id']
+            assert document_id == doc_hash, "Analysis did not return the document id"
+            
+            response = client.post(f'/api/documents/{document_id}/ask',
+                                   json={'question': 'Does a pandemic excuse delay?', 'k': 3})
+            body = response.get_json()
+            prompt = fake.last_request['messages'][1]['content']
+            assert response.status_code == 200 and body['answer'].startswith("Neither party"), "Question not answered"
+            assert 'FORCE MAJEURE' in prompt and len(prompt) < 4096 < len(text), "Prompt not limited to top clauses"
+            assert body['context_chars'] < 2048, "Too much context sent"
+            print(f"✓ Ask endpoint sent {body['context_chars']} chars of {len(text)} to the model")
+            
+            assert client.post('/api/documents/' + '0' * 64 + '/ask', json={'question': 'x'}).status_code == 404, \
+                "Unknown document should 404"
+            assert client.post('/api/documents/not-a-hash/ask', json={'question': 'x'}).status_code == 400, \
+                "Invalid document id should be rejected"
+        finally:
+            webapp.document_analyzer.clause_store = original_store
+            webapp.document_analyzer.client = original_client
+        
+        assert os.stat(tmp).st_mode & 0o777 == 0o700, "Index directory should be private"
+        size = os.path.getsize(store.path_for(doc_hash))
+        small = ClauseIndexStore(tmp, max_bytes=size * 2)
+        others = [hashlib.sha256(str(n).encode()).hexdigest() for n in range(2)]
+        os.utime(small.path_for(doc_hash), (time.time() - 60, time.time() - 60))
+        small.ensure(others[0], text)
+        small.ensure(others[1], text)
+        assert doc_hash not in small and others[1] in small, "Least recently used index not evicted"
+        os.utime(small.path_for(others[1]), (0, 0))
+        expiring = ClauseIndexStore(tmp, ttl_seconds=3600)
+        assert expiring.get(others[1]) is None and others[1] not in expiring, "Expired index still served"
+        expiring.ensure(others[0], text)
+        os.utime(expiring.path_for(others[0]), (0, 0))
+        expiring.ensure(others[0], text)
+        assert expiring.get(others[0]) is not None, "Re-analyzed document's index should be refreshed"
+        print("✓ Clause indexes kept private and evicted by age and size")
+    
+    print("Clause index tests passed!\n")
+
+def test_structured_logging():
+    """Test queued JSON logging, correlation ids, sampling and redaction"""
+    print("Testing structured logging...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_file = os.path.join(temp_dir, 'app.log')
+        test_logger = logging.getLogger('jollybot.test.structured')
+        test_logger.propagate = False
+        listener = configure_logging(LoggingConfig(console_format='none', file=log_file, max_bytes=400,
+                                                   backup_count=3, sample_rate=0.25), root=test_logger)
+        try:
+            with correlation('req-42'):
+                with log_stage('extraction'):
+                    time.sleep(0.01)
+                test_logger.info("Message from %s", 'whatsapp:+15551234567',
+                                 extra={'text': 'confidential clause', 'stages': stage_timings()})
+            for index in range(8):
+                test_logger.info("Sampled event %s", index, extra={'sample': True})
+            test_logger.warning("Never sampled", extra={'sample': True})
+        finally:
+            listener.stop()
+            for handler in list(test_logger.handlers):
+                test_logger.removeHandler(handler)
+        
+        assert os.path.exists(log_file + '.1'), "Log file should have rotated"
+        records = []
+        for name in (log_file + '.3', log_file + '.2', log_file + '.1', log_file):
+            if os.path.exists(name):
+                with open(name, encoding='utf-8') as f:
+                    records += [json.loads(line) for line in f]
+    
+    first = records[0]
+    assert first['correlation_id'] == 'req-42' and first['level'] == 'INFO'
+    assert first['message'] == 'Message from whatsapp:+*******4567', first['message']
+    assert first['text'] == '<redacted: 19 chars>' and first['stages_ms']['extraction'] >= 10
+    sampled = [record['message'] for record in records if record['message'].startswith('Sampled')]
+    assert sampled == ['Sampled event 0', 'Sampled event 4'], sampled
+    assert records[-1]['message'] == 'Never sampled' and records[-1]['correlation_id'] is None
+    print("✓ JSON records with correlation, stages, redaction, sampling and rotation")
+    
+    # A full queue drops records instead of blocking the caller
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    dropped = LOG_RECORDS_DROPPED._default().value
+    handler.handle(logging.makeLogRecord({'msg': 'kept'}))
+    handler.handle(logging.makeLogRecord({'msg': 'dropped'}))
+    assert LOG_RECORDS_DROPPED._default().value == dropped + 1
+    print("✓ Full log queue never blocks")
+    
+    # Requests echo a safe X-Request-ID; jobs and dispatched tasks carry their own or their caller's id
+    import app as webapp
+    client = webapp.app.test_client()
+    assert client.get('/health', headers={'X-Request-ID': 'abc-123'}).headers['X-Request-ID'] == 'abc-123'
+    generated = client.get('/health', headers={'X-Request-ID': 'bad id; x=1'}).headers['X-Request-ID']
+    assert generated != 'bad id; x=1' and len(generated) == 16
+    
+    jobs = JobQueue(backend=ThreadPoolBackend(max_workers=1))
+    job = jobs.submit(current_correlation_id)
+    while not job.done:
+        time.sleep(0.01)
+    assert job.result == job.id
+    jobs.shutdown()
+    
+    dispatcher = MessageDispatcher(max_workers=1)
+    seen = []
+    with correlation('webhook-7'):
+        dispatcher.submit('+15550000001', lambda: seen.append(current_correlation_id()))
+    dispatcher.join(5)
+    dispatcher.shutdown()
+    assert seen == ['webhook-7']
+    print("✓ Correlation ids propagate to responses, jobs and dispatched tasks")
+
+def test_metrics():
+    """Test metric exposition, pipeline instrumentation and dependency readiness"""
+    print("Testing metrics...")
+    
+    registry = Registry()
+    latency = Histogram('test_latency_seconds', 'Test latency', ['route'], buckets=(0.1, 1), registry=registry)
+    errors = Counter('test_errors_total', 'Test errors', registry=registry)
+    in_flight = Gauge('test_in_flight', 'Test in flight', registry=registry)
+    latency.labels(route='/a').observe(0.05)
+    latency.labels(route='/a').observe(0.5)
+    errors.inc()
+    with in_flight.track_inprogress():
+        assert 'test_in_flight 1' in registry.render(), "Gauge not raised while in progress"
+    exposition = registry.render()
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in exposition, "Bucket counts wrong"
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 2' in exposition, "+Inf bucket wrong"
+    assert 'test_latency_seconds_count{route="/a"} 2' in exposition and 'test_errors_total 1' in exposition, \
+        "Count or counter missing"
+    assert 'test_in_flight 0' in exposition, "Gauge not lowered"
+    print("✓ Prometheus text exposition working")
+    
+    import app as webapp
+    client = webapp.app.test_client()
+    client.post('/api/analyze', data={'file': (BytesIO(b"This employment agreement sets the salary."), 'offer.txt')})
+    response = client.get('/metrics')
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200 and response.content_type.startswith('text/plain'), "Metrics not served"
+    for sample in ('jollybot_extraction_seconds_count{format="txt"}', 'jollybot_upload_size_bytes_count',
+                   'jollybot_mock_fallbacks_total{reason="no_client"}', 'jollybot_analysis_seconds_count',
+                   'jollybot_request_seconds_count{endpoint="api_analyze",method="POST",status="200"}',
+                   'jollybot_in_flight_requests 1', 'jollybot_job_queue_pending'):
+        assert sample in body, f"{sample} missing from /metrics"
+    print("✓ Pipeline timings, fallbacks and in-flight gauges exported")
+    
+    stub = StubOpenAIServer()
+    original_client = webapp.document_analyzer.client
+    webapp.health_checker.ttl_seconds = 0
+    try:
+        webapp.document_analyzer.client = LLMClient(api_key='test-key', base_url=stub.base_url, max_retries=0)
+        report = client.get('/health').get_json()
+        assert report['status'] == 'healthy' and report['dependencies']['openai']['status'] == 'up', \
+            "Reachable OpenAI not reported up"
+        assert report['dependencies']['twilio']['status'] == 'disabled', "Unconfigured Twilio should be disabled"
+        
+        stub.close()
+        response = client.get('/health')
+        report = response.get_json()
+        assert response.status_code == 200 and report['status'] == 'degraded', "Unreachable OpenAI not reported"
+        assert report['dependencies']['openai']['status'] == 'down', "OpenAI should be down"
+        print("✓ Health reports real dependency readiness")
+    finally:
+        webapp.document_analyzer.client.close()
+        webapp.document_analyzer.client = original_client
+        webapp.health_checker.ttl_seconds = 30
+    
+    print("Metrics tests passed!\n")
+
+def test_benchmark_suite():
+    """Test benchmark fixtures, the fake model server and baseline comparison"""
+    print("Testing benchmark suite...")
+    from benchmarks.fake_openai import FakeOpenAIServer
+    from benchmarks.fixtures import generate_corpus
+    from benchmarks.run import compare, run
+    
+    analyzer = DocumentAnalyzer()
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = generate_corpus(directory, ['small'])
+        assert sorted(fixtures) == ['small.docx', 'small.pdf', 'small.txt'], "Fixture set incomplete"
+        for name, path in fixtures.items():
+            assert "MASTER SERVICES AGREEMENT" in analyzer.extract_text(path), f"{name} fixture not readable"
+        print("✓ Fixture corpus generated")
+        
+        results = run(['parsing'], ['small'], directory, iterations=1, isolate=False)
+    parsing = results['results']['parsing']
+    assert {'json_small', 'sections_large'} <= set(parsing), "Response shapes missing"
+    assert all(case['p95_ms'] >= case['p50_ms'] > 0 and case['peak_rss_mb'] > 0 for case in parsing.values()), \
+        "Percentiles or RSS missing"
+    json.dumps(results)
+    print("✓ Stage results emitted as JSON")
+    
+    baseline = json.loads(json.dumps(results))
+    baseline['results']['parsing']['json_small']['p50_ms'] = parsing['json_small']['p50_ms'] / 2
+    baseline['results']['parsing']['json_large']['throughput_per_s'] = parsing['json_large']['throughput_per_s'] * 2
+    regressions = {(item['case'], item['metric']) for item in compare(results, baseline, tolerance=0.2)}
+    assert regressions == {('json_small', 'p50_ms'), ('json_large', 'throughput_per_s')}, \
+        f"Unexpected regressions: {regressions}"
+    print("✓ Baseline comparison flags regressions")
+    
+    with FakeOpenAIServer(latency_ms=50) as fake:
+        client = LLMClient(api_key='test-key', base_url=fake.base_url)
+        started = time.perf_counter()
+        reply = client.complete([{'role': 'user', 'content': 'Analyze'}], max_tokens=50)
+        assert time.perf_counter() - started >= 0.05 and fake.requests == 1, "Fake latency not applied"
+        assert '"summary"' in reply.choices[0].message.content, "Fake reply missing"
+        client.close()
+    print("✓ Fake OpenAI server with configurable latency")
+    
+    print("Benchmark suite tests passed!\n")
+
+def test_asgi_app():
+    """Test the asyncio serving mode against the same services as the Flask app"""
+    print("Testing ASGI mode...")
+    import app as webapp
+    from asgi import AsgiApp
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    
+    stub = StubOpenAIServer()
+    twilio = StubTwilioServer()
+    analyzer = webapp.document_analyzer
+    original_client, original_bot = analyzer.async_client, webapp.whatsapp_bot
+    application = AsgiApp(webapp.app, extraction_processes=0)
+    
+    async def scenario():
+        status, headers, body = await asgi_call(application, 'GET', '/')
+        assert status == 200 and b'<form' in body, "Pages should be served by the Flask app"
+        print("✓ Non-native routes fall back to the WSGI app")
+        
+        # Thirty analyses each waiting 0.3s on the model must overlap on one event loop
+        analyzer.async_client = AsyncLLMClient(api_key='test-key', base_url=stub.base_url, max_connections=50)
+        stub.script = [(200, {}, 0.3)] * 30
+        uploads = [multipart_upload(f'nda-{index}.txt', f"Confidentiality agreement number {index}.".encode())
+                   for index in range(30)]
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(asgi_call(application, 'POST', '/api/analyze', body, content_type)
+                                           for body, content_type in uploads))
+        elapsed = time.perf_counter() - started
+        results = [json.loads(body) for _, _, body in responses]
+        assert all(status == 200 for status, _, _ in responses), "Async analysis failed"
+        assert all(result['analysis']['analysis']['summary'].startswith("A services agreement") for result in results), \
+            "Model reply not used"
+        assert elapsed < 3, f"Analyses did not overlap ({elapsed:.2f}s for 30 x 0.3s)"
+        print(f"✓ 30 concurrent analyses in {elapsed:.2f}s on one event loop")
+        
+        document_id = results[0]['analysis']['document_id']
+        status, _, body = await asgi_call(application, 'POST', f'/api/documents/{document_id}/ask',
+                                          json.dumps({'question': 'Which confidentiality agreement?'}).encode(),
+                                          'application/json')
+        answer = json.loads(body)
+        assert status == 200 and answer['clauses'] and answer['answer'], "Async document question failed"
+        status, _, _ = await asgi_call(application, 'POST', '/api/documents/not-a-hash/ask',
+                                       b'{"question": "x"}', 'application/json')
+        assert status == 400, "Shared validation should reject bad ids"
+        print("✓ Document questions answered with an awaited model call")
+        
+        bot = WhatsAppBot()
+        webapp.whatsapp_bot = bot
+        signature = twilio_signature('http://testserver/webhook/whatsapp',
+                                     {'From': 'whatsapp:+15550000009', 'Body': 'status'})
+        status, _, body = await asgi_call(application, 'POST', '/webhook/whatsapp',
+                                          b'From=whatsapp%3A%2B15550000009&Body=status',
+                                          'application/x-www-form-urlencoded',
+                                          [('X-Twilio-Signature', signature)])
+        assert status == 200 and b'<Message>' not in body, "Webhook should acknowledge immediately"
+        assert await bot.async_dispatcher.join(timeout=5), "Async replies did not finish"
+        assert twilio.messages == [('whatsapp:+15550000009', bot._reply_for('status'))], "Reply not sent via async Twilio"
+        print("✓ WhatsApp replies sent with the async Twilio client")
+        
+        status, _, body = await asgi_call(application, 'GET', '/metrics')
+        assert status == 200 and b'jollybot_request_seconds_count{endpoint="api_analyze"' in body, "Metrics missing"
+        
+        analyzer.process_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+        text = await analyzer.extract_text_async(make_pdf(["Lease of premises"]), 'lease.pdf')
+        assert "Lease of premises" in text, "Process pool extraction failed"
+        pages = [f"Clause {n} of the lease" for n in range(20)]
+        text = await analyzer.extract_text_async(make_pdf(pages), 'long.pdf')
+        assert "Clause 19" in text and _worker_pdf_engine.max_workers == 1, \
+            "Pool workers should extract long PDFs serially"
+        print("✓ Extraction offloaded to a process pool")
+    
+    credentials = {'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32, 'TWILIO_AUTH_TOKEN': 'token',
+                   'TWILIO_API_BASE_URL': twilio.base_url}
+    saved = {name: os.environ.get(name) for name in credentials}
+    os.environ.update(credentials)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(scenario())
+        loop.run_until_complete(webapp.whatsapp_bot.shutdown_async())
+        loop.run_until_complete(analyzer.async_client.aclose())
+    finally:
+        loop.close()
+        if analyzer.process_pool is not None:
+            analyzer.process_pool.shutdown()
+            analyzer.process_pool = None
+        analyzer.async_client = original_client
+        webapp.whatsapp_bot.shutdown(wait=False)
+        webapp.whatsapp_bot = original_bot
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        stub.close()
+        twilio.close()
+    
+    print("ASGI mode tests passed!\n")
+
+def test_startup():
+    """Test settings parsing, the app factory and lazy SDK imports"""
+    print("Testing startup...")
+    from benchmarks.startup import run_child
+    from src.preload import preload_modules
+    from src.settings import Settings, configure, get_settings
+    import gc
+    import app as webapp
+    
+    # Settings are parsed once; allowed_file reads them instead of the environment
+    settings = configure(Settings(max_file_size_mb=2, allowed_extensions={'PDF', ' .txt', ''}))
+    assert settings.allowed_extensions == {'pdf', 'txt'}
+    assert settings.max_file_size_bytes == 2 * 1024 * 1024
+    os.environ['ALLOWED_EXTENSIONS'] = 'exe'
+    try:
+        assert allowed_file("test.pdf") and not allowed_file("test.docx") and not allowed_file("test.exe")
+        assert get_settings() is settings
+    finally:
+        del os.environ['ALLOWED_EXTENSIONS']
+        configure()
+    assert allowed_file("test.docx")
+    print("✓ Settings parsed once")
+    
+    # The factory builds a fresh app and services with every route under its usual endpoint
+    services = ('app', 'document_analyzer', 'whatsapp_bot', 'job_queue', 'batch_analyzer', 'health_checker')
+    originals = {name: getattr(webapp, name) for name in services}
+    try:
+        flask_app = webapp.create_app(Settings(max_file_size_mb=1))
+        assert flask_app is not originals['app'] and webapp.document_analyzer is not originals['document_analyzer']
+        assert flask_app.config['MAX_CONTENT_LENGTH'] == 1024 * 1024
+        endpoints = {rule.endpoint for rule in flask_app.url_map.iter_rules()}
+        assert {'index', 'api_analyze', 'api_job_status', 'health_check', 'metrics'} <= endpoints
+        response = flask_app.test_client().get('/health')
+        assert response.status_code == 200 and response.get_json()['service'] == 'JollyLLBot'
+    finally:
+        webapp.job_queue.shutdown(wait=False)
+        configure()
+        for name, service in originals.items():
+            setattr(webapp, name, service)
+    print("✓ App factory working")
+    
+    # SDKs load on first use, not when the app is imported
+    report = run_child(['cold'])
+    assert report['lazy_modules_loaded'] == [], report
+    os.environ.update({'TWILIO_ACCOUNT_SID': 'ACtest', 'TWILIO_AUTH_TOKEN': 'secret'})
+    try:
+        bot = WhatsAppBot()
+    finally:
+        del os.environ['TWILIO_ACCOUNT_SID'], os.environ['TWILIO_AUTH_TOKEN']
+    assert not bot._client_ready
+    assert bot.client is not None and bot.client is bot.client
+    print(f"✓ Cold import in {report['import_ms']:.0f}ms without loading the SDKs")
+    
+    timings = preload_modules(('src.settings', 'jollybot_missing_module'))
+    gc.unfreeze()
+    assert list(timings) == ['src.settings']
+    print("✓ Preload working")
+    
+    print("Startup tests passed!\n")
+
+def test_model_router():
+    """Test local document scoring and model routing"""
+    print("Testing ModelRouter...")
+    
+    router = ModelRouter(default_routes(), {
+        'small': ModelTier('small', 'small-model', 0.0005, 0.0015),
+        'standard': ModelTier('standard', 'standard-model', 0.0005, 0.0015),
+        'large': ModelTier('large', 'large-model', 0.01, 0.03)
+    })
+    plain = '\n'.join(f"{index}. The parties will meet on the first day of month {index} to review progress."
+                     for index in range(1, 11))
+    risky = '\n'.join(f"{index}. The Tenant shall indemnify the Landlord against all liability, and any breach "
+                     f"lets the Landlord terminate and forfeit the deposit of unit {index}." for index in range(1, 400))
+    assert router.route("Please sign and return.", 'General Legal Document', 0.0).fast_path
+    assert router.route("Tenant may terminate early.", 'General Legal Document', 0.0).route.name == 'short'
+    decision = router.route(plain, 'Contract/Agreement', 0.8)
+    assert (decision.route.name, decision.model, decision.max_output_tokens) == ('short', 'small-model', 500)
+    decision = router.route(risky, 'Lease Agreement', 0.9)
+    assert decision.route.name == 'complex' and decision.model == 'large-model' and decision.template == 'detailed'
+    assert decision.profile.risk_density > 50 and decision.scoring_ms < 1000
+    print("✓ Documents routed by size, clauses and risk density")
+    
+    # Routed analyses use the tier's model, output budget and template, and log their cost
+    analyzer = DocumentAnalyzer(cache=AnalysisCache())
+    fake = use_fake_llm(analyzer)
+    analyzer.router = router
+    result = analyzer.analyze_text(plain)['analysis']
+    assert fake.last_request['model'] == 'small-model' and fake.last_request['max_tokens'] == 500
+    assert TEMPLATES['brief'] in fake.last_request['messages'][1]['content']
+    assert result['routing']['route'] == 'short' and result['routing']['profile']['clauses'] == 10
+    
+    calls = fake.calls
+    result = analyzer.analyze_text("Please sign the attached form and return it by Friday.")['analysis']
+    assert fake.calls == calls, "Trivial documents should not call the model"
+    assert result['routing']['route'] == FAST_PATH and result['routing']['model'] is None
+    assert result['summary'].startswith('Short') and result['key_points']
+    assert result['risks_concerns'] == [FAST_PATH_RISK_NOTE], "Fast path should say risks were not reviewed"
+    
+    summary = router.log.summary()
+    assert summary['overall']['analyses'] == 2 and summary['overall']['model_calls'] == 1
+    
+    # Only the exact cache is under test here, not reuse of earlier versions
+    analyzer.revisions = analyzer.near_duplicates = None
+    calls = fake.calls
+    analyzer.analyze_text(plain)
+    assert fake.calls == calls, "Same document and routing table should hit the cache"
+    router.tiers['small'] = ModelTier('small', 'other-small-model')
+    analyzer.analyze_text(plain)
+    router.tiers['small'] = ModelTier('small', 'small-model', 0.0005, 0.0015)
+    assert fake.calls == calls + 1 and fake.last_request['model'] == 'other-small-model', \
+        "Result cached for another tier model was reused"
+    assert summary['routes']['short']['cost_usd'] > 0 and summary['routes'][FAST_PATH]['cost_usd'] == 0
+    print("✓ Routed analyses and fast path working")
+    
+    # Routing table and tier models come from configuration
+    with tempfile.TemporaryDirectory() as temp_dir:
+        table = os.path.join(temp_dir, 'routes.json')
+        with open(table, 'w') as f:
+            json.dump({
+                'tiers': {'mini': {'model': 'mini-model', 'prompt_cost': 0.0001}},
+                'routes': [{'name': 'tiny', 'tier': 'mini', 'max_output_tokens': 200, 'template': 'brief',
+                            'max_tokens': 2000},
+                           {'name': 'rest', 'tier': 'large'}]
+            }, f)
+        saved = {name: os.environ.get(name) for name in ('ROUTER_TABLE', 'ROUTER_MODELS', 'ROUTER_LOG_PATH')}
+        os.environ.update({'ROUTER_TABLE': table, 'ROUTER_MODELS': 'large=big-model',
+                           'ROUTER_LOG_PATH': os.path.join(temp_dir, 'routing.jsonl')})
+        try:
+            configured = ModelRouter.from_env('default-model')
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        assert configured.route(plain, 'Contract/Agreement', 0.8).model == 'mini-model'
+        decision = configured.route(risky, 'Lease Agreement', 0.9)
+        assert decision.route.name == 'rest' and decision.model == 'big-model'
+        configured.log.record(decision, 0.5, 'ok')
+        configured.log.close()
+        with open(os.path.join(temp_dir, 'routing.jsonl')) as f:
+            assert json.loads(f.readline())['route'] == 'rest'
+    print("✓ Configurable routing table working")
+    
+    import app as webapp
+    original = webapp.document_analyzer.router
+    webapp.document_analyzer.router = router
+    try:
+        report = webapp.app.test_client().get('/api/routing').get_json()
+    finally:
+        webapp.document_analyzer.router = original
+    assert report['enabled'] and report['table'][0]['name'] == FAST_PATH
+    assert report['routes']['short']['analyses'] == 2 and report['overall']['p50_latency_ms'] >= 0
+    print("✓ Routing report endpoint working")
+
 def test_whatsapp_bot():
     """Test WhatsApp bot functionality"""
     print("Testing WhatsAppBot...")
@@ -58,6 +1769,106 @@ def test_whatsapp_bot():
     assert "Status" in status, "Status message missing status info"
     print("✓ Status message generated")
     
+    inline = bot.handle_message(webhook_request({'From': 'whatsapp:+15550000001', 'Body': 'Hello'}))
+    assert "Welcome to JollyLLBot" in inline, "Mock mode should reply inline"
+    
+    import app as webapp
+    stub = StubTwilioServer(delay=0.05)
+    credentials = {'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32, 'TWILIO_AUTH_TOKEN': 'token',
+                   'TWILIO_API_BASE_URL': stub.base_url}
+    os.environ.update(credentials)
+    original_bot = webapp.whatsapp_bot
+    try:
+        bot = WhatsAppBot()
+        bot.backoff_base = 0.01
+        webapp.whatsapp_bot = bot
+        client = webapp.app.test_client()
+        
+        def post(fields):
+            signature = twilio_signature('http://localhost/webhook/whatsapp', fields)
+            return client.post('/webhook/whatsapp', data=fields, headers={'X-Twilio-Signature': signature})
+        
+        forged = {'From': 'whatsapp:+15550000001', 'Body': 'hello'}
+        assert client.post('/webhook/whatsapp', data=forged).status_code == 403, "Unsigned webhook accepted"
+        response = client.post('/webhook/whatsapp', data=forged, headers={'X-Twilio-Signature': 'bm90IHNpZ25lZA=='})
+        assert response.status_code == 403, "Badly signed webhook accepted"
+        
+        bodies = ['hello', 'status', 'analyze', 'xyz', 'hi']
+        latencies = []
+        for body in bodies:
+            started = time.perf_counter()
+            response = post({'From': 'whatsapp:+15550000001', 'Body': body})
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200 and '<Message>' not in response.get_data(as_text=True), \
+                "Webhook should acknowledge with empty TwiML"
+        post({'From': 'whatsapp:+15550000002', 'Body': 'status'})
+        assert max(latencies) < 0.1, f"Webhook blocked for {max(latencies):.3f}s"
+        assert bot.dispatcher.join(timeout=5), "Dispatcher did not drain"
+        
+        first = [body for to, body in stub.messages if to == 'whatsapp:+15550000001']
+        expected = [bot._reply_for(body) for body in bodies]
+        assert first == expected, "Replies to one number were reordered"
+        assert len(stub.messages) == 6, "Reply to second number missing"
+        print(f"✓ Webhook acknowledged in {max(latencies) * 1000:.1f}ms; replies delivered in order")
+        
+        stub.script = [503, 429]
+        assert bot.send_message('whatsapp:+15550000003', 'retry me') == True, "Transient failures not retried"
+        stub.script = [400]
+        requests_before = stub.requests
+        assert bot.send_message('whatsapp:+15550000003', 'bad request') == False, "Client error should fail"
+        assert stub.requests == requests_before + 1, "Client errors should not be retried"
+        print("✓ Outbound retry with backoff working")
+        
+        analyzer = DocumentAnalyzer(cache=AnalysisCache())
+        fake = use_fake_llm(analyzer)
+        bot.analyzer = analyzer
+        lease = b"This Lease Agreement is made between the Landlord and the Tenant. Rent is due monthly."
+        stub.media['/media/lease'] = ('text/plain; charset=utf-8', lease)
+        stub.media['/media/lease-copy'] = ('text/plain', lease)
+        stub.messages.clear()
+        media_message = {'From': 'whatsapp:+15550000004', 'NumMedia': '1',
+                         'MediaUrl0': stub.base_url + '/media/lease', 'MediaContentType0': 'text/plain'}
+        post(media_message)
+        assert bot.dispatcher.join(timeout=5), "Media analysis did not finish"
+        replies = [body for to, body in stub.messages]
+        assert replies[0].startswith("⏳"), "No acknowledgement before analysis"
+        assert "📑 Type: Lease Agreement" in replies[1] and "Negotiate a liability cap" in replies[1], \
+            "Condensed analysis not sent"
+        
+        stub.messages.clear()
+        extracted = []
+        analyzer.extract_text = lambda *args: extracted.append(args)
+        post(dict(media_message, MediaUrl0=stub.base_url + '/media/lease-copy'))
+        assert bot.dispatcher.join(timeout=5), "Repeat media did not finish"
+        del analyzer.extract_text
+        assert fake.calls == 1 and [body for to, body in stub.messages] == replies[1:], \
+            "Re-forwarded document was analyzed again"
+        assert extracted == [], "Re-forwarded document's text was extracted again"
+        assert bot.sessions.get('whatsapp:+15550000004').relevant_clauses("rent"), "Session clauses not restored"
+        print("✓ WhatsApp media analyzed and repeats answered from the content hash")
+        
+        stub.messages.clear()
+        post(dict(media_message, MediaUrl0='http://169.254.169.254/latest/meta-data'))
+        assert bot.dispatcher.join(timeout=5), "Untrusted media did not finish"
+        assert "couldn't download" in stub.messages[0][1] and fake.calls == 1, "Untrusted media URL was fetched"
+        try:
+            DocumentSource.from_stream(_LimitedReader(BytesIO(b'x' * 4096), 1000), 'big.txt', spool_threshold=100)
+            raise AssertionError("Oversized media without Content-Length was read to the end")
+        except MediaTooLargeError:
+            pass
+        print("✓ Unsigned webhooks rejected; media only fetched from Twilio and cut off at the size limit")
+        
+        parts = split_message('\n'.join(f"• Point {index}: " + 'x' * 90 for index in range(40)))
+        assert len(parts) > 1 and all(len(part) <= 1600 for part in parts), "Reply not split for WhatsApp"
+        assert parts[0].startswith(f"(1/{len(parts)})"), "Split parts not numbered"
+        print("✓ Long replies split within WhatsApp limits")
+        bot.shutdown()
+    finally:
+        webapp.whatsapp_bot = original_bot
+        for name in credentials:
+            os.environ.pop(name, None)
+        stub.close()
+    
     print("WhatsAppBot tests passed!\n")
 
 def test_utils():
@@ -86,7 +1897,30 @@ def main():
     try:
         test_utils()
         test_document_analyzer()
+        test_analysis_cache()
+        test_chunked_analysis()
+        test_prompt_compaction()
+        test_revision_analysis()
+        test_near_duplicate_analysis()
+        test_pdf_extraction_engine()
+        test_document_source()
+        test_docx_extraction()
+        test_streaming_analysis()
+        test_llm_client()
+        test_batch_analysis()
+        test_response_parser()
+        test_document_classifier()
+        test_job_queue()
+        test_scheduler()
+        test_model_router()
         test_whatsapp_bot()
+        test_session_store()
+        test_clause_index()
+        test_metrics()
+        test_structured_logging()
+        test_benchmark_suite()
+        test_asgi_app()
+        test_startup()
         
         print("=" * 50)
         print("All tests passed! ✅")